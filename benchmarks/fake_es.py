@@ -0,0 +1,852 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import re
+import json
+import time
+import uuid
+import random
+import threading
+import collections
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlparse, parse_qs, unquote
+
+
+# Module API
+
+class FakeElasticsearch(object):
+    """In-process Elasticsearch stand-in.
+
+    Implements the subset of the REST API used by `Storage` (index, alias,
+    mapping, settings, bulk, search/PIT, mget, reindex and task endpoints)
+    on top of in-memory dicts, with configurable latency and bulk rejections.
+
+    # Arguments
+        latency (float): seconds to sleep before answering each request
+        reject_rate (float): probability of rejecting a bulk item with a 429
+        version (str): version number reported by the root endpoint
+        supports_pit (bool): whether point in time searches are available
+        supports_shard_doc (bool): whether searches can be sorted by `_shard_doc`
+
+    """
+
+    # Public
+
+    def __init__(self, latency=0.0, reject_rate=0.0, version='8.17.0',
+                 supports_pit=True, supports_shard_doc=True, seed=None):
+        self.latency = latency
+        self.supports_pit = supports_pit
+        self.supports_shard_doc = supports_shard_doc
+        self.reject_rate = reject_rate
+        self.version = version
+        self.requests = collections.Counter()
+        self.__random = random.Random(seed)
+        self.__lock = threading.RLock()
+        self.__indices = collections.OrderedDict()
+        self.__pits = {}
+        self.__scrolls = {}
+        self.__tasks = {}
+        self.__seq = 0
+        self.__server = None
+        self.__thread = None
+
+    @property
+    def url(self):
+        host, port = self.__server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        handler = _make_handler(self)
+        self.__server = _Server(('127.0.0.1', 0), handler)
+        self.__thread = threading.Thread(target=self.__server.serve_forever)
+        self.__thread.daemon = True
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def handle(self, method, path, params, body):
+        """Dispatch a request and return a `(status, payload)` tuple.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        parts = [unquote(part) for part in path.strip('/').split('/') if part]
+        with self.__lock:
+            for pattern, methods, name in _ROUTES:
+                match = pattern.match('/' + '/'.join(parts))
+                if match and method in methods:
+                    self.requests[name] += 1
+                    handler = getattr(self, '_' + name)
+                    return handler(method, params, body, **match.groupdict())
+        return _error(400, 'unsupported', '{} {}'.format(method, path))
+
+    # Index helpers
+
+    def _resolve(self, expression, allow_missing=False):
+        names = []
+        for part in expression.split(','):
+            if part in ('_all', '*'):
+                names.extend(self.__indices.keys())
+            elif '*' in part:
+                regex = re.compile('^' + re.escape(part).replace('\\*', '.*') + '$')
+                names.extend(n for n in self.__indices if regex.match(n))
+            elif part in self.__indices:
+                names.append(part)
+            else:
+                aliased = [n for n, i in self.__indices.items() if part in i['aliases']]
+                if not aliased and not allow_missing:
+                    raise _NotFound(part)
+                names.extend(aliased)
+        return list(collections.OrderedDict.fromkeys(names))
+
+    def _write_index(self, expression):
+        names = self._resolve(expression)
+        if len(names) != 1:
+            raise _BadRequest('illegal_argument_exception',
+                              'no write index is defined for alias [{}]'.format(expression))
+        return names[0]
+
+    def _next_seq(self):
+        self.__seq += 1
+        return self.__seq
+
+    # Endpoints
+
+    def _info(self, method, params, body):
+        return 200, {'name': 'fake', 'cluster_name': 'fake',
+                     'version': {'number': self.version},
+                     'tagline': 'You Know, for Search'}
+
+    def _create_index(self, method, params, body, index):
+        if index in self.__indices:
+            return _error(400, 'resource_already_exists_exception', index)
+        body = body or {}
+        settings = {'index.number_of_shards': '1', 'index.number_of_replicas': '1'}
+        settings.update(_flatten(body.get('settings') or {}, 'index'))
+        self.__indices[index] = {
+            'docs': collections.OrderedDict(),
+            'mappings': body.get('mappings') or {'properties': {}},
+            'settings': settings,
+            'aliases': dict(body.get('aliases') or {}),
+        }
+        return 200, {'acknowledged': True, 'index': index}
+
+    def _delete_index(self, method, params, body, index):
+        try:
+            names = self._resolve(index)
+        except _NotFound as exception:
+            return exception.response()
+        for name in names:
+            del self.__indices[name]
+        return 200, {'acknowledged': True}
+
+    def _exists_index(self, method, params, body, index):
+        try:
+            self._resolve(index)
+        except _NotFound:
+            return 404, None
+        return 200, None
+
+    def _get_alias(self, method, params, body, index='_all', name='*'):
+        try:
+            names = self._resolve(index)
+        except _NotFound as exception:
+            return exception.response()
+        regex = re.compile('^' + '|'.join(
+            re.escape(n).replace('\\*', '.*') for n in name.split(',')) + '$')
+        result = {}
+        for index_name in names:
+            aliases = dict((a, v) for a, v in self.__indices[index_name]['aliases'].items()
+                           if regex.match(a))
+            if aliases or name == '*':
+                result[index_name] = {'aliases': aliases}
+        if not result and name != '*':
+            return (404, {'error': 'alias [{}] missing'.format(name), 'status': 404}) \
+                if method == 'GET' else (404, None)
+        return (200, result) if method == 'GET' else (200, None)
+
+    def _put_alias(self, method, params, body, index, name):
+        try:
+            names = self._resolve(index)
+        except _NotFound as exception:
+            return exception.response()
+        for index_name in names:
+            self.__indices[index_name]['aliases'][name] = body or {}
+        return 200, {'acknowledged': True}
+
+    def _update_aliases(self, method, params, body):
+        actions = body.get('actions', [])
+        for action in actions:
+            for verb, spec in action.items():
+                indices = spec.get('indices') or [spec['index']]
+                for index_name in indices:
+                    if index_name not in self.__indices:
+                        return _NotFound(index_name).response()
+        for action in actions:
+            for verb, spec in action.items():
+                indices = spec.get('indices') or [spec['index']]
+                for index_name in indices:
+                    aliases = self.__indices[index_name]['aliases']
+                    if verb == 'add':
+                        aliases[spec['alias']] = {}
+                    elif verb == 'remove':
+                        aliases.pop(spec['alias'], None)
+                    elif verb == 'remove_index':
+                        del self.__indices[index_name]
+        return 200, {'acknowledged': True}
+
+    def _get_mapping(self, method, params, body, index):
+        try:
+            names = self._resolve(index)
+        except _NotFound as exception:
+            return exception.response()
+        return 200, dict((n, {'mappings': self.__indices[n]['mappings']}) for n in names)
+
+    def _put_mapping(self, method, params, body, index):
+        try:
+            names = self._resolve(index)
+        except _NotFound as exception:
+            return exception.response()
+        for name in names:
+            current = self.__indices[name]['mappings']
+            try:
+                _check_mapping(current.get('properties', {}), body.get('properties', {}))
+            except _BadRequest as exception:
+                return exception.response()
+        for name in names:
+            current = self.__indices[name]['mappings']
+            _merge_mapping(current.setdefault('properties', {}), body.get('properties', {}))
+            for key, value in body.items():
+                if key != 'properties':
+                    current[key] = value
+        return 200, {'acknowledged': True}
+
+    def _get_settings(self, method, params, body, index):
+        try:
+            names = self._resolve(index)
+        except _NotFound as exception:
+            return exception.response()
+        patterns = [re.compile('^' + re.escape(n).replace('\\*', '.*') + '$')
+                    for n in params.get('name', '*').split(',')]
+        result = {}
+        for name in names:
+            settings = dict((k, v) for k, v in self.__indices[name]['settings'].items()
+                            if any(p.match(k) for p in patterns))
+            if params.get('flat_settings') != 'true':
+                settings = _unflatten(settings)
+            result[name] = {'settings': settings}
+        return 200, result
+
+    def _get_settings_named(self, method, params, body, index, name):
+        return self._get_settings(method, dict(params, name=name), body, index)
+
+    def _put_settings(self, method, params, body, index):
+        try:
+            names = self._resolve(index)
+        except _NotFound as exception:
+            return exception.response()
+        for name in names:
+            settings = self.__indices[name]['settings']
+            for key, value in _flatten(body, 'index'):
+                if value is None:
+                    settings.pop(key, None)
+                else:
+                    settings[key] = value
+        return 200, {'acknowledged': True}
+
+    def _flush(self, method, params, body, index='_all'):
+        try:
+            self._resolve(index)
+        except _NotFound as exception:
+            return exception.response()
+        return 200, {'_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+
+    _refresh = _flush
+
+    def _bulk(self, method, params, body, index=None):
+        items = []
+        errors = False
+        lines = iter(body)
+        for header in lines:
+            (op_type, meta), = header.items()
+            source = next(lines) if op_type != 'delete' else None
+            target = meta.get('_index', index)
+            item = {'_index': target, '_id': meta.get('_id')}
+            try:
+                name = self._write_index(target)
+                item['_index'] = name
+                if self.reject_rate and self.__random.random() < self.reject_rate:
+                    raise _BadRequest('es_rejected_execution_exception',
+                                      'rejected execution of coordinating operation',
+                                      status=429)
+                item.update(self._apply(name, op_type, meta, source))
+            except (_NotFound, _BadRequest) as exception:
+                errors = True
+                item.update({'status': exception.status, 'error': exception.error()})
+            items.append({op_type: item})
+        return 200, {'took': 1, 'errors': errors, 'items': items}
+
+    def _apply(self, name, op_type, meta, source):
+        docs = self.__indices[name]['docs']
+        doc_id = meta.get('_id') or uuid.uuid4().hex
+        existing = docs.get(doc_id)
+        if op_type in ('index', 'create'):
+            if op_type == 'create' and existing is not None:
+                raise _BadRequest('version_conflict_engine_exception',
+                                  'document already exists', status=409)
+            result = 'updated' if existing else 'created'
+            docs[doc_id] = _Doc(self._next_seq(), source, meta.get('routing'))
+        elif op_type == 'update':
+            if existing is None:
+                if source.get('doc_as_upsert'):
+                    document = source.get('doc')
+                elif 'upsert' in source:
+                    document = source['upsert']
+                else:
+                    raise _NotFound(doc_id, 'document_missing_exception')
+                docs[doc_id] = _Doc(self._next_seq(), document, meta.get('routing'))
+                result = 'created'
+            else:
+                merged = dict(existing.source)
+                merged.update(source.get('doc') or {})
+                if merged == existing.source and source.get('detect_noop', True):
+                    result = 'noop'
+                else:
+                    existing.source = merged
+                    result = 'updated'
+        elif op_type == 'delete':
+            if docs.pop(doc_id, None) is None:
+                return {'_id': doc_id, 'result': 'not_found', 'status': 404}
+            result = 'deleted'
+        else:
+            raise _BadRequest('illegal_argument_exception', op_type)
+        status = 201 if result == 'created' else 200
+        return {'_id': doc_id, 'result': result, 'status': status}
+
+    def _open_pit(self, method, params, body, index):
+        if not self.supports_pit:
+            return _error(400, 'invalid_type_name_exception', '_pit')
+        try:
+            names = self._resolve(index)
+        except _NotFound as exception:
+            return exception.response()
+        pit_id = uuid.uuid4().hex
+        snapshot = []
+        routings = set(params['routing'].split(',')) if 'routing' in params else None
+        for name in names:
+            for doc_id, doc in self.__indices[name]['docs'].items():
+                if routings is None or doc.routing is None or doc.routing in routings:
+                    snapshot.append((name, doc_id, doc.copy()))
+        self.__pits[pit_id] = snapshot
+        return 200, {'id': pit_id}
+
+    def _close_pit(self, method, params, body):
+        found = self.__pits.pop(body.get('id'), None) is not None
+        return (200 if found else 404), {'succeeded': found, 'num_freed': int(found)}
+
+    def _search(self, method, params, body, index=None):
+        body = dict(body or {})
+        for key in ('size', 'from'):
+            if key in params:
+                body[key] = int(params[key])
+        if 'routing' in params:
+            body.setdefault('_routing', params['routing'])
+        if 'pit' in body:
+            snapshot = self.__pits.get(body['pit']['id'])
+            if snapshot is None:
+                return _error(404, 'search_context_missing_exception', body['pit']['id'])
+            candidates = snapshot
+        else:
+            try:
+                names = self._resolve(index or '_all')
+            except _NotFound as exception:
+                return exception.response()
+            candidates = [(n, i, d) for n in names
+                          for i, d in self.__indices[n]['docs'].items()]
+        if '_routing' in body:
+            routings = set(str(body['_routing']).split(','))
+            candidates = [c for c in candidates
+                          if c[2].routing is None or c[2].routing in routings]
+        if 'slice' in body:
+            slice_id, slice_max = body['slice']['id'], body['slice']['max']
+            candidates = [c for c in candidates
+                          if _stable_hash(c[1]) % slice_max == slice_id]
+        query = body.get('query') or {'match_all': {}}
+        try:
+            hits = [c for c in candidates if _matches(query, c[2].source, c[1])]
+        except _BadRequest as exception:
+            return exception.response()
+        sort = body.get('sort') or []
+        keys = [_sort_spec(s) for s in sort]
+        if not self.supports_shard_doc and ('_shard_doc', 'asc') in keys:
+            return _error(400, 'search_phase_execution_exception',
+                          'No mapping found for [_shard_doc] in order to sort on')
+        if keys:
+            def sort_key(hit):
+                return [_sort_value(field, hit) for field, order in keys]
+            hits.sort(key=sort_key)
+            for position, (field, order) in reversed(list(enumerate(keys))):
+                if order == 'desc':
+                    hits.sort(key=lambda h, p=position, f=field: _sort_value(f, h),
+                              reverse=True)
+            if 'search_after' in body:
+                after = body['search_after']
+                hits = [h for h in hits if _after(sort_key(h), after, keys)]
+        offset = body.get('from', 0)
+        size = body.get('size', 10)
+        result = self._page(hits, offset, size, keys, body.get('_source', True))
+        if 'pit' in body:
+            result['pit_id'] = body['pit']['id']
+        if 'scroll' in params:
+            scroll_id = uuid.uuid4().hex
+            self.__scrolls[scroll_id] = (hits, offset + size, size, keys,
+                                         body.get('_source', True))
+            result['_scroll_id'] = scroll_id
+        return 200, result
+
+    def _page(self, hits, offset, size, keys, source):
+        page = hits[offset:offset + size]
+        result_hits = []
+        for name, doc_id, doc in page:
+            hit = {'_index': name, '_id': doc_id, '_source': _project(doc.source, source)}
+            if keys:
+                hit['sort'] = [_sort_value(f, (name, doc_id, doc)) for f, o in keys]
+            result_hits.append(hit)
+        return {'took': 1, 'timed_out': False,
+                'hits': {'total': {'value': len(hits), 'relation': 'eq'},
+                         'hits': result_hits}}
+
+    def _scroll(self, method, params, body):
+        scroll_id = (body or {}).get('scroll_id') or params.get('scroll_id')
+        if method == 'DELETE':
+            for item in (scroll_id if isinstance(scroll_id, list) else [scroll_id]):
+                self.__scrolls.pop(item, None)
+            return 200, {'succeeded': True}
+        if scroll_id not in self.__scrolls:
+            return _error(404, 'search_context_missing_exception', scroll_id)
+        hits, offset, size, keys, source = self.__scrolls[scroll_id]
+        self.__scrolls[scroll_id] = (hits, offset + size, size, keys, source)
+        result = self._page(hits, offset, size, keys, source)
+        result['_scroll_id'] = scroll_id
+        return 200, result
+
+    def _mget(self, method, params, body, index=None):
+        docs = body.get('docs') or [{'_id': i} for i in body.get('ids', [])]
+        includes = params.get('_source_includes')
+        source_filter = includes.split(',') if includes else body.get('_source', True)
+        result = []
+        for spec in docs:
+            target = spec.get('_index', index)
+            doc_id = spec['_id']
+            try:
+                names = self._resolve(target)
+            except _NotFound as exception:
+                result.append({'_index': target, '_id': doc_id,
+                               'error': exception.error()})
+                continue
+            found = None
+            for name in names:
+                doc = self.__indices[name]['docs'].get(doc_id)
+                if doc is not None:
+                    found = (name, doc)
+                    break
+            if found is None:
+                result.append({'_index': names[0] if names else target,
+                               '_id': doc_id, 'found': False})
+            else:
+                result.append({'_index': found[0], '_id': doc_id, 'found': True,
+                               '_source': _project(found[1].source,
+                                                   spec.get('_source', source_filter))})
+        return 200, {'docs': result}
+
+    def _reindex(self, method, params, body):
+        source = body['source']['index']
+        if not isinstance(source, list):
+            source = [source]
+        try:
+            names = self._resolve(','.join(source))
+        except _NotFound as exception:
+            return exception.response()
+        dest = self._write_index(body['dest']['index'])
+        created = 0
+        for name in names:
+            for doc_id, doc in self.__indices[name]['docs'].items():
+                self.__indices[dest]['docs'][doc_id] = _Doc(
+                    self._next_seq(), dict(doc.source), doc.routing)
+                created += 1
+        status = {'total': created, 'created': created, 'updated': 0,
+                  'deleted': 0, 'batches': 1}
+        if params.get('wait_for_completion') == 'false':
+            task_id = 'fake:{}'.format(len(self.__tasks) + 1)
+            self.__tasks[task_id] = {'completed': True,
+                                     'task': {'status': status,
+                                              'running_time_in_nanos': 1000000},
+                                     'response': dict(status, failures=[])}
+            return 200, {'task': task_id}
+        return 200, dict(status, failures=[])
+
+    def _get_task(self, method, params, body, task_id):
+        if task_id not in self.__tasks:
+            return _error(404, 'resource_not_found_exception', task_id)
+        return 200, self.__tasks[task_id]
+
+    def _doc(self, method, params, body, index, doc_id):
+        if method in ('PUT', 'POST'):
+            if index not in self.__indices and not self._resolve(index, allow_missing=True):
+                self._create_index('PUT', {}, None, index)
+            name = self._write_index(index)
+            result = self._apply(name, 'index', {'_id': doc_id, 'routing': params.get('routing')},
+                                 body)
+            return result['status'], dict(result, _index=name)
+        try:
+            names = self._resolve(index)
+        except _NotFound as exception:
+            return exception.response()
+        for name in names:
+            doc = self.__indices[name]['docs'].get(doc_id)
+            if doc is None:
+                continue
+            if method == 'DELETE':
+                del self.__indices[name]['docs'][doc_id]
+                return 200, {'_index': name, '_id': doc_id, 'result': 'deleted'}
+            return 200, {'_index': name, '_id': doc_id, 'found': True, '_source': doc.source}
+        return 404, {'_index': index, '_id': doc_id, 'found': False}
+
+    def _count(self, method, params, body, index=None):
+        status, result = self._search(method, {}, dict(body or {}, size=0), index=index)
+        if status != 200:
+            return status, result
+        return 200, {'count': result['hits']['total']['value']}
+
+
+# Internal
+
+_Route = collections.namedtuple('_Route', 'pattern methods name')
+
+
+def _route(pattern, methods, name):
+    regex = re.sub(r'\{(\w+)\}', r'(?P<\1>[^/]+)', pattern)
+    return _Route(re.compile('^' + regex + '$'), methods, name)
+
+
+_ROUTES = [
+    _route('/', ('GET', 'HEAD'), 'info'),
+    _route('/_alias', ('GET', 'HEAD'), 'get_alias'),
+    _route('/_alias/{name}', ('GET', 'HEAD'), 'get_alias'),
+    _route('/_aliases', ('POST',), 'update_aliases'),
+    _route('/_bulk', ('POST', 'PUT'), 'bulk'),
+    _route('/_search', ('GET', 'POST'), 'search'),
+    _route('/_search/scroll', ('GET', 'POST', 'DELETE'), 'scroll'),
+    _route('/_mget', ('GET', 'POST'), 'mget'),
+    _route('/_pit', ('DELETE',), 'close_pit'),
+    _route('/_reindex', ('POST',), 'reindex'),
+    _route('/_flush', ('GET', 'POST'), 'flush'),
+    _route('/_refresh', ('GET', 'POST'), 'refresh'),
+    _route('/_tasks/{task_id}', ('GET',), 'get_task'),
+    _route('/{index}/_alias', ('GET', 'HEAD'), 'get_alias'),
+    _route('/{index}/_alias/{name}', ('GET', 'HEAD'), 'get_alias'),
+    _route('/{index}/_alias/{name}', ('PUT', 'POST'), 'put_alias'),
+    _route('/{index}/_aliases/{name}', ('PUT', 'POST'), 'put_alias'),
+    _route('/{index}/_mapping', ('GET',), 'get_mapping'),
+    _route('/{index}/_mapping', ('PUT', 'POST'), 'put_mapping'),
+    _route('/{index}/_settings', ('GET',), 'get_settings'),
+    _route('/{index}/_settings/{name}', ('GET',), 'get_settings_named'),
+    _route('/{index}/_settings', ('PUT',), 'put_settings'),
+    _route('/{index}/_bulk', ('POST', 'PUT'), 'bulk'),
+    _route('/{index}/_search', ('GET', 'POST'), 'search'),
+    _route('/{index}/_count', ('GET', 'POST'), 'count'),
+    _route('/{index}/_mget', ('GET', 'POST'), 'mget'),
+    _route('/{index}/_pit', ('POST',), 'open_pit'),
+    _route('/{index}/_flush', ('GET', 'POST'), 'flush'),
+    _route('/{index}/_refresh', ('GET', 'POST'), 'refresh'),
+    _route('/{index}/_doc/{doc_id}', ('GET', 'HEAD', 'PUT', 'POST', 'DELETE'), 'doc'),
+    _route('/{index}', ('PUT',), 'create_index'),
+    _route('/{index}', ('DELETE',), 'delete_index'),
+    _route('/{index}', ('HEAD',), 'exists_index'),
+]
+
+
+class _Doc(object):
+    __slots__ = ('seq', 'source', 'routing')
+
+    def __init__(self, seq, source, routing=None):
+        self.seq = seq
+        self.source = source
+        self.routing = routing
+
+    def copy(self):
+        return _Doc(self.seq, self.source, self.routing)
+
+
+class _BadRequest(Exception):
+
+    def __init__(self, type_, reason, status=400):
+        super(_BadRequest, self).__init__(reason)
+        self.type = type_
+        self.reason = reason
+        self.status = status
+
+    def error(self):
+        return {'type': self.type, 'reason': self.reason}
+
+    def response(self):
+        return self.status, {'error': dict(self.error(), root_cause=[self.error()]),
+                             'status': self.status}
+
+
+class _NotFound(_BadRequest):
+
+    def __init__(self, name, type_='index_not_found_exception'):
+        super(_NotFound, self).__init__(type_, 'no such index [{}]'.format(name), 404)
+
+
+def _error(status, type_, reason):
+    return _BadRequest(type_, reason, status).response()
+
+
+def _flatten(settings, prefix):
+    for key, value in settings.items():
+        if key == prefix and isinstance(value, dict):
+            for item in _flatten(value, prefix):
+                yield item
+            continue
+        name = key if key.startswith(prefix + '.') else '{}.{}'.format(prefix, key)
+        if isinstance(value, dict):
+            for item in _flatten(value, name):
+                yield item
+        else:
+            yield name, value if value is None else str(value)
+
+
+def _unflatten(settings):
+    result = {}
+    for key, value in settings.items():
+        node = result
+        parts = key.split('.')
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return result
+
+
+def _check_mapping(current, update):
+    for name, prop in update.items():
+        if name not in current:
+            continue
+        existing = current[name]
+        if existing.get('type') != prop.get('type') and 'properties' not in prop:
+            raise _BadRequest('illegal_argument_exception',
+                              'mapper [{}] cannot be changed from type [{}] to [{}]'
+                              .format(name, existing.get('type'), prop.get('type')))
+        for key in ('format', 'scaling_factor'):
+            if key in prop and existing.get(key) != prop.get(key):
+                raise _BadRequest('illegal_argument_exception',
+                                  'mapper [{}] cannot change [{}]'.format(name, key))
+        if 'properties' in prop:
+            _check_mapping(existing.get('properties', {}), prop['properties'])
+
+
+def _merge_mapping(current, update):
+    for name, prop in update.items():
+        if name in current and 'properties' in prop:
+            merged = dict(prop)
+            merged['properties'] = dict(current[name].get('properties', {}))
+            _merge_mapping(merged['properties'], prop['properties'])
+            current[name] = merged
+        else:
+            current[name] = prop
+
+
+def _stable_hash(value):
+    result = 0
+    for char in value:
+        result = (result * 31 + ord(char)) & 0xffffffff
+    return result
+
+
+def _get(source, path):
+    node = source
+    for part in path.split('.'):
+        if not isinstance(node, dict) or part not in node:
+            return None
+        node = node[part]
+    return node
+
+
+def _values(source, field):
+    value = _get(source, field)
+    if value is None and field.endswith('.keyword'):
+        # Keyword sub-fields hold the value of their string field
+        value = _get(source, field[:-len('.keyword')])
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _comparable(a, b):
+    if isinstance(a, (int, float)) and not isinstance(b, (int, float)):
+        try:
+            return a, float(b)
+        except (TypeError, ValueError):
+            return str(a), str(b)
+    if isinstance(b, (int, float)) and not isinstance(a, (int, float)):
+        try:
+            return float(a), b
+        except (TypeError, ValueError):
+            return str(a), str(b)
+    return a, b
+
+
+def _matches(query, source, doc_id=None):
+    (kind, spec), = query.items()
+    if kind == 'match_all':
+        return True
+    if kind == 'bool':
+        def as_list(value):
+            return value if isinstance(value, list) else [value]
+        for clause in as_list(spec.get('filter', [])) + as_list(spec.get('must', [])):
+            if not _matches(clause, source, doc_id):
+                return False
+        for clause in as_list(spec.get('must_not', [])):
+            if _matches(clause, source, doc_id):
+                return False
+        should = as_list(spec.get('should', []))
+        if should:
+            required = spec.get('minimum_should_match', 1)
+            if sum(1 for c in should if _matches(c, source, doc_id)) < required:
+                return False
+        return True
+    if kind == 'ids':
+        return doc_id in spec['values']
+    if kind == 'exists':
+        return bool(_values(source, spec['field']))
+    (field, value), = spec.items()
+    values = _values(source, field)
+    if kind == 'term':
+        if isinstance(value, dict):
+            value = value['value']
+        return any(_comparable(v, value)[0] == _comparable(v, value)[1] for v in values)
+    if kind == 'terms':
+        return any(_comparable(v, t)[0] == _comparable(v, t)[1]
+                   for v in values for t in value)
+    if kind in ('match', 'match_phrase'):
+        if isinstance(value, dict):
+            value = value['query']
+        needle = str(value).lower()
+        return any(needle in str(v).lower() for v in values)
+    if kind == 'range':
+        for v in values:
+            ok = True
+            for op, bound in value.items():
+                if op not in ('gt', 'gte', 'lt', 'lte'):
+                    continue
+                left, right = _comparable(v, bound)
+                ok = ok and {'gt': left > right, 'gte': left >= right,
+                             'lt': left < right, 'lte': left <= right}[op]
+            if ok:
+                return True
+        return False
+    raise _BadRequest('parsing_exception', 'unknown query [{}]'.format(kind))
+
+
+def _sort_spec(spec):
+    if isinstance(spec, dict):
+        (field, order), = spec.items()
+        if isinstance(order, dict):
+            order = order.get('order', 'asc')
+        return field, order
+    return spec, 'asc'
+
+
+def _sort_value(field, hit):
+    name, doc_id, doc = hit
+    if field in ('_shard_doc', '_doc'):
+        return doc.seq
+    if field == '_id':
+        return doc_id
+    value = _get(doc.source, field)
+    return (0, '') if value is None else (1, value)
+
+
+def _after(values, after, keys):
+    for value, bound, (field, order) in zip(values, after, keys):
+        if isinstance(value, tuple) and not isinstance(bound, tuple):
+            bound = tuple(bound) if isinstance(bound, list) else (1, bound)
+        if value == bound:
+            continue
+        return value > bound if order == 'asc' else value < bound
+    return False
+
+
+def _project(source, spec):
+    if spec is True or spec is None:
+        return source
+    if spec is False:
+        return {}
+    if isinstance(spec, dict):
+        includes = spec.get('includes') or spec.get('include') or []
+        excludes = spec.get('excludes') or spec.get('exclude') or []
+    else:
+        includes = spec if isinstance(spec, list) else [spec]
+        excludes = []
+    result = {}
+    for key, value in source.items():
+        if includes and key not in includes:
+            continue
+        if key in excludes:
+            continue
+        result[key] = value
+    return result
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _make_handler(fake):
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _dispatch(self):
+            url = urlparse(self.path)
+            params = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+            body = None
+            if raw:
+                text = raw.decode('utf-8')
+                if url.path.rstrip('/').endswith('_bulk'):
+                    body = [json.loads(line) for line in text.splitlines() if line.strip()]
+                else:
+                    body = json.loads(text)
+            status, payload = fake.handle(self.command, url.path, params, body)
+            data = b'' if payload is None else json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('X-Elastic-Product', 'Elasticsearch')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(data)
+
+        do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _dispatch
+
+    return Handler
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import platform
+import contextlib
+import collections
+import multiprocessing
+from elasticsearch import Elasticsearch, __version__ as es_version
+
+import tableschema_elasticsearch
+from tableschema_elasticsearch import Storage, mappers
+from tableschema_elasticsearch.storage import DEFAULT_CHUNK_SIZE
+from .fake_es import FakeElasticsearch
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+# Module API
+
+SCHEMAS = collections.OrderedDict([
+    ('narrow', {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'name', 'type': 'string'},
+            {'name': 'score', 'type': 'number'},
+            {'name': 'active', 'type': 'boolean'},
+            {'name': 'created', 'type': 'date'},
+        ],
+        'primaryKey': ['id'],
+    }),
+    ('wide', {
+        'fields': [{'name': 'id', 'type': 'integer'}] + [
+            {'name': 'field_{:03d}'.format(number), 'type': type_}
+            for number, type_ in zip(range(99), ['string', 'integer', 'number',
+                                                 'boolean', 'date'] * 20)
+        ],
+        'primaryKey': ['id'],
+    }),
+    ('nested', {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'name', 'type': 'string'},
+            {'name': 'tags', 'type': 'array', 'es:itemType': 'string'},
+            {'name': 'address', 'type': 'object', 'es:schema': {'fields': [
+                {'name': 'street', 'type': 'string'},
+                {'name': 'city', 'type': 'string'},
+                {'name': 'location', 'type': 'geopoint'},
+                {'name': 'details', 'type': 'object', 'es:schema': {'fields': [
+                    {'name': 'floor', 'type': 'integer'},
+                    {'name': 'since', 'type': 'datetime'},
+                    {'name': 'scores', 'type': 'array', 'es:itemType': 'number'},
+                ]}},
+            ]}},
+        ],
+        'primaryKey': ['id'],
+    }),
+])
+MAPPING_CALLS = 200
+
+
+def generate_rows(descriptor, count, seed=0):
+    """Generate `count` rows matching a descriptor, the same for every seed.
+    """
+    generator = random.Random(seed)
+    for number in range(count):
+        row = _generate_row(descriptor, generator)
+        row['id'] = number
+        yield row
+
+
+@contextlib.contextmanager
+def serve(**options):
+    """Run a `FakeElasticsearch` in a child process, yielding its url.
+
+    The server runs apart from the benchmarked client so its threads and
+    documents don't count in the measured time and memory.
+    """
+    connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve, args=(child_connection, options))
+    process.daemon = True
+    process.start()
+    try:
+        yield connection.recv()
+    finally:
+        connection.send(None)
+        process.join(10)
+
+
+def run_benchmarks(rows=10000, schemas=None, latency=0.0, reject_rate=0.0,
+                   concurrency=1, chunk_size=DEFAULT_CHUNK_SIZE, memory=True, seed=0):
+    """Run the benchmarks and return their results as a JSON serializable dict.
+
+    For every schema, measures the mapping generation time, then the write
+    and read throughput of `rows` rows against a fake server answering
+    with `latency` seconds of delay and rejecting `reject_rate` of the
+    bulk items. With `memory`, every case is run a second time under
+    tracemalloc to record its peak memory (kept apart from the timing).
+    """
+    results = []
+    with serve(latency=latency, reject_rate=reject_rate, seed=seed) as url:
+        storage = Storage(Elasticsearch(url, request_timeout=60))
+        for name in schemas or SCHEMAS:
+            descriptor = SCHEMAS[name]
+            data = list(generate_rows(descriptor, rows, seed=seed))
+            bucket = 'benchmark-{}'.format(name)
+
+            def create():
+                storage.delete(bucket)
+                storage.create(bucket, descriptor)
+
+            def write():
+                collections.deque(storage.write(
+                    bucket, data, descriptor['primaryKey'], chunk_size=chunk_size,
+                    concurrency=concurrency, initial_backoff=0.01), maxlen=0)
+                return len(data)
+
+            def read():
+                return sum(1 for _ in storage.iter(bucket))
+
+            def generate_mapping():
+                for _ in range(MAPPING_CALLS):
+                    mappers.descriptor_to_mapping(descriptor)
+                return MAPPING_CALLS
+
+            results.append(_measure('mapping', name, generate_mapping, memory=memory))
+            results.append(_measure('write', name, write, setup=create, memory=memory))
+            results.append(_measure('read', name, read, memory=memory))
+            storage.delete(bucket)
+    return {
+        'package_version': _package_version(),
+        'elasticsearch_client': '.'.join(map(str, es_version)),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created': datetime.datetime.utcnow().isoformat() + 'Z',
+        'config': {
+            'rows': rows,
+            'latency': latency,
+            'reject_rate': reject_rate,
+            'concurrency': concurrency,
+            'chunk_size': chunk_size,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline):
+    """Return the throughput of every case relative to a baseline run.
+    """
+    key = lambda result: (result['benchmark'], result['schema'])
+    previous = dict((key(result), result) for result in baseline['results'])
+    ratios = []
+    for result in results['results']:
+        before = previous.get(key(result))
+        if before and before['per_second']:
+            ratios.append(dict(
+                benchmark=result['benchmark'], schema=result['schema'],
+                ratio=round(result['per_second'] / before['per_second'], 3)))
+    return ratios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark Storage against an in-process Elasticsearch stand-in')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--schemas', nargs='+', choices=list(SCHEMAS), default=list(SCHEMAS))
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the server waits before answering each request')
+    parser.add_argument('--reject-rate', type=float, default=0.0,
+                        help='share of bulk items rejected with a 429')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip the peak memory measurements')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='print the throughput relative to a previous results file')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(rows=args.rows, schemas=args.schemas, latency=args.latency,
+                             reject_rate=args.reject_rate, concurrency=args.concurrency,
+                             chunk_size=args.chunk_size, memory=args.memory, seed=args.seed)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+    for result in results['results']:
+        print('{benchmark:>8} {schema:>8}: {per_second:12.1f} {unit}/s, peak memory {memory}'
+              .format(unit='calls' if result['benchmark'] == 'mapping' else 'rows',
+                      memory=result['peak_memory_bytes'], **result), file=sys.stderr)
+    if args.compare:
+        with io.open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+        for ratio in compare(results, baseline):
+            print('{benchmark:>8} {schema:>8}: x{ratio}'.format(**ratio), file=sys.stderr)
+
+
+# Internal
+
+def _measure(benchmark, schema, run, setup=None, memory=True):
+    if setup is not None:
+        setup()
+    start = time.time()
+    count = run()
+    seconds = time.time() - start
+    peak_memory = None
+    if memory and tracemalloc is not None:
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        try:
+            run()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {
+        'benchmark': benchmark,
+        'schema': schema,
+        'count': count,
+        'seconds': round(seconds, 6),
+        'per_second': round(count / seconds, 1) if seconds > 0 else None,
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def _serve(connection, options):
+    with FakeElasticsearch(**options) as fake:
+        connection.send(fake.url)
+        connection.recv()
+
+
+def _generate_row(descriptor, generator):
+    return dict(
+        (field['name'], _generate_value(field, generator))
+        for field in descriptor['fields']
+    )
+
+
+def _generate_value(field, generator):
+    schema_type = field['type']
+    if schema_type == 'array':
+        item = dict(field, type=field['es:itemType'])
+        return [_generate_value(item, generator) for _ in range(generator.randint(0, 4))]
+    if schema_type == 'object':
+        return _generate_row(field['es:schema'], generator)
+    if schema_type == 'integer':
+        return generator.randint(-10 ** 6, 10 ** 6)
+    if schema_type == 'number':
+        return round(generator.uniform(-1000, 1000), 2)
+    if schema_type == 'boolean':
+        return generator.random() < 0.5
+    if schema_type == 'date':
+        return (datetime.date(2020, 1, 1) +
+                datetime.timedelta(days=generator.randint(0, 1000))).isoformat()
+    if schema_type == 'datetime':
+        return (datetime.datetime(2020, 1, 1) +
+                datetime.timedelta(seconds=generator.randint(0, 10 ** 8))).isoformat()
+    if schema_type == 'geopoint':
+        return '{:.5f},{:.5f}'.format(generator.uniform(-180, 180), generator.uniform(-90, 90))
+    return ' '.join(generator.choice(_WORDS) for _ in range(generator.randint(1, 6)))
+
+
+def _package_version():
+    path = os.path.join(os.path.dirname(tableschema_elasticsearch.__file__), 'VERSION')
+    with io.open(path, encoding='utf-8') as file:
+        return file.read().strip()
+
+
+_WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel',
+          'india', 'juliett', 'kilo', 'lima', 'mike', 'november', 'oscar', 'papa']
+
+
+if __name__ == '__main__':
+    main()
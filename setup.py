@@ -37,9 +37,19 @@ TESTS_REQUIRE = [
 EXAMPLES_REQUIRE = [
     'python-dotenv',
 ]
+ASYNC_REQUIRE = [
+    'aiohttp>=3,<4',
+]
+SPEEDUPS_REQUIRE = [
+    'orjson',
+]
+COLUMNAR_REQUIRE = [
+    'numpy',
+    'pyarrow',
+]
 README = read('README.md')
 VERSION = read(PACKAGE, 'VERSION')
-PACKAGES = find_packages(exclude=['examples', 'tests'])
+PACKAGES = find_packages(exclude=['benchmarks', 'examples', 'tests'])
 
 
 # Run
@@ -50,7 +60,12 @@ setup(
     include_package_data=True,
     install_requires=INSTALL_REQUIRES,
     tests_require=TESTS_REQUIRE,
-    extras_require={'develop': TESTS_REQUIRE + EXAMPLES_REQUIRE},
+    extras_require={
+        'async': ASYNC_REQUIRE,
+        'speedups': SPEEDUPS_REQUIRE,
+        'columnar': COLUMNAR_REQUIRE,
+        'develop': TESTS_REQUIRE + EXAMPLES_REQUIRE + ASYNC_REQUIRE,
+    },
     zip_safe=False,
     long_description=README,
     long_description_content_type='text/markdown',
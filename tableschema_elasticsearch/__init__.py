@@ -6,3 +6,11 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 from .storage import Storage
+from .reindex import ReindexTask
+from .failures import WriteReport
+from .metrics import Metrics, InMemoryCollector, StatsdMetrics
+try:
+    from .async_storage import AsyncStorage
+except (ImportError, SyntaxError):
+    # asyncio support requires Python 3.6+ and the elasticsearch async extra
+    pass
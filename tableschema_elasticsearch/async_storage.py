@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import uuid
+import asyncio
+import datetime
+import warnings
+import collections
+from elasticsearch import AsyncElasticsearch, __version__ as es_version
+from elasticsearch.exceptions import NotFoundError, RequestError
+
+from . import bulk
+from . import mappers
+from . import encoders
+from . import failures
+from .storage import DEFAULT_PAGE_SIZE, DEFAULT_CHUNK_SIZE, DEFAULT_MGET_SIZE
+from .storage import SEARCH_KEEP_ALIVE
+from .storage import _check_refresh_policy, _error_handler, _key_row, _search_body
+from .storage import _descriptor_mapping, _mapping_params, _mget_rows
+from .reindex import reindex_body, task_status, check_task_response, switch_alias_body
+
+
+REINDEX_POLL_INTERVAL = 1.0
+
+
+# Module API
+
+class AsyncStorage(object):
+    """Elasticsearch Tabular Storage for asyncio.
+
+    Mirrors `Storage` on top of `AsyncElasticsearch`: every call that talks
+    to Elasticsearch is a coroutine, and `iter`/`write` are async generators.
+
+    # Arguments
+        es (object): AsyncElasticsearch instance
+        refresh (str): default durability/visibility policy of `write`
+            (one of `none`, `wait_for`, `refresh` or `flush`)
+
+    """
+
+    # Public
+
+    def __init__(self, es=None, refresh='flush'):
+        # Use the passed `es` or create a new AsyncElasticsearch instance
+        self.__es = es if es is not None else AsyncElasticsearch()
+        self.__refresh = _check_refresh_policy(refresh)
+        self.__descriptors = {}
+
+    def __repr__(self):
+        # Template and format
+        template = 'AsyncStorage {engine}'
+        text = template.format(engine=self.__es)
+        return text
+
+    @property
+    def buckets(self):
+        return self.__iter_buckets()
+
+    def get_index_name(self, bucket):
+        uid = str(uuid.uuid4())[:8]
+        today = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
+        return '{}_{}_{}'.format(bucket, today, uid)
+
+    async def create_index(self, bucket, index_settings=None, alias=True):
+        index_name = self.get_index_name(bucket)
+        body = None
+        if index_settings is not None:
+            body = dict(
+                settings=index_settings
+            )
+        await self.__es.indices.create(index=index_name, body=body)
+        if alias:
+            await self.__es.indices.put_alias(index=index_name, name=bucket)
+        return index_name
+
+    async def swap_alias(self, bucket, index_name):
+        """Point a bucket at a new index, then delete its previous indices.
+
+        Same arguments as `Storage.swap_alias`.
+
+        """
+        previous_index_names = []
+        if await self.__es.indices.exists_alias(name=bucket):
+            previous_index_names = [
+                name for name in await self.__es.indices.get_alias(name=bucket)
+                if name != index_name
+            ]
+        await self.__es.indices.update_aliases(
+            body=switch_alias_body(bucket, index_name, previous_index_names))
+        self.__descriptors.pop(bucket, None)
+        for previous_index_name in previous_index_names:
+            await self.__es.indices.delete(index=previous_index_name)
+
+    async def put_mapping(self, bucket, descriptor, index_name, mapping_generator_cls):
+        mapping = _descriptor_mapping(descriptor, mapping_generator_cls)
+        if es_version[0] < 8:
+            await self.__es.indices.put_mapping(index=index_name, body=mapping)
+        else:
+            await self.__es.indices.put_mapping(index=index_name, **_mapping_params(mapping))
+
+    def generate_doc_id(self, row, primary_key):
+        return bulk.generate_doc_id(row, primary_key)
+
+    async def create(self, bucket, descriptor,
+                     reindex=False, always_recreate=False,
+                     mapping_generator_cls=None, index_settings=None,
+                     reindex_requests_per_second=None, blue_green=False):
+        """Create index with mapping by schema.
+
+        Same arguments as `Storage.create`; the reindex runs as a background
+        task which is awaited without blocking the event loop.
+
+        """
+        self.__descriptors.pop(bucket, None)
+        existing_index_names = []
+        if await self.__es.indices.exists_alias(name=bucket):
+            existing_index_names = await self.__es.indices.get_alias(name=bucket)
+            existing_index_names = sorted(existing_index_names.keys())
+
+        created = True
+        if len(existing_index_names) == 0 or always_recreate:
+            # A replacement index only gets the alias once it has been filled
+            alias = len(existing_index_names) == 0 or not (reindex or blue_green)
+            index_name = await self.create_index(bucket, index_settings=index_settings,
+                                                 alias=alias)
+            await self.put_mapping(bucket, descriptor, index_name, mapping_generator_cls)
+
+        elif await self.__update_mapping(bucket, descriptor, existing_index_names[-1],
+                                         mapping_generator_cls, reindex):
+            index_name = existing_index_names.pop(-1)
+            created = False
+
+        else:
+            index_name = await self.create_index(bucket, index_settings=index_settings,
+                                                 alias=False)
+            await self.put_mapping(bucket, descriptor, index_name, mapping_generator_cls)
+
+        if reindex and len(existing_index_names) > 0:
+            await self.__reindex(bucket, existing_index_names, index_name,
+                                 reindex_requests_per_second,
+                                 mappers.get_routing_key(descriptor), created)
+            self.__descriptors.pop(bucket, None)
+
+        elif blue_green and always_recreate and len(existing_index_names) > 0:
+            return index_name
+
+    async def delete(self, bucket=None):
+        """Delete index with mapping by schema.
+
+        # Arguments
+            bucket(str): Name of index to delete
+
+        """
+        async def internal_delete(bucket):
+            if await self.__es.indices.exists_alias(name=bucket):
+                existing_index_names = await self.__es.indices.get_alias(name=bucket)
+                existing_index_names = list(existing_index_names.keys())
+                for existing_index_name in existing_index_names:
+                    await self.__es.indices.delete(index=existing_index_name)
+
+        if bucket is None:
+            self.__descriptors.clear()
+            buckets = [bucket async for bucket in self.buckets]
+            for bucket in buckets:
+                await internal_delete(bucket)
+        else:
+            self.__descriptors.pop(bucket, None)
+            await internal_delete(bucket)
+
+    async def describe(self, bucket, descriptor=None):
+        """Return the descriptor of a bucket.
+
+        Same arguments as `Storage.describe`.
+
+        """
+        if descriptor is not None:
+            self.__descriptors[bucket] = descriptor
+            return descriptor
+        descriptor = self.__descriptors.get(bucket)
+        if descriptor is None:
+            response = await self.__es.indices.get_mapping(index=bucket)
+            index_name = sorted(response.keys())[-1]
+            descriptor = mappers.mapping_to_descriptor(response[index_name]['mappings'])
+            self.__descriptors[bucket] = descriptor
+        return descriptor
+
+    async def iter(self, bucket, page_size=DEFAULT_PAGE_SIZE, fields=None, filters=None,
+                   routing=None):
+        """Iterate over the rows of a bucket.
+
+        Rows are read from a point-in-time snapshot of the bucket, paging
+        with `search_after` (see `Storage.iter`).
+
+        # Arguments
+            bucket(str):
+                Name of index to read
+            page_size(int):
+                Number of rows fetched per search request
+            fields(list):
+                Only fetch these fields of every row
+            filters(dict):
+                Only fetch the rows matching these filters (see `Storage.iter`)
+            routing(str):
+                Only search the shards of this routing value
+
+        """
+        descriptor = await self.__known_descriptor(bucket) if filters else None
+        search_body = _search_body(fields, filters, descriptor)
+        params = dict(routing=routing) if routing is not None else {}
+        pit = await self.__es.open_point_in_time(index=bucket,
+                                                 keep_alive=SEARCH_KEEP_ALIVE, **params)
+        search_after = None
+        try:
+            while True:
+                body = dict(
+                    search_body,
+                    pit=dict(id=pit['id'], keep_alive=SEARCH_KEEP_ALIVE),
+                    sort=[{'_shard_doc': 'asc'}],
+                    size=page_size,
+                    track_total_hits=False,
+                )
+                if search_after is not None:
+                    body['search_after'] = search_after
+                results = await self.__es.search(body=body)
+                hits = results.get('hits', {}).get('hits', [])
+                if len(hits) == 0:
+                    break
+                for hit in hits:
+                    yield hit.get('_source')
+                search_after = hits[-1]['sort']
+        finally:
+            await self.__es.close_point_in_time(body=dict(id=pit['id']))
+
+    async def read(self, bucket, **options):
+        """Read all the rows of a bucket.
+
+        # Arguments
+            bucket(str):
+                Name of index to read
+            options:
+                Same options as `iter`
+
+        """
+        # Get rows
+        rows = [row async for row in self.iter(bucket, **options)]
+
+        return rows
+
+    async def get_many(self, bucket, keys, primary_key, fields=None,
+                       batch_size=DEFAULT_MGET_SIZE, concurrency=4, routing=None):
+        """Fetch rows by their primary key.
+
+        Same arguments as `Storage.get_many` (without `cache`); rows of a
+        routed bucket need their `routing`.
+
+        """
+        doc_ids = [self.generate_doc_id(_key_row(key, primary_key), primary_key)
+                   for key in keys]
+        unique_doc_ids = list(collections.OrderedDict.fromkeys(doc_ids))
+        source = dict(includes=list(fields)) if fields is not None \
+            else dict(excludes=[mappers.CONTENT_HASH_FIELD])
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def mget(batch):
+            async with semaphore:
+                docs = [dict(_id=doc_id, _source=source) for doc_id in batch]
+                if routing is not None:
+                    for doc in docs:
+                        doc['routing'] = routing
+                response = await self.__es.mget(index=bucket, body=dict(docs=docs))
+            return response['docs']
+
+        found = {}
+        for docs in await asyncio.gather(*[
+                mget(batch) for batch in bulk.iter_chunks(unique_doc_ids, batch_size)]):
+            found.update(_mget_rows(docs))
+        return [found.get(doc_id) for doc_id in doc_ids]
+
+    async def write(self, bucket, rows, primary_key, update=False, as_generator=False,
+                    chunk_size=DEFAULT_CHUNK_SIZE, concurrency=1, refresh=None,
+                    descriptor=None, max_retries=bulk.DEFAULT_RETRY.max_retries,
+                    initial_backoff=bulk.DEFAULT_RETRY.initial_backoff,
+                    on_error=None, dead_letter=None, report=None, mapping_generator_cls=None):
+        """Write rows to a bucket.
+
+        Same arguments as `Storage.write` (without `bulk_load`, `processes`,
+        `chunk_bytes`, `checkpoint`, `checkpoint_interval` and
+        `skip_unchanged`); `rows` may also be an async iterable.
+        Acknowledged rows are yielded when `as_generator` is set. Rows are
+        routed by the `es:routingKey` of the given `descriptor`, or of the
+        bucket's one when none is given.
+
+        """
+        if primary_key is None or len(primary_key) == 0:
+            raise ValueError('primary_key cannot be an empty list')
+        refresh = _check_refresh_policy(refresh or self.__refresh)
+
+        encoder = None
+        if descriptor is not None:
+            encoder = encoders.get_encoder(descriptor, mapping_generator_cls)
+        known_descriptor = await self.__known_descriptor(bucket, descriptor)
+        retry = bulk.RetryPolicy(max_retries, initial_backoff, bulk.DEFAULT_RETRY.max_backoff)
+        outcomes = self.__iter_acknowledged(
+            bucket, rows, primary_key, update, encoder, chunk_size, concurrency,
+            last_refresh='wait_for' if refresh == 'wait_for' else None, retry=retry,
+            collect_errors=on_error is not None or dead_letter is not None,
+            routing_key=mappers.get_routing_key(known_descriptor))
+        with _error_handler(on_error, dead_letter) as on_error:
+            async for row in _handle_outcomes(outcomes, on_error, report):
+                if as_generator:
+                    yield row
+
+        if refresh == 'refresh':
+            await self.__es.indices.refresh(index=bucket)
+        elif refresh == 'flush':
+            await self.__es.indices.flush(index=bucket)
+
+    async def write_many(self, writes, **options):
+        """Write to several buckets concurrently.
+
+        # Arguments
+            writes:
+                Iterable of `(bucket, rows, primary_key)` tuples
+            options:
+                Same options as `write` (except `as_generator`)
+
+        # Returns
+            list: number of rows written for every entry of `writes`
+
+        """
+        async def count(bucket, rows, primary_key):
+            written = 0
+            async for _ in self.write(bucket, rows, primary_key,
+                                      as_generator=True, **options):
+                written += 1
+            return written
+
+        return await asyncio.gather(*[count(*write) for write in writes])
+
+    # Private
+
+    async def __update_mapping(self, bucket, descriptor, index_name, mapping_generator_cls,
+                               reindex):
+        # Same as `Storage.__update_mapping`
+        response = await self.__es.indices.get_mapping(index=index_name)
+        diff = mappers.diff_mappings(response[index_name]['mappings'],
+                                     _descriptor_mapping(descriptor, mapping_generator_cls))
+        if diff.kind == mappers.MAPPING_NOOP:
+            return True
+        if diff.kind == mappers.MAPPING_BREAKING and reindex:
+            return False
+        try:
+            await self.put_mapping(bucket, descriptor, index_name, mapping_generator_cls)
+        except RequestError:
+            if reindex:
+                return False
+            raise
+        return True
+
+    async def __known_descriptor(self, bucket, descriptor=None):
+        # Same as `Storage.__known_descriptor`
+        if descriptor is None:
+            try:
+                descriptor = await self.describe(bucket)
+            except NotFoundError:
+                return None
+        return descriptor
+
+    async def __reindex(self, bucket, source_index_names, index_name, requests_per_second,
+                        routing_key=None, created=False):
+        body = reindex_body(source_index_names, index_name, routing_key)
+        response = await self.__es.reindex(body=body,
+                                           slices='auto',
+                                           wait_for_completion=False,
+                                           requests_per_second=requests_per_second or -1)
+        while True:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                task = await self.__es.tasks.get(task_id=response['task'])
+            if task_status(task)['completed']:
+                break
+            await asyncio.sleep(REINDEX_POLL_INTERVAL)
+        try:
+            check_task_response(response['task'], task)
+        except RuntimeError:
+            if created:
+                # The partial destination index would be left behind unaliased
+                await self.__es.indices.delete(index=index_name, ignore_unavailable=True)
+            raise
+        await self.__es.indices.flush(index=index_name)
+        await self.__es.indices.update_aliases(
+            body=switch_alias_body(bucket, index_name, source_index_names))
+
+        for source_index_name in source_index_names:
+            await self.__es.indices.delete(index=source_index_name)
+
+    async def __iter_buckets(self):
+        indexes = await self.__es.indices.get_alias(index='*')
+        for index_name, index in indexes.items():
+            for alias_name in index.get('aliases', {}).keys():
+                yield alias_name
+
+    async def __iter_acknowledged(self, bucket, rows, primary_key, update, encoder,
+                                  chunk_size, concurrency, last_refresh=None, retry=None,
+                                  collect_errors=False, routing_key=None):
+        # Mirrors `bulk.iter_acknowledged` with asyncio tasks instead of threads
+        pending = collections.deque()
+        try:
+            async for chunk, last in _aiter_chunks(rows, chunk_size):
+                chunk = [
+                    bulk.make_action(row, bucket,
+                                     self.generate_doc_id(row, primary_key), update,
+                                     encoder=encoder,
+                                     routing=bulk.routing_value(row, routing_key)
+                                     if routing_key else None)
+                    for row in chunk
+                ]
+                if last and last_refresh is not None:
+                    while pending:
+                        for row in await pending.popleft():
+                            yield row
+                refresh = last_refresh if last else None
+                send = self.__send_chunk(chunk, refresh, retry, collect_errors)
+                pending.append(asyncio.ensure_future(send))
+                while pending and (len(pending) >= concurrency or last):
+                    for row in await pending.popleft():
+                        yield row
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def __send_chunk(self, chunk, refresh=None, retry=None, collect_errors=False):
+        # Mirrors `bulk.send_chunk`
+        retry = retry or bulk.NO_RETRY
+        failed = [] if collect_errors else None
+        actions = chunk
+        for attempt in range(retry.max_retries + 1):
+            rejected = None if attempt == retry.max_retries else []
+            try:
+                await self.__send_actions(actions, refresh, rejected, failed)
+            except bulk.ApiError as exception:
+                rejected = bulk._rejected_request(actions, exception, rejected, failed)
+            if not rejected:
+                break
+            actions = rejected
+            await asyncio.sleep(min(retry.initial_backoff * 2 ** attempt, retry.max_backoff))
+        return bulk.outcomes(chunk, failed)
+
+    async def __send_actions(self, actions, refresh, rejected, failed):
+        if refresh is not None:
+            response = await self.__es.bulk(body=bulk.chunk_body(actions), refresh=refresh)
+        else:
+            response = await self.__es.bulk(body=bulk.chunk_body(actions))
+        return bulk.acknowledge_chunk(actions, response, rejected, failed)
+
+
+# Internal
+
+async def _aiter_chunks(rows, chunk_size):
+    # Yields `(chunk, last)` for sync and async iterables of rows
+    if hasattr(rows, '__aiter__'):
+        rows = rows.__aiter__()
+    else:
+        rows = _as_async(rows)
+    chunk = []
+    async for row in rows:
+        if len(chunk) >= chunk_size:
+            yield chunk, False
+            chunk = []
+        chunk.append(row)
+    if chunk:
+        yield chunk, True
+
+
+async def _handle_outcomes(outcomes, on_error=None, report=None):
+    # Mirrors `failures.handle_outcomes`
+    position = 0
+    async for outcome in outcomes:
+        if failures.handle_outcome(outcome, position, on_error, report):
+            yield outcome
+        position += 1
+
+
+async def _as_async(rows):
+    for row in rows:
+        yield row
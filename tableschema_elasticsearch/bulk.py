@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import time
+import datetime
+import threading
+import collections
+import multiprocessing
+import six
+from multiprocessing.pool import ThreadPool
+from elasticsearch.helpers import BulkIndexError
+try:
+    from elasticsearch.exceptions import ApiError
+except ImportError:
+    # elasticsearch<8
+    from elasticsearch.exceptions import TransportError as ApiError
+
+from . import encoders
+from .failures import FailedItem
+from .mappers import CONTENT_HASH_FIELD
+from .metrics import NO_METRICS
+
+
+# Module API
+
+BulkAction = collections.namedtuple('BulkAction', 'row header source data content_hash')
+BulkAction.__new__.__defaults__ = (None,)
+RetryPolicy = collections.namedtuple('RetryPolicy', 'max_retries initial_backoff max_backoff')
+
+DEFAULT_RETRY = RetryPolicy(max_retries=5, initial_backoff=0.5, max_backoff=60)
+NO_RETRY = RetryPolicy(max_retries=0, initial_backoff=0, max_backoff=0)
+MAX_CHUNK_BYTES = 90 * 1024 * 1024  # under the default `http.max_content_length`
+DEFAULT_TARGET_LATENCY = 1.0
+
+
+class ChunkSizer(object):
+    """Adaptive byte budget of bulk requests.
+
+    Starts from `target_bytes` and adapts to every acknowledged request:
+    the budget shrinks with the fraction of items rejected (429, halving
+    at most), shrinks when a request takes longer than `target_latency`
+    and grows when full requests come back well under it. Thread safe, as requests are
+    acknowledged from the pool threads of `iter_acknowledged`.
+
+    # Arguments
+        target_bytes (int): initial size of a bulk request body
+        min_bytes (int): lower bound of the budget (`target_bytes / 16`)
+        max_bytes (int): upper bound of the budget (`target_bytes * 8`,
+            at most `MAX_CHUNK_BYTES`)
+        target_latency (float): seconds a bulk request should take
+
+    """
+
+    # Public
+
+    def __init__(self, target_bytes, min_bytes=None, max_bytes=None,
+                 target_latency=DEFAULT_TARGET_LATENCY):
+        self.__min_bytes = min_bytes or max(target_bytes // 16, 1)
+        self.__max_bytes = max_bytes or min(target_bytes * 8, MAX_CHUNK_BYTES)
+        self.__target_latency = target_latency
+        self.__target_bytes = self.__bound(target_bytes)
+        self.__lock = threading.Lock()
+
+    @property
+    def target_bytes(self):
+        return self.__target_bytes
+
+    def observe(self, size, latency, rejected=0.0):
+        """Adapt the budget to a bulk request of `size` bytes.
+
+        # Arguments
+            size (int): size of the request body
+            latency (float): seconds the request took
+            rejected (float): fraction of its items rejected with a 429
+
+        """
+        with self.__lock:
+            target = self.__target_bytes
+            if rejected > 0:
+                target = target * max(1 - rejected, 0.5)
+            elif latency > self.__target_latency:
+                target = target * max(self.__target_latency / latency, 0.5)
+            elif latency < self.__target_latency / 2 and size >= target * 0.8:
+                target = target * 1.25
+            self.__target_bytes = self.__bound(target)
+
+    # Private
+
+    def __bound(self, target):
+        return int(min(max(target, self.__min_bytes), self.__max_bytes))
+
+
+def generate_doc_id(row, primary_key):
+    """Build the document id of a row from its primary key values.
+    """
+    return '/'.join([str(row.get(k)) for k in primary_key])
+
+
+def make_action(row, index, doc_id, update=False, encoder=None, hashed=False,
+                routing=None):
+    """Build the bulk action for a row.
+
+    The row travels with its action, so it is released together with the
+    chunk it belongs to as soon as the chunk is acknowledged. With an
+    `encoder` (see `encoders.RowEncoder`) the action is also serialized
+    to its NDJSON lines right away. With `hashed`, the content hash of
+    the row is stored in the `CONTENT_HASH_FIELD` of the document. With
+    `routing`, the document is stored on the shard of that value.
+    """
+    op_type = 'update' if update else 'index'
+    header = {op_type: {'_index': index, '_id': doc_id}}
+    if routing is not None:
+        header[op_type]['routing'] = routing
+    source = row if encoder is None else encoder.cast(row)
+    hash_ = None
+    if hashed:
+        hash_ = encoders.content_hash(source)
+        source = dict(source)
+        source[CONTENT_HASH_FIELD] = hash_
+    if update:
+        source = {'doc': source, 'doc_as_upsert': True}
+    data = None
+    if encoder is not None:
+        data = encoders.dumps(header) + b'\n' + encoders.dumps(source) + b'\n'
+    return BulkAction(row, header, source, data, hash_)
+
+
+def routing_value(row, routing_key):
+    """Return the routing of a row: the value of its `routing_key` field as a string.
+    """
+    value = row.get(routing_key)
+    if value is None or value == '':
+        raise ValueError('Row has no routing value in {}'.format(routing_key))
+    return routing_string(value)
+
+
+def routing_string(value):
+    """Format a routing value the way the reindex routing script does.
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return six.text_type(value)
+
+
+def action_index(action):
+    """Return the name of the index an action is sent to.
+    """
+    return next(iter(action.header.values()))['_index']
+
+
+def iter_chunks(actions, chunk_size, sizer=None):
+    """Group actions into lists of at most `chunk_size` actions.
+
+    With a `sizer` (see `ChunkSizer`), a chunk is also closed once the
+    serialized `data` of its actions reaches the current byte budget;
+    `chunk_size` may then be `None` to only limit chunks by size.
+    """
+    chunk = []
+    size = 0
+    for action in actions:
+        chunk.append(action)
+        if sizer is not None:
+            size += len(action.data)
+        if (chunk_size is not None and len(chunk) >= chunk_size) or \
+                (sizer is not None and size >= sizer.target_bytes):
+            yield chunk
+            chunk = []
+            size = 0
+    if chunk:
+        yield chunk
+
+
+def encode_chunk(rows, index, primary_key, update=False, descriptor=None, doc_ids=None,
+                 hashed=False, index_names=None, routing_key=None, mapping_generator_cls=None):
+    """Serialize a chunk of rows to the NDJSON lines of their bulk actions.
+
+    Runs in the worker processes of `iter_encoded_chunks`, so it only takes
+    picklable arguments; the document ids are generated with
+    `generate_doc_id` unless `doc_ids` are given. Rows go to `index`
+    unless `index_names` gives the index of every row, routed by their
+    `routing_key` field if any. Returns the `header`, `data` and
+    `content_hash` of every action.
+    """
+    encoder = encoders.get_encoder(descriptor or {}, mapping_generator_cls)
+    if doc_ids is None:
+        doc_ids = [generate_doc_id(row, primary_key) for row in rows]
+    if index_names is None:
+        index_names = [index] * len(rows)
+    actions = (make_action(row, index_name, doc_id, update, encoder=encoder, hashed=hashed,
+                           routing=routing_value(row, routing_key) if routing_key else None)
+               for row, doc_id, index_name in zip(rows, doc_ids, index_names))
+    return [(action.header, action.data, action.content_hash) for action in actions]
+
+
+def iter_encoded_chunks(chunks, processes, index, primary_key, update=False,
+                        descriptor=None, generate_doc_id=None, hashed=False,
+                        index_name=None, routing_key=None, mapping_generator_cls=None):
+    """Encode chunks of rows into actions on a process pool.
+
+    Chunks are yielded in order as lists of actions carrying their
+    pre-serialized `data`, with at most twice `processes` chunks being
+    encoded ahead of the consumer. With a `generate_doc_id` callable, the
+    ids are generated in this process and sent along with the rows, and
+    so are the indices of the rows given by an `index_name` callable.
+    """
+    pool = multiprocessing.Pool(processes)
+    pending = collections.deque()
+    try:
+        for rows in chunks:
+            doc_ids = None
+            if generate_doc_id is not None:
+                doc_ids = [generate_doc_id(row, primary_key) for row in rows]
+            index_names = None
+            if index_name is not None:
+                index_names = [index_name(row) for row in rows]
+            args = (rows, index, primary_key, update, descriptor, doc_ids, hashed, index_names,
+                    routing_key, mapping_generator_cls)
+            pending.append((rows, pool.apply_async(encode_chunk, args)))
+            if len(pending) >= 2 * processes:
+                yield _encoded_actions(*pending.popleft())
+        while pending:
+            yield _encoded_actions(*pending.popleft())
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def send_chunk(es, chunk, refresh=None, retry=None, sizer=None, collect_errors=False,
+               skip_unchanged=False, metrics=None):
+    """Send a chunk of actions as one bulk request.
+
+    Returns the rows of the chunk in order, raising `BulkIndexError`
+    (like `elasticsearch.helpers.streaming_bulk`) when any item failed.
+    Items (or whole requests) rejected with a 429 are sent again following
+    the `retry` policy (see `RetryPolicy`, no retries by default), with
+    an exponential backoff. The first request is reported to the `sizer`.
+    With `collect_errors`, failed items are returned as `FailedItem`s in
+    place of their rows instead of raising. With `skip_unchanged`, only the
+    actions returned by `changed_actions` are sent. Every request is
+    reported to `metrics` (see `metrics.Metrics`).
+    """
+    retry = retry or NO_RETRY
+    metrics = metrics or NO_METRICS
+    tags = {'index': _chunk_index(chunk)}
+    failed = [] if collect_errors else None
+    actions = changed_actions(es, chunk) if skip_unchanged else chunk
+    if skip_unchanged:
+        metrics.count('bulk.skipped', len(chunk) - len(actions), tags)
+    if not actions and refresh is not None:
+        # Nothing left to carry the refresh
+        es.indices.refresh(index=tags['index'])
+    for attempt in range(retry.max_retries + 1 if actions else 0):
+        rejected = None if attempt == retry.max_retries else []
+        started = time.time()
+        try:
+            _send_actions(es, actions, refresh, rejected, failed)
+        except ApiError as exception:
+            rejected = _rejected_request(actions, exception, rejected, failed)
+        size = sum(len(action.data or b'') for action in actions)
+        latency = time.time() - started
+        _report_request(metrics, tags, actions, size, latency, rejected)
+        if sizer is not None and attempt == 0:
+            sizer.observe(size, latency, len(rejected or []) / len(actions))
+        if not rejected:
+            break
+        actions = rejected
+        backoff = min(retry.initial_backoff * 2 ** attempt, retry.max_backoff)
+        metrics.timing('bulk.backoff', backoff, tags)
+        time.sleep(backoff)
+    if failed:
+        metrics.count('bulk.failed', len(failed), tags)
+    return outcomes(chunk, failed)
+
+
+def changed_actions(es, chunk):
+    """Return the actions of a chunk which would change their document.
+
+    The content hashes of the chunk's documents are fetched with a single
+    `mget`; actions whose `content_hash` matches the stored one are left
+    out (actions without a hash are always kept).
+    """
+    docs = [dict(next(iter(action.header.values())), _source=[CONTENT_HASH_FIELD])
+            for action in chunk]
+    response = es.mget(body=dict(docs=docs))
+    changed = []
+    for action, doc in zip(chunk, response['docs']):
+        stored_hash = (doc.get('_source') or {}).get(CONTENT_HASH_FIELD)
+        if action.content_hash is None or action.content_hash != stored_hash:
+            changed.append(action)
+    return changed
+
+
+def outcomes(chunk, failed=None):
+    """Return the rows of a chunk, with its `failed` items in place of theirs.
+
+    # Arguments
+        chunk (list): actions of the chunk
+        failed (list): `(action, FailedItem)` pairs of its failed actions
+
+    """
+    if not failed:
+        return [action.row for action in chunk]
+    failures = dict((id(action), item) for action, item in failed)
+    return [failures.get(id(action), action.row) for action in chunk]
+
+
+def chunk_body(chunk):
+    """Build the bulk request body of a chunk.
+    """
+    if all(action.data is not None for action in chunk):
+        return b''.join(action.data for action in chunk)
+    body = []
+    for action in chunk:
+        body.append(action.header)
+        body.append(action.source)
+    return body
+
+
+def acknowledge_chunk(chunk, response, rejected=None, failed=None):
+    """Match a bulk response with its chunk and return the acknowledged rows.
+
+    When a `rejected` list is given, the actions rejected with a 429 are
+    appended to it instead of failing. When a `failed` list is given, the
+    other failed actions are appended to it with their `FailedItem`
+    instead of raising `BulkIndexError`.
+    """
+    rows = []
+    errors = []
+    for action, item in zip(chunk, response['items']):
+        op_type, info = next(iter(item.items()))
+        status = info.get('status', 500)
+        if 200 <= status < 300:
+            rows.append(action.row)
+        elif status == 429 and rejected is not None:
+            rejected.append(action)
+        elif failed is not None:
+            failed.append((action, FailedItem(action.row, None, info.get('_id'),
+                                              status, info.get('error'))))
+        else:
+            info = dict(info, data=action.source if action.source is not None else action.row)
+            errors.append({op_type: info})
+    if errors:
+        raise BulkIndexError('%i document(s) failed to index.' % len(errors), errors)
+    return rows
+
+
+def iter_acknowledged(es, chunks, concurrency=1, last_refresh=None, retry=None, sizer=None,
+                      collect_errors=False, skip_unchanged=False, metrics=None):
+    """Send chunks and yield their rows in order once acknowledged.
+
+    With `concurrency` above one, up to that many bulk requests are kept in
+    flight on a thread pool; only those chunks (and the one being built)
+    are held in memory. `last_refresh` is passed as the `refresh` parameter
+    of the last bulk request, which is only sent once all the others have
+    been acknowledged (chunks are then built one ahead to find the last).
+    `retry`, `sizer`, `collect_errors`, `skip_unchanged` and `metrics` are
+    passed to `send_chunk`.
+    """
+    pool = ThreadPool(concurrency) if concurrency > 1 else None
+    pending = collections.deque()
+    if last_refresh is not None:
+        marked = _mark_last(chunks)
+    else:
+        marked = ((chunk, False) for chunk in chunks)
+    try:
+        for chunk, last in marked:
+            refresh = last_refresh if last else None
+            if pool is None or last:
+                for row in _drain(pending):
+                    yield row
+                for row in send_chunk(es, chunk, refresh, retry, sizer,
+                                      collect_errors, skip_unchanged, metrics):
+                    yield row
+                continue
+            args = (es, chunk, None, retry, sizer, collect_errors, skip_unchanged, metrics)
+            pending.append(pool.apply_async(send_chunk, args))
+            for row in _drain(pending, concurrency - 1):
+                yield row
+        for row in _drain(pending):
+            yield row
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
+# Internal
+
+def _send_actions(es, actions, refresh, rejected, failed):
+    if refresh is not None:
+        response = es.bulk(body=chunk_body(actions), refresh=refresh)
+    else:
+        response = es.bulk(body=chunk_body(actions))
+    return acknowledge_chunk(actions, response, rejected, failed)
+
+
+def _report_request(metrics, tags, actions, size, latency, rejected):
+    metrics.timing('bulk.latency', latency, tags)
+    metrics.count('bulk.docs', len(actions), tags)
+    if size:
+        # Only known for pre-serialized actions
+        metrics.count('bulk.bytes', size, tags)
+    if rejected:
+        metrics.count('bulk.rejected', len(rejected), tags)
+
+
+def _chunk_index(chunk):
+    return action_index(chunk[0])
+
+
+def _rejected_request(actions, exception, rejected, failed):
+    # Returns the actions to retry after a whole bulk request failed
+    status = getattr(exception, 'status_code', None)
+    if status == 429 and rejected is not None:
+        return actions
+    if failed is None:
+        raise exception
+    error = getattr(exception, 'info', None) or str(exception)
+    if isinstance(error, dict):
+        error = error.get('error', error)
+    failed.extend((action, FailedItem(action.row, None, None, status, error))
+                  for action in actions)
+    return None
+
+
+def _encoded_actions(rows, result):
+    return [BulkAction(row, header, None, data, content_hash)
+            for row, (header, data, content_hash) in zip(rows, result.get())]
+
+
+def _drain(pending, in_flight=0):
+    # Yields the rows of the oldest pending requests until `in_flight` are left
+    while len(pending) > in_flight:
+        for row in pending.popleft().get():
+            yield row
+
+
+def _mark_last(iterable):
+    iterator = iter(iterable)
+    try:
+        previous = next(iterator)
+    except StopIteration:
+        return
+    for item in iterator:
+        yield previous, False
+        previous = item
+    yield previous, True
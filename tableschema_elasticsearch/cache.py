@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import time
+import threading
+import collections
+
+
+# Module API
+
+MISSING = object()
+
+
+class LRUCache(object):
+    """Least recently used cache of documents keyed by bucket and id.
+
+    Used by `Storage.get_many`; `Storage.write` invalidates the entries of
+    the bucket it writes to. Thread safe.
+
+    # Arguments
+        max_size (int): number of documents kept (0 disables the cache)
+
+    """
+
+    # Public
+
+    def __init__(self, max_size):
+        self.__max_size = max_size
+        self.__items = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__items)
+
+    def get(self, bucket, doc_id):
+        """Return the cached document, or `MISSING` when it is not cached.
+        """
+        key = (bucket, doc_id)
+        with self.__lock:
+            value = self.__items.pop(key, MISSING)
+            if value is not MISSING:
+                self.__items[key] = value
+            return value
+
+    def put(self, bucket, doc_id, value):
+        if self.__max_size <= 0:
+            return
+        key = (bucket, doc_id)
+        with self.__lock:
+            self.__items.pop(key, None)
+            self.__items[key] = value
+            while len(self.__items) > self.__max_size:
+                self.__items.popitem(last=False)
+
+    def invalidate(self, bucket=None):
+        """Drop the cached documents of a bucket (of all buckets by default).
+        """
+        with self.__lock:
+            if bucket is None:
+                self.__items.clear()
+                return
+            for key in [key for key in self.__items if key[0] == bucket]:
+                del self.__items[key]
+
+
+class AliasCache(object):
+    """Time limited cache of the indices of a cluster and their aliases.
+
+    The whole metadata is loaded with a single `fetch` call (the
+    `indices.get_alias` response for all indices) and reused for `ttl`
+    seconds. `Storage` keeps it up to date with the indices and aliases
+    it creates and deletes itself, and invalidates it after operations
+    it can't follow (like a reindex switching aliases).
+
+    # Arguments
+        fetch (callable): returns the `indices.get_alias` response
+        ttl (float): seconds the metadata is reused (0 disables the cache)
+
+    """
+
+    # Public
+
+    def __init__(self, fetch, ttl):
+        self.__fetch = fetch
+        self.__ttl = ttl
+        self.__indices = None
+        self.__loaded_at = None
+        self.__lock = threading.Lock()
+
+    def aliases(self):
+        """Return the names of all the aliases, in the order of their indices.
+        """
+        names = (alias for aliases in self.__load().values() for alias in aliases)
+        return list(collections.OrderedDict.fromkeys(names))
+
+    def indices(self, alias=None):
+        """Return the names of the indices pointed to by an alias (by any alias by default).
+        """
+        return [index_name for index_name, aliases in self.__load().items()
+                if alias in aliases or (alias is None and aliases)]
+
+    def add(self, index_name, aliases=()):
+        with self.__lock:
+            if self.__indices is not None:
+                known = self.__indices.setdefault(index_name, [])
+                known.extend(alias for alias in aliases if alias not in known)
+
+    def remove(self, index_names):
+        with self.__lock:
+            if self.__indices is not None:
+                for index_name in index_names:
+                    self.__indices.pop(index_name, None)
+
+    def invalidate(self):
+        with self.__lock:
+            self.__indices = None
+
+    # Private
+
+    def __load(self):
+        with self.__lock:
+            expired = self.__indices is None or \
+                time.time() - self.__loaded_at >= self.__ttl
+            if expired:
+                response = self.__fetch()
+                self.__indices = collections.OrderedDict(
+                    (index_name, list(index.get('aliases', {})))
+                    for index_name, index in response.items()
+                )
+                self.__loaded_at = time.time()
+            return collections.OrderedDict(
+                (index_name, list(aliases)) for index_name, aliases in self.__indices.items())
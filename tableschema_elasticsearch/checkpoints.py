@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import os
+import json
+import itertools
+from elasticsearch.exceptions import NotFoundError
+
+from .failures import FailedItem
+
+
+# Module API
+
+CHECKPOINT_INDEX = 'tableschema-checkpoints'
+DEFAULT_CHECKPOINT_INTERVAL = 10000
+
+
+class FileCheckpoint(object):
+    """Checkpoint of a write stored in a local JSON file.
+
+    The file is replaced atomically on every save, so a crash leaves
+    either the previous or the new checkpoint.
+
+    # Arguments
+        path (str): path of the checkpoint file
+
+    """
+
+    # Public
+
+    def __init__(self, path):
+        self.__path = path
+
+    def __repr__(self):
+        return 'FileCheckpoint {}'.format(self.__path)
+
+    def load(self):
+        """Return the saved state, or `None` when there is no checkpoint.
+        """
+        try:
+            with io.open(self.__path, encoding='utf-8') as file:
+                return json.load(file)
+        except IOError:
+            return None
+
+    def save(self, state):
+        temporary_path = self.__path + '.tmp'
+        with io.open(temporary_path, 'w', encoding='utf-8') as file:
+            file.write(json.dumps(state, ensure_ascii=False))
+            file.flush()
+            os.fsync(file.fileno())
+        getattr(os, 'replace', os.rename)(temporary_path, self.__path)
+
+    def clear(self):
+        if os.path.exists(self.__path):
+            os.remove(self.__path)
+
+
+class IndexCheckpoint(object):
+    """Checkpoint of a write stored as a document in Elasticsearch.
+
+    # Arguments
+        es (object): ElasticSearch instance
+        name (str): id of the checkpoint document (e.g. the name of the load)
+        index (str): index holding the checkpoint documents
+
+    """
+
+    # Public
+
+    def __init__(self, es, name, index=CHECKPOINT_INDEX):
+        self.__es = es
+        self.__name = name
+        self.__index = index
+
+    def __repr__(self):
+        return 'IndexCheckpoint {}/{}'.format(self.__index, self.__name)
+
+    def load(self):
+        """Return the saved state, or `None` when there is no checkpoint.
+        """
+        try:
+            return self.__es.get(index=self.__index, id=self.__name)['_source']
+        except NotFoundError:
+            return None
+
+    def save(self, state):
+        self.__es.index(index=self.__index, id=self.__name, body=state)
+
+    def clear(self):
+        try:
+            self.__es.delete(index=self.__index, id=self.__name)
+        except NotFoundError:
+            pass
+
+
+def resume(rows, checkpoint, generate_doc_id):
+    """Skip the rows already acknowledged according to a checkpoint.
+
+    Returns the iterator of the remaining rows and the number of rows
+    skipped. The document id of the last skipped row is checked against
+    the checkpoint, raising `ValueError` when the rows don't match it
+    (the source must yield the rows in the same order on every run).
+    """
+    rows = iter(rows)
+    state = checkpoint.load()
+    if not state:
+        return rows, 0
+    last_row = None
+    skipped = 0
+    for last_row in itertools.islice(rows, state['acknowledged']):
+        skipped += 1
+    matches = skipped == state['acknowledged']
+    if matches and skipped > 0 and 'last_doc_id' in state:
+        matches = generate_doc_id(last_row) == state['last_doc_id']
+    if not matches:
+        raise ValueError('Rows do not match the checkpoint {} ({} rows acknowledged, '
+                         'last document id {})'.format(checkpoint, state['acknowledged'],
+                                                       state.get('last_doc_id')))
+    return rows, skipped
+
+
+def track(outcomes, checkpoint, generate_doc_id, offset=0,
+          interval=DEFAULT_CHECKPOINT_INTERVAL):
+    """Pass outcomes of `bulk.iter_acknowledged` through, saving checkpoints.
+
+    A checkpoint is saved every `interval` outcomes, counting the `offset`
+    rows skipped by `resume`, and when the write stops before the end
+    (failure or generator closed). It is cleared once all the outcomes
+    went through.
+    """
+    acknowledged = saved = offset
+    last_row = None
+    completed = False
+    try:
+        for outcome in outcomes:
+            acknowledged += 1
+            last_row = outcome
+            if acknowledged - saved >= interval:
+                checkpoint.save(_state(acknowledged, last_row, generate_doc_id))
+                saved = acknowledged
+            yield outcome
+        completed = True
+    finally:
+        if completed:
+            checkpoint.clear()
+        elif acknowledged > saved:
+            checkpoint.save(_state(acknowledged, last_row, generate_doc_id))
+
+
+# Internal
+
+def _state(acknowledged, outcome, generate_doc_id):
+    row = outcome.row if isinstance(outcome, FailedItem) else outcome
+    return {'acknowledged': acknowledged, 'last_doc_id': generate_doc_id(row)}
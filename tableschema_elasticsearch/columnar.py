@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import datetime
+import collections
+import six
+
+from .encoders import dumps, _cast_integer, _cast_number, _cast_geopoint
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+# Module API
+
+BATCH_FORMATS = ('arrow', 'numpy')
+
+
+class ColumnarConverter(object):
+    """Converter of search result pages into typed columns.
+
+    Every page of hits is turned into one Arrow record batch (or a dict of
+    NumPy arrays) typed from the bucket's tableschema descriptor, so only
+    the columns of the current page are ever materialized. Values which
+    can't be cast to their field type become nulls, as Elasticsearch does
+    with `ignore_malformed`.
+
+    # Arguments
+        descriptor (dict): tableschema descriptor of the bucket
+        fields (list): only convert these fields (defaults to all of them)
+
+    """
+
+    # Public
+
+    def __init__(self, descriptor, fields=None):
+        if pyarrow is None:
+            raise RuntimeError('pyarrow is required for columnar reads, install it with '
+                               '`pip install tableschema-elasticsearch[columnar]`')
+        schema_fields = descriptor.get('fields', [])
+        if fields is not None:
+            by_name = dict((field['name'], field) for field in schema_fields)
+            schema_fields = [by_name.get(name, {'name': name, 'type': 'any'})
+                             for name in fields]
+        self.__columns = [
+            (field['name'],) + _compile_column(field)
+            for field in schema_fields
+        ]
+        self.__schema = pyarrow.schema([
+            pyarrow.field(name, type_) for name, type_, _ in self.__columns
+        ])
+
+    @property
+    def schema(self):
+        """pyarrow.Schema of the record batches
+        """
+        return self.__schema
+
+    def to_columns(self, hits):
+        """Return the cast values of a page of hits, column by column.
+        """
+        sources = [hit.get('_source') or {} for hit in hits]
+        columns = collections.OrderedDict()
+        for name, _, cast in self.__columns:
+            columns[name] = [
+                cast(source.get(name)) if source.get(name) is not None else None
+                for source in sources
+            ]
+        return columns
+
+    def to_record_batch(self, hits):
+        """Convert a page of hits to a `pyarrow.RecordBatch`.
+        """
+        columns = self.to_columns(hits)
+        arrays = [
+            pyarrow.array(columns[name], type=type_)
+            for name, type_, _ in self.__columns
+        ]
+        return pyarrow.RecordBatch.from_arrays(arrays, schema=self.__schema)
+
+    def to_arrays(self, hits):
+        """Convert a page of hits to a dict of NumPy arrays.
+        """
+        batch = self.to_record_batch(hits)
+        return collections.OrderedDict(
+            (name, column.to_numpy(zero_copy_only=False))
+            for name, column in zip(batch.schema.names, batch.columns)
+        )
+
+    def convert(self, hits, format='arrow'):
+        """Convert a page of hits to the given format (`arrow` or `numpy`).
+        """
+        if format == 'numpy':
+            return self.to_arrays(hits)
+        return self.to_record_batch(hits)
+
+
+def check_batch_format(format):
+    if format not in BATCH_FORMATS:
+        raise ValueError('format must be one of {}, got {!r}'.format(
+            ', '.join(BATCH_FORMATS), format))
+    return format
+
+
+# Internal
+
+def _compile_column(field):
+    # Returns the `(arrow type, cast)` of a field; untyped values are kept as JSON
+    schema_type = field.get('type', 'any')
+    if schema_type == 'array':
+        item_type, cast = _compile_column(dict(field, type=field.get('es:itemType', 'any')))
+        return pyarrow.list_(item_type), lambda value: [
+            cast(v) if v is not None else None
+            for v in (value if isinstance(value, list) else [value])
+        ]
+    if schema_type in ('integer', 'year'):
+        return pyarrow.int64(), _nullify(_cast_integer, six.integer_types)
+    if schema_type == 'number':
+        return pyarrow.float64(), _nullify(_cast_number, (float,) + six.integer_types)
+    if schema_type == 'boolean':
+        return pyarrow.bool_(), _cast_boolean
+    if schema_type == 'string':
+        return pyarrow.string(), _cast_string
+    if schema_type in ('date', 'datetime', 'time'):
+        return _compile_date_column(schema_type, field.get('format'))
+    if schema_type == 'geopoint':
+        geopoint_type = pyarrow.struct([('lat', pyarrow.float64()),
+                                        ('lon', pyarrow.float64())])
+        return geopoint_type, _nullify(_cast_geopoint, dict)
+    if schema_type == 'object' and field.get('es:index', True) and 'es:schema' in field:
+        return _compile_object_column(field['es:schema'])
+    return pyarrow.string(), _cast_json
+
+
+def _compile_object_column(schema):
+    members = [(field['name'],) + _compile_column(field) for field in schema['fields']]
+    struct_type = pyarrow.struct([(name, type_) for name, type_, _ in members])
+
+    def cast(value):
+        if not isinstance(value, dict):
+            return None
+        return dict(
+            (name, cast_(value[name]) if value.get(name) is not None else None)
+            for name, _, cast_ in members
+        )
+
+    return struct_type, cast
+
+
+def _compile_date_column(schema_type, fmt):
+    arrow_type, convert = {
+        'date': (pyarrow.date32(), lambda value: value.date()),
+        'datetime': (pyarrow.timestamp('us'), lambda value: value),
+        'time': (pyarrow.time64('us'), lambda value: value.time()),
+    }[schema_type]
+    parse = _parse_iso_date if fmt in (None, 'default', 'any') else \
+        (lambda value: datetime.datetime.strptime(value, fmt))
+
+    def cast(value):
+        # Malformed dates kept by `ignore_malformed` may be of any type (epoch ints...)
+        if not isinstance(value, six.string_types):
+            return None
+        try:
+            return convert(parse(value))
+        except (TypeError, ValueError):
+            return None
+
+    return arrow_type, cast
+
+
+def _parse_iso_date(value):
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    if 'T' not in value and ':' in value:
+        value = '1900-01-01T' + value
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _nullify(cast, types):
+    # The encoder casts pass invalid values through, columns need nulls instead
+    def nullified(value):
+        value = cast(value)
+        if isinstance(value, types) and not isinstance(value, bool):
+            return value
+        return None
+    return nullified
+
+
+def _cast_boolean(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, six.string_types):
+        return {'true': True, 'false': False}.get(value.strip().lower())
+    return None
+
+
+def _cast_json(value):
+    if isinstance(value, six.string_types):
+        return value
+    return dumps(value).decode('utf-8')
+
+
+def _cast_string(value):
+    return value if isinstance(value, six.text_type) else six.text_type(value)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import uuid
+import hashlib
+import decimal
+import datetime
+import six
+from elasticsearch.serializer import JSONSerializer
+
+from .mappers import MappingGenerator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Module API
+
+class RowEncoder(object):
+    """Rows encoder compiled from a tableschema descriptor.
+
+    Casts every field of a row to the wire format expected by the mapping
+    `MappingGenerator` generates for the same descriptor (dates in the
+    mapping format, numbers as floats, geopoints as `lat`/`lon` objects...).
+    The casts are resolved once per schema, so encoding a row is a single
+    pass over its declared fields; other values are passed through.
+
+    # Arguments
+        descriptor (dict): tableschema descriptor
+        mapping_generator_cls: subclass of MappingGenerator used for the mapping
+
+    """
+
+    # Public
+
+    def __init__(self, descriptor, mapping_generator_cls=None):
+        if mapping_generator_cls is None:
+            mapping_generator_cls = MappingGenerator
+        self.__casts = [
+            (field['name'], cast)
+            for field, cast in (
+                (field, _compile_field(field, mapping_generator_cls))
+                for field in descriptor.get('fields', [])
+            )
+            if cast is not None
+        ]
+
+    def cast(self, row):
+        """Return a copy of the row with its fields in wire format.
+        """
+        result = dict(row)
+        for name, cast in self.__casts:
+            value = result.get(name)
+            if value is not None:
+                result[name] = cast(value)
+        return result
+
+    def encode(self, row):
+        """Cast and serialize a row to JSON bytes.
+        """
+        return dumps(self.cast(row))
+
+
+def get_encoder(descriptor, mapping_generator_cls=None):
+    """Return the (cached) `RowEncoder` of a descriptor and mapping generator.
+    """
+    key = (json.dumps(descriptor, sort_keys=True, default=str), mapping_generator_cls)
+    encoder = _ENCODERS.get(key)
+    if encoder is None:
+        encoder = _ENCODERS[key] = RowEncoder(descriptor, mapping_generator_cls)
+    return encoder
+
+
+def dumps(value):
+    """Serialize a value to JSON bytes, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_default)
+    return json.dumps(value, default=_default, separators=(',', ':'),
+                      ensure_ascii=False).encode('utf-8')
+
+
+def content_hash(value):
+    """Hash the content of a row (independently of the order of its keys).
+    """
+    if orjson is not None:
+        data = orjson.dumps(value, default=_default, option=orjson.OPT_SORT_KEYS)
+    else:
+        data = json.dumps(value, default=_default, separators=(',', ':'), sort_keys=True,
+                          ensure_ascii=False).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+# Internal
+
+_ENCODERS = {}
+_CLIENT_SERIALIZER = JSONSerializer()
+
+
+def _compile_field(field, mapping_generator_cls):
+    schema_type = field['type']
+    if schema_type == 'array':
+        item = dict(field, type=field.get('es:itemType'))
+        cast = _compile_field(item, mapping_generator_cls) if item['type'] else None
+        if cast is None:
+            return None
+        return lambda value: ([cast(v) if v is not None else v for v in value]
+                              if isinstance(value, (list, tuple)) else cast(value))
+    if schema_type in ('integer', 'year'):
+        return _cast_integer
+    if schema_type == 'number':
+        return _cast_number
+    if schema_type in ('date', 'datetime', 'time'):
+        fmt = field.get('format')
+        if mapping_generator_cls._convert_date_format(fmt) == 'strict_date_optional_time':
+            return _cast_iso_date
+        return lambda value: _cast_formatted_date(value, fmt)
+    if schema_type == 'geopoint':
+        return _cast_geopoint
+    if schema_type == 'object' and field.get('es:index', True) and 'es:schema' in field:
+        encoder = RowEncoder(field['es:schema'], mapping_generator_cls)
+        return lambda value: encoder.cast(value) if isinstance(value, dict) else value
+    return None
+
+
+def _cast_integer(value):
+    if isinstance(value, six.integer_types) and not isinstance(value, bool):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _cast_number(value):
+    if isinstance(value, (float, six.integer_types)) and not isinstance(value, bool):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _cast_iso_date(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def _cast_formatted_date(value, fmt):
+    if isinstance(value, (datetime.date, datetime.time)):
+        # The mapping format only keeps milliseconds for %f
+        if '%f' in fmt:
+            fmt = fmt.replace('%f', '{:03d}'.format(getattr(value, 'microsecond', 0) // 1000))
+        return value.strftime(fmt)
+    return value
+
+
+def _cast_geopoint(value):
+    try:
+        if isinstance(value, dict):
+            return {'lat': float(value['lat']), 'lon': float(value['lon'])}
+        if isinstance(value, six.string_types):
+            value = value.strip()
+            if value.startswith('{'):
+                return _cast_geopoint(json.loads(value))
+            value = json.loads(value) if value.startswith('[') else value.split(',')
+        lon, lat = value
+        return {'lat': float(lat), 'lon': float(lon)}
+    except (KeyError, TypeError, ValueError):
+        return value
+
+
+def _default(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    # Other types (numpy, pandas...) are serialized as the client would
+    return _CLIENT_SERIALIZER.default(value)
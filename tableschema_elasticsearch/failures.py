@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import collections
+import six
+
+from . import encoders
+
+
+# Module API
+
+FailedItem = collections.namedtuple('FailedItem', 'row position doc_id status error')
+
+
+class WriteReport(object):
+    """Summary of a `write`, filled in as rows are acknowledged or fail.
+
+    Pass an instance as the `report` argument of `Storage.write` and read
+    it once the write is over.
+    """
+
+    # Public
+
+    def __init__(self):
+        self.succeeded = 0
+        self.failed = 0
+        self.error_types = collections.Counter()
+
+    def __repr__(self):
+        return 'WriteReport (succeeded: {}, failed: {})'.format(self.succeeded, self.failed)
+
+    def add_success(self):
+        self.succeeded += 1
+
+    def add_failure(self, item):
+        self.failed += 1
+        self.error_types[error_type(item.error)] += 1
+
+    def as_dict(self):
+        return {
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'error_types': dict(self.error_types),
+        }
+
+
+class DeadLetterFile(object):
+    """NDJSON file receiving the rows which failed to be written.
+
+    Every line holds the `position` of the row in the written iterable,
+    its `doc_id`, the bulk `status` and `error` and the `row` itself. The
+    file is only created (or appended to) once a row has failed.
+
+    # Arguments
+        path (str): path of the file
+
+    """
+
+    # Public
+
+    def __init__(self, path):
+        self.__path = path
+        self.__file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __call__(self, item):
+        if self.__file is None:
+            self.__file = io.open(self.__path, 'ab')
+        self.__file.write(encoders.dumps(item._asdict()) + b'\n')
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+
+def error_type(error):
+    """Return the type of a bulk item error (`type` of Elasticsearch errors).
+    """
+    if isinstance(error, dict):
+        return error.get('type', 'unknown')
+    if isinstance(error, six.string_types):
+        return error
+    return type(error).__name__
+
+
+def handle_outcomes(outcomes, on_error=None, report=None, start=0):
+    """Yield the acknowledged rows of `bulk.iter_acknowledged` outcomes.
+
+    Failed items get the position of their row in the written iterable
+    (the first outcome being at `start`) and are passed to `on_error`;
+    all outcomes are counted in `report`.
+    """
+    for position, outcome in enumerate(outcomes, start):
+        if handle_outcome(outcome, position, on_error, report):
+            yield outcome
+
+
+def handle_outcome(outcome, position, on_error=None, report=None):
+    """Handle one outcome of `handle_outcomes`, returning whether it is a row.
+    """
+    if isinstance(outcome, FailedItem):
+        outcome = outcome._replace(position=position)
+        if report is not None:
+            report.add_failure(outcome)
+        if on_error is not None:
+            on_error(outcome)
+        return False
+    if report is not None:
+        report.add_success()
+    return True
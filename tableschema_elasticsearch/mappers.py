@@ -6,9 +6,27 @@ from __future__ import unicode_literals
 
 from copy import copy
 import re
+import collections
+import six
 
 # Module API
 
+RANGE_OPERATORS = ('gt', 'gte', 'lt', 'lte')
+CONTENT_HASH_FIELD = 'tableschema_content_hash'
+DESCRIPTOR_META_KEY = 'tableschema'
+# Sub-field of string fields holding their exact value, for equality filters
+KEYWORD_SUBFIELD = 'keyword'
+KEYWORD_IGNORE_ABOVE = 256
+MAPPING_NOOP = 'noop'
+MAPPING_ADDITIVE = 'additive'
+MAPPING_BREAKING = 'breaking'
+# Field parameters `put_mapping` can change on an existing field
+UPDATABLE_PARAMETERS = ('dynamic', 'fields', 'ignore_above', 'ignore_malformed', 'meta',
+                        'search_analyzer', 'search_quote_analyzer')
+# Values Elasticsearch uses for (and may leave out of) unset parameters
+PARAMETER_DEFAULTS = {'type': 'object', 'enabled': True, 'index': True, 'doc_values': True,
+                      'ignore_malformed': False, 'dynamic': True}
+
 
 class MappingGenerator(object):
 
@@ -23,8 +41,8 @@ class MappingGenerator(object):
         'f': 'SSS',
     }
 
-    def __init__(self, base={}):
-        self._mapping = base
+    def __init__(self, base=None):
+        self._mapping = {} if base is None else base
 
     @classmethod
     def _quote_literals(cls, s):
@@ -72,7 +90,9 @@ class MappingGenerator(object):
                        'scaling_factor': 100,
                        'ignore_malformed': True,
                        'index': False},
-            'string': {'type': 'text'},
+            'string': {'type': 'text',
+                       'fields': {KEYWORD_SUBFIELD: {'type': 'keyword',
+                                                     'ignore_above': KEYWORD_IGNORE_ABOVE}}},
             'boolean': {'type': 'boolean'},
             'date': {'type': 'date',
                      'ignore_malformed': True,
@@ -124,6 +144,12 @@ class MappingGenerator(object):
         properties = {}
         self._mapping['properties'] = properties
         self._update_properties(properties, schema)
+        if schema.get('es:contentHash'):
+            # Hash of the row written by `Storage.write(skip_unchanged=True)`
+            properties[CONTENT_HASH_FIELD] = {'type': 'keyword', 'index': False}
+        if get_routing_key(schema) is not None:
+            # Rows are written with their routing, so reads without it are errors
+            self._mapping['_routing'] = {'required': True}
 
     def get_mapping(self):
         return self._mapping
@@ -140,8 +166,255 @@ def descriptor_to_mapping(descriptor, mapping_generator_cls=None):
     return mapping_gen.get_mapping()
 
 
-def columns_and_constraints_to_descriptor(prefix, tablename, columns,
-                                          constraints, autoincrement_column):
+def get_routing_key(descriptor):
+    """Return the field routing the rows of a descriptor (`es:routingKey`), or `None`.
+    """
+    name = (descriptor or {}).get('es:routingKey')
+    if name is None:
+        return None
+    if name not in [field['name'] for field in descriptor.get('fields', [])]:
+        raise ValueError('es:routingKey must name a field, got {!r}'.format(name))
+    return name
+
+
+class MappingDiff(collections.namedtuple('MappingDiff', 'added updated conflicts')):
+    """Differences between a live mapping and the mapping to put.
+
+    `added` lists the new fields, `updated` the changed parameters which
+    can be updated in place (as `field[parameter]`, or `_meta`) and
+    `conflicts` the changed parameters which can't.
+    """
+
+    @property
+    def kind(self):
+        """`noop`, `additive` (safe to put) or `breaking` (needs a reindex)
+        """
+        if self.conflicts:
+            return MAPPING_BREAKING
+        if self.added or self.updated:
+            return MAPPING_ADDITIVE
+        return MAPPING_NOOP
+
+
+def diff_mappings(current, target):
+    """Compare the live mapping of an index with the mapping to put.
+
+    Parameters are compared the way Elasticsearch reports them (booleans
+    may come back as strings, numbers as floats, defaults may be left
+    out), so a mapping put earlier compares as unchanged. Parameters of
+    the live mapping the target leaves unset are kept by `put_mapping`
+    and don't count as changes.
+    """
+    added = []
+    updated = []
+    conflicts = []
+    if (current.get('_meta') or {}) != (target.get('_meta') or {}):
+        updated.append('_meta')
+    if _routing_required(current) != _routing_required(target):
+        # Documents stay on the shards their routing (or its absence) sent them to
+        conflicts.append('_routing')
+    _diff_properties(current.get('properties', {}), target.get('properties', {}), '',
+                     added, updated, conflicts)
+    return MappingDiff(added, updated, conflicts)
+
+
+def filters_to_query(filters, descriptor=None):
+    """Convert simple row filters to an ElasticSearch query.
+
+    Filters map field names to either a value (equality), a list of values
+    (`in`) or a dict of range operators (`gt`, `gte`, `lt`, `lte`). All the
+    filters must match. The `string` fields of the descriptor are matched
+    exactly on their keyword sub-field (values longer than
+    `KEYWORD_IGNORE_ABOVE` characters are not indexed there); string values
+    of other fields are matched as phrases.
+    """
+    keyword_fields = _keyword_fields(descriptor)
+    clauses = []
+    for name, condition in sorted(filters.items()):
+        keyword = name in keyword_fields
+        if keyword:
+            name = '{}.{}'.format(name, KEYWORD_SUBFIELD)
+        if isinstance(condition, dict):
+            unknown = set(condition) - set(RANGE_OPERATORS)
+            if unknown:
+                raise ValueError('Unsupported filter operators for {}: {}'
+                                 .format(name, ', '.join(sorted(unknown))))
+            clauses.append({'range': {name: dict(condition)}})
+        elif isinstance(condition, (list, tuple, set)):
+            values = list(condition)
+            if not keyword and any(isinstance(value, six.string_types) for value in values):
+                clauses.append({'bool': {
+                    'should': [_equals(name, value) for value in values],
+                    'minimum_should_match': 1,
+                }})
+            else:
+                clauses.append({'terms': {name: values}})
+        else:
+            clauses.append({'term': {name: condition}} if keyword else _equals(name, condition))
+    return {'bool': {'filter': clauses}}
+
+
+class DescriptorGenerator(object):
+    """Inverse of `MappingGenerator`, rebuilding a descriptor from a mapping.
+
+    Used by `Storage.describe` for indices created without the descriptor
+    in their `_meta`. Types the mapping can't tell apart are resolved to
+    the widest one (`long` fields become `integer`, not `year`, and date
+    fields are `date`, `time` or `datetime` depending on their format).
+    """
+
+    DATE_CONVERSION = dict(
+        (value, key) for key, value in MappingGenerator.DATE_CONVERSION.items()
+    )
+
+    def __init__(self, base=None):
+        self._descriptor = dict(base or {})
+
+    @classmethod
+    def _convert_date_format(cls, fmt):
+        # Returns the strftime format of an Elasticsearch date format, or None
+        if fmt in (None, 'strict_date_optional_time'):
+            return None
+        tokens = re.findall(r"'[^']*'|[a-zA-Z]+|[^'a-zA-Z]+", fmt)
+        result = ''
+        for token in tokens:
+            if token.startswith("'"):
+                result += token[1:-1]
+            elif token.isalpha():
+                if token not in cls.DATE_CONVERSION:
+                    return None
+                result += '%' + cls.DATE_CONVERSION[token]
+            else:
+                result += token
+        return result
+
+    @classmethod
+    def _convert_date(cls, prop):
+        field = {'type': 'datetime'}
+        fmt = cls._convert_date_format(prop.get('format'))
+        if fmt is not None:
+            has_date = any('%' + part in fmt for part in 'dmyY')
+            has_time = any('%' + part in fmt for part in 'HMSf')
+            if not has_time:
+                field['type'] = 'date'
+            elif not has_date:
+                field['type'] = 'time'
+            field['format'] = fmt
+        return field
+
+    @classmethod
+    def _convert_property(cls, name, prop):
+        es_type = prop.get('type', 'object')
+        if es_type in ('long', 'integer', 'short', 'byte'):
+            field = {'type': 'integer'}
+        elif es_type in ('scaled_float', 'float', 'double', 'half_float'):
+            field = {'type': 'number'}
+        elif es_type in ('text', 'keyword'):
+            field = {'type': 'string'}
+        elif es_type == 'boolean':
+            field = {'type': 'boolean'}
+        elif es_type == 'date':
+            field = cls._convert_date(prop)
+        elif es_type == 'geo_point':
+            field = {'type': 'geopoint'}
+        elif es_type == 'object' and prop.get('enabled', True) is False:
+            field = {'type': 'object', 'es:index': False}
+        elif es_type == 'object':
+            field = {'type': 'object',
+                     'es:schema': cls._convert_properties(prop.get('properties', {}))}
+        else:
+            field = {'type': 'any'}
+        return dict([('name', name)], **field)
+
+    @classmethod
+    def _convert_properties(cls, properties):
+        return {'fields': [
+            cls._convert_property(name, prop)
+            for name, prop in sorted(properties.items())
+            if name != CONTENT_HASH_FIELD
+        ]}
+
+    def generate_from_mapping(self, mapping):
+        properties = mapping.get('properties', {})
+        self._descriptor.update(self._convert_properties(properties))
+        if CONTENT_HASH_FIELD in properties:
+            self._descriptor['es:contentHash'] = True
+
+    def get_descriptor(self):
+        return self._descriptor
+
+
+def mapping_to_descriptor(mapping, descriptor_generator_cls=None):
     """Convert ElasticSearch Mapping to descriptor.
+
+    The descriptor stored in the mapping `_meta` by `Storage.create` is
+    returned as is, other mappings are converted by the generator.
     """
-    raise NotImplementedError
+    meta = mapping.get('_meta') or {}
+    if DESCRIPTOR_META_KEY in meta:
+        return meta[DESCRIPTOR_META_KEY]
+    if descriptor_generator_cls is None:
+        descriptor_generator_cls = DescriptorGenerator
+    descriptor_gen = descriptor_generator_cls()
+    descriptor_gen.generate_from_mapping(mapping)
+    return descriptor_gen.get_descriptor()
+
+
+# Internal
+
+def _diff_properties(current, target, prefix, added, updated, conflicts):
+    for name, prop in sorted(target.items()):
+        path = prefix + name
+        if name not in current:
+            added.append(path)
+            continue
+        existing = current[name]
+        if 'properties' in prop:
+            _diff_properties(existing.get('properties', {}), prop['properties'], path + '.',
+                             added, updated, conflicts)
+        for key in sorted(set(prop) | set(existing)):
+            if key == 'properties':
+                continue
+            if key not in prop and key not in PARAMETER_DEFAULTS:
+                continue
+            value = prop.get(key, PARAMETER_DEFAULTS.get(key))
+            if key in existing or key in PARAMETER_DEFAULTS:
+                if _normalize(existing.get(key, PARAMETER_DEFAULTS.get(key))) == \
+                        _normalize(value):
+                    continue
+            change = '{}[{}]'.format(path, key)
+            (updated if key in UPDATABLE_PARAMETERS else conflicts).append(change)
+
+
+def _keyword_fields(descriptor, prefix=''):
+    # Returns the (dotted) names of the string fields of a descriptor
+    names = set()
+    for field in (descriptor or {}).get('fields', []):
+        schema_type = field['type']
+        if schema_type == 'array':
+            schema_type = field.get('es:itemType')
+        if schema_type == 'string':
+            names.add(prefix + field['name'])
+        elif schema_type == 'object' and field.get('es:index', True) and 'es:schema' in field:
+            names.update(_keyword_fields(field['es:schema'], prefix + field['name'] + '.'))
+    return names
+
+
+def _routing_required(mapping):
+    return _normalize((mapping.get('_routing') or {}).get('required', False))
+
+
+def _normalize(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, six.string_types) and value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    if isinstance(value, six.integer_types + (float,)):
+        return float(value)
+    return value
+
+
+def _equals(name, value):
+    if isinstance(value, six.string_types):
+        return {'match_phrase': {name: value}}
+    return {'term': {name: value}}
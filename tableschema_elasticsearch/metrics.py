@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import time
+import socket
+import threading
+import contextlib
+import collections
+
+
+# Module API
+
+class Metrics(object):
+    """Metrics sink of `Storage`, doing nothing.
+
+    Subclasses receive timings (in seconds) and counts, both with optional
+    tags (the `index` or `bucket` they concern). `Storage` reports:
+
+    - `bulk.latency`, `bulk.docs`, `bulk.bytes`, `bulk.rejected`, `bulk.failed`,
+      `bulk.skipped` and `bulk.backoff` for every bulk request of `write`
+      (`bulk.bytes` only for requests serialized client side, i.e. writes
+      with a `descriptor`, `chunk_bytes` or `processes`)
+    - `write.prepare`: client side time spent building every chunk
+      (document ids, casting and serialization)
+    - `search.latency` and `search.hits` for every page of `iter`
+    - `mget.latency` and `mget.docs` for every batch of `get_many`
+    - `create`, `put_mapping`, `reindex`, `refresh` and `flush` durations
+    - `mapping.noop`, `mapping.additive` and `mapping.breaking` counts of
+      the mapping changes `create` found on existing buckets
+
+    Comparing `write.prepare` with `bulk.latency` and `bulk.backoff` tells
+    client side CPU apart from cluster side backpressure.
+    """
+
+    # Public
+
+    def timing(self, name, seconds, tags=None):
+        pass
+
+    def count(self, name, value=1, tags=None):
+        pass
+
+    @contextlib.contextmanager
+    def timer(self, name, tags=None):
+        """Report the duration of the wrapped block as a timing.
+        """
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.timing(name, time.time() - started, tags)
+
+    def timed(self, iterable, name, tags=None):
+        """Pass items through, reporting the time taken to produce each one.
+        """
+        iterator = iter(iterable)
+        while True:
+            started = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.timing(name, time.time() - started, tags)
+            yield item
+
+
+NO_METRICS = Metrics()
+
+
+class InMemoryCollector(Metrics):
+    """Metrics collected in memory, to be summarized after an operation.
+
+    Thread safe, as bulk requests and search slices report from threads.
+    """
+
+    # Public
+
+    def __init__(self):
+        self.__timings = collections.defaultdict(list)
+        self.__counts = collections.Counter()
+        self.__lock = threading.Lock()
+
+    def timing(self, name, seconds, tags=None):
+        with self.__lock:
+            self.__timings[_key(name, tags)].append(seconds)
+
+    def count(self, name, value=1, tags=None):
+        with self.__lock:
+            self.__counts[_key(name, tags)] += value
+
+    def timings(self, name, tags=None):
+        """Return the timings reported under a name (and tags).
+        """
+        with self.__lock:
+            return list(self.__timings.get(_key(name, tags), []))
+
+    def counts(self, name, tags=None):
+        """Return the total count reported under a name (and tags).
+        """
+        with self.__lock:
+            return self.__counts.get(_key(name, tags), 0)
+
+    def summary(self):
+        """Return the timings and counts by name, over all their tags.
+
+        Timings are summarized as `count`, `total`, `min`, `mean`, `p50`,
+        `p95` and `max` (in seconds).
+        """
+        timings = collections.defaultdict(list)
+        counts = collections.Counter()
+        with self.__lock:
+            for (name, _), values in self.__timings.items():
+                timings[name].extend(values)
+            for (name, _), value in self.__counts.items():
+                counts[name] += value
+        return {
+            'timings': dict((name, _summarize(values)) for name, values in timings.items()),
+            'counts': dict(counts),
+        }
+
+    def reset(self):
+        with self.__lock:
+            self.__timings.clear()
+            self.__counts.clear()
+
+
+class StatsdMetrics(Metrics):
+    """Metrics sent to a StatsD daemon over UDP.
+
+    Timings are sent in milliseconds (`|ms`) and counts as counters (`|c`),
+    with tags in the DogStatsD `|#key:value` extension unless disabled
+    (Prometheus' statsd_exporter maps both to labels). Sending never
+    raises: metrics are dropped when the daemon can't be reached.
+
+    # Arguments
+        host (str): StatsD host
+        port (int): StatsD port
+        prefix (str): prefix of the metric names
+        tags (bool): whether to send the tags
+
+    """
+
+    # Public
+
+    def __init__(self, host='localhost', port=8125, prefix='tableschema_elasticsearch',
+                 tags=True):
+        self.__address = (host, port)
+        self.__prefix = prefix + '.' if prefix else ''
+        self.__tags = tags
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def timing(self, name, seconds, tags=None):
+        self.__send(name, '{:.3f}|ms'.format(seconds * 1000), tags)
+
+    def count(self, name, value=1, tags=None):
+        self.__send(name, '{}|c'.format(value), tags)
+
+    def close(self):
+        self.__socket.close()
+
+    # Private
+
+    def __send(self, name, value, tags):
+        line = '{}{}:{}'.format(self.__prefix, name, value)
+        if tags and self.__tags:
+            line += '|#' + ','.join('{}:{}'.format(k, v) for k, v in sorted(tags.items()))
+        try:
+            self.__socket.sendto(line.encode('utf-8'), self.__address)
+        except (socket.error, OSError):
+            pass
+
+
+# Internal
+
+def _key(name, tags):
+    return name, tuple(sorted(tags.items())) if tags else ()
+
+
+def _summarize(values):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'total': sum(values),
+        'min': values[0],
+        'mean': sum(values) / len(values),
+        'p50': _percentile(values, 0.5),
+        'p95': _percentile(values, 0.95),
+        'max': values[-1],
+    }
+
+
+def _percentile(values, fraction):
+    # Nearest rank percentile of sorted values
+    return values[min(len(values) - 1, int(fraction * len(values)))]
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import datetime
+import six
+
+from .columnar import _parse_iso_date
+
+
+# Module API
+
+PARTITION_PERIODS = {
+    'day': '%Y.%m.%d',
+    'month': '%Y.%m',
+    'year': '%Y',
+}
+DEFAULT_PARTITION_PERIOD = 'month'
+PARTITION_INFIX = '_partition_'
+
+
+class Partitioner(object):
+    """Router of the rows of a partitioned bucket to per-period indices.
+
+    A bucket is partitioned by setting `es:partitionField` in its
+    descriptor to one of its `date`/`datetime` fields, and optionally
+    `es:partitionPeriod` to `day`, `month` (default) or `year`. Every
+    period gets its own index, named `<bucket>_partition_<period>` and
+    sharing the bucket alias.
+
+    # Arguments
+        bucket (str): name of the bucket
+        field (dict): partition field of the descriptor
+        period (str): `day`, `month` or `year`
+
+    """
+
+    # Public
+
+    def __init__(self, bucket, field, period=DEFAULT_PARTITION_PERIOD):
+        if period not in PARTITION_PERIODS:
+            raise ValueError('es:partitionPeriod must be one of {}, got {!r}'.format(
+                ', '.join(sorted(PARTITION_PERIODS)), period))
+        self.__bucket = bucket
+        self.__field = field['name']
+        self.__format = field.get('format')
+        self.__period = period
+        self.__key_format = PARTITION_PERIODS[period]
+
+    def __repr__(self):
+        return 'Partitioner {} ({} by {})'.format(self.__bucket, self.__field, self.__period)
+
+    @property
+    def field(self):
+        return self.__field
+
+    def index_name(self, row):
+        """Return the name of the partition index of a row.
+        """
+        value = _parse_date(row.get(self.__field), self.__format)
+        if value is None:
+            raise ValueError('Row has no valid partition value in {}: {!r}'.format(
+                self.__field, row.get(self.__field)))
+        return self.__bucket + PARTITION_INFIX + value.strftime(self.__key_format)
+
+    def is_partition(self, index_name):
+        return self.__period_start(index_name) is not None
+
+    def select(self, index_names, condition):
+        """Return the partitions which may hold rows matching a filter condition.
+
+        The condition is the `Storage.iter` filter of the partition field:
+        a value, a list of values or a dict of range operators. Partitions
+        are kept when their period overlaps the condition; conditions which
+        can't be parsed keep them all.
+        """
+        intervals = _intervals(condition, self.__format)
+        selected = []
+        for index_name in index_names:
+            start = self.__period_start(index_name)
+            if start is None:
+                continue
+            end = _period_end(start, self.__period)
+            if intervals is None or any((low is None or end > low) and
+                                        (high is None or start < high or
+                                         (start == high and inclusive))
+                                        for low, high, inclusive in intervals):
+                selected.append(index_name)
+        return selected
+
+    def older(self, index_names, before):
+        """Return the partitions whose whole period is before a date.
+        """
+        date = _parse_date(before, self.__format)
+        if date is None:
+            raise ValueError('Invalid partition date: {!r}'.format(before))
+        return [
+            index_name for index_name in index_names
+            if self.is_partition(index_name) and
+            _period_end(self.__period_start(index_name), self.__period) <= date
+        ]
+
+    # Private
+
+    def __period_start(self, index_name):
+        if not is_partition_index(self.__bucket, index_name):
+            return None
+        key = index_name[len(self.__bucket + PARTITION_INFIX):]
+        try:
+            return datetime.datetime.strptime(key, self.__key_format)
+        except ValueError:
+            return None
+
+
+def get_partitioner(bucket, descriptor):
+    """Return the `Partitioner` of a bucket, or `None` if it is not partitioned.
+    """
+    name = (descriptor or {}).get('es:partitionField')
+    if name is None:
+        return None
+    fields = [field for field in descriptor.get('fields', []) if field['name'] == name]
+    if not fields or fields[0]['type'] not in ('date', 'datetime'):
+        raise ValueError('es:partitionField must name a date or datetime field, got {!r}'
+                         .format(name))
+    return Partitioner(bucket, fields[0],
+                       descriptor.get('es:partitionPeriod', DEFAULT_PARTITION_PERIOD))
+
+
+def is_partition_index(bucket, index_name):
+    """Return whether an index is a partition of a bucket.
+    """
+    return index_name.startswith(bucket + PARTITION_INFIX)
+
+
+# Internal
+
+def _parse_date(value, fmt=None):
+    # Returns a naive UTC datetime, or None
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    if not isinstance(value, six.string_types):
+        return None
+    try:
+        if fmt in (None, 'default', 'any'):
+            return _parse_iso_date(value)
+        return datetime.datetime.strptime(value, fmt)
+    except ValueError:
+        return None
+
+
+def _period_end(start, period):
+    if period == 'day':
+        return start + datetime.timedelta(days=1)
+    if period == 'month':
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return start.replace(year=start.year + 1)
+
+
+def _intervals(condition, fmt):
+    # Returns the (low, high, high inclusive) intervals of a condition, None when unknown
+    if isinstance(condition, dict):
+        low = condition.get('gte', condition.get('gt'))
+        high = condition.get('lte', condition.get('lt'))
+        bounds = [_parse_date(bound, fmt) if bound is not None else None
+                  for bound in (low, high)]
+        if any(bound is None and value is not None
+               for bound, value in zip(bounds, (low, high))):
+            return None
+        return [tuple(bounds) + ('lt' not in condition or 'lte' in condition,)]
+    values = condition if isinstance(condition, (list, tuple, set)) else [condition]
+    dates = [_parse_date(value, fmt) for value in values]
+    if any(date is None for date in dates):
+        return None
+    return [(date, date, True) for date in dates]
+
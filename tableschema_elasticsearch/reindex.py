@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import time
+import warnings
+
+
+# Module API
+
+ROUTING_SCRIPT = ('def value = ctx._source[params.key]; '
+                  'if (value != null) { ctx._routing = String.valueOf(value) }')
+
+class ReindexTask(object):
+    """Handle of a background reindex started by `Storage.create`.
+
+    The reindex runs as a sliced Elasticsearch task. Once the task is seen
+    completed (by `wait` or by polling `status`), the destination index is
+    flushed, the alias (if any) is switched to it in one atomic call and
+    only then are the source indices deleted. When the task failed, the
+    sources are kept and a destination index created for the reindex is
+    deleted.
+
+    # Arguments
+        es (object): ElasticSearch instance
+        task_id (str): id of the reindex task
+        index_name (str): name of the destination index
+        source_index_names (list): indices being migrated
+        alias (str): alias to switch from the source indices to the
+            destination index on completion
+        on_finish (callable): called once the migration is finished (or failed)
+        delete_on_failure (bool): whether the destination index was created
+            for the reindex, and is deleted if it fails
+
+    """
+
+    # Public
+
+    def __init__(self, es, task_id, index_name, source_index_names, alias=None,
+                 on_finish=None, delete_on_failure=False):
+        self.__es = es
+        self.__task_id = task_id
+        self.__index_name = index_name
+        self.__source_index_names = list(source_index_names)
+        self.__alias = alias
+        self.__on_finish = on_finish
+        self.__delete_on_failure = delete_on_failure
+        self.__finished = False
+        self.__last_status = None
+
+    def __repr__(self):
+        return 'ReindexTask {} ({} -> {})'.format(
+            self.__task_id, ', '.join(self.__source_index_names), self.__index_name)
+
+    @property
+    def task_id(self):
+        return self.__task_id
+
+    @property
+    def index_name(self):
+        return self.__index_name
+
+    @property
+    def done(self):
+        return self.__finished
+
+    def status(self):
+        """Fetch the progress of the reindex.
+
+        # Returns
+            dict: `completed`, `total`, `processed`, `remaining`,
+            `docs_per_second` and `elapsed` (seconds)
+
+        """
+        if self.__finished:
+            return self.__last_status
+        with warnings.catch_warnings():
+            # The tasks API is flagged as technical preview by the client
+            warnings.simplefilter('ignore')
+            response = self.__es.tasks.get(task_id=self.__task_id)
+        status = task_status(response)
+        self.__last_status = status
+        if status['completed']:
+            self.__finish(response)
+        return status
+
+    def wait(self, poll_interval=1.0, timeout=None):
+        """Poll the task until it completes and finish the migration.
+
+        # Arguments
+            poll_interval (float): seconds between two polls
+            timeout (float): give up (raising `RuntimeError`) after that many
+                seconds; the task keeps running and can be waited on again
+
+        # Returns
+            dict: the final `status`
+
+        """
+        started = time.time()
+        while True:
+            status = self.status()
+            if status['completed']:
+                return status
+            if timeout is not None and time.time() - started > timeout:
+                raise RuntimeError('Reindex task {} did not complete within {}s'
+                                   .format(self.__task_id, timeout))
+            time.sleep(poll_interval)
+
+    def rethrottle(self, requests_per_second):
+        """Change the rate limit of the running task (`None` to unthrottle).
+        """
+        if requests_per_second is None:
+            requests_per_second = -1
+        self.__es.reindex_rethrottle(task_id=self.__task_id,
+                                     requests_per_second=requests_per_second)
+
+    # Private
+
+    def __finish(self, response):
+        try:
+            check_task_response(self.__task_id, response)
+        except RuntimeError:
+            if self.__delete_on_failure:
+                self.__es.indices.delete(index=self.__index_name, ignore_unavailable=True)
+            if self.__on_finish is not None:
+                self.__on_finish()
+            raise
+        self.__es.indices.flush(index=self.__index_name)
+        if self.__alias is not None:
+            switch_alias(self.__es, self.__alias, self.__index_name,
+                         self.__source_index_names)
+        for source_index_name in self.__source_index_names:
+            self.__es.indices.delete(index=source_index_name)
+        self.__finished = True
+        if self.__on_finish is not None:
+            self.__on_finish()
+
+
+def reindex_body(source_index_names, index_name, routing_key=None):
+    """Build the `reindex` body copying source indices into a new index.
+
+    With a `routing_key`, documents are routed by that field of their
+    source (formatted like `bulk.routing_value`), as the destination
+    mapping then requires a routing.
+    """
+    body = dict(
+        source=dict(
+            index=list(source_index_names)
+        ),
+        dest=dict(
+            index=index_name,
+            version_type='external'
+        )
+    )
+    if routing_key is not None:
+        body['script'] = dict(lang='painless', source=ROUTING_SCRIPT,
+                              params=dict(key=routing_key))
+    return body
+
+
+def task_status(response):
+    """Summarize a `tasks.get` response of a reindex task.
+    """
+    task = response.get('task', {})
+    status = task.get('status', {})
+    total = status.get('total', 0)
+    processed = sum(status.get(key, 0) for key in
+                    ('created', 'updated', 'deleted', 'noops', 'version_conflicts'))
+    elapsed = task.get('running_time_in_nanos', 0) / 1e9
+    return {
+        'completed': response.get('completed', False),
+        'total': total,
+        'processed': processed,
+        'remaining': max(total - processed, 0),
+        'docs_per_second': processed / elapsed if elapsed > 0 else 0.0,
+        'elapsed': elapsed,
+    }
+
+
+def check_task_response(task_id, response):
+    """Raise `RuntimeError` if a completed reindex task failed.
+    """
+    failures = response.get('response', {}).get('failures') or []
+    if response.get('error') or failures:
+        raise RuntimeError('Reindex task {} failed: {}'.format(
+            task_id, response.get('error') or failures))
+
+
+def switch_alias(es, alias, index_name, previous_index_names):
+    """Point an alias at an index instead of the previous ones, atomically.
+    """
+    es.indices.update_aliases(body=switch_alias_body(alias, index_name,
+                                                     previous_index_names))
+
+
+def switch_alias_body(alias, index_name, previous_index_names):
+    """Build the `update_aliases` body used by `switch_alias`.
+    """
+    actions = [dict(add=dict(index=index_name, alias=alias))]
+    for previous_index_name in previous_index_names:
+        actions.append(dict(remove=dict(index=previous_index_name, alias=alias)))
+    return dict(actions=actions)
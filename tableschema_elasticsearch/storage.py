@@ -6,22 +6,49 @@ from __future__ import unicode_literals
 
 import sys
 import datetime
+import contextlib
 import itertools
 import collections
+import threading
 import uuid
+from multiprocessing.pool import ThreadPool
 
+import six
 import logging
+from six.moves import queue
 from elasticsearch import Elasticsearch, __version__ as es_version
-from elasticsearch.helpers import streaming_bulk
-from elasticsearch.exceptions import RequestError
+from elasticsearch.exceptions import NotFoundError, RequestError
 
+from . import bulk
+from . import cache as cache_module
 from . import mappers
+from . import columnar
+from . import encoders
+from . import failures
+from . import checkpoints
+from . import partitions
+from . import metrics as metrics_module
+from .reindex import ReindexTask, reindex_body, switch_alias
 
 
 tracer = logging.getLogger('elasticsearch')
 tracer.setLevel(logging.CRITICAL)
 tracer.addHandler(logging.StreamHandler(sys.stderr))
 
+DEFAULT_PAGE_SIZE = 5000
+DEFAULT_PREFETCH = 4
+DEFAULT_CHUNK_SIZE = 500
+REFRESH_POLICIES = ('none', 'wait_for', 'refresh', 'flush')
+BULK_LOAD_SETTINGS = {
+    'index.refresh_interval': '-1',
+    'index.number_of_replicas': '0',
+}
+SEARCH_KEEP_ALIVE = '5m'
+DEFAULT_MGET_SIZE = 1000
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_METADATA_TTL = 30
+MAX_INDEX_NAMES_LENGTH = 3000  # keeps request lines under `http.max_initial_line_length`
+
 # Module API
 
 
@@ -38,13 +65,28 @@ class Storage(object):
 
     # Arguments
         es (object): ElasticSearch instance
+        refresh (str): default durability/visibility policy of `write`
+            (one of `none`, `wait_for`, `refresh` or `flush`)
+        cache_size (int): number of documents kept by the `get_many` cache
+        metadata_ttl (float): seconds the indices and aliases of the cluster
+            are cached for (see `cache.AliasCache`, 0 to always fetch them)
+        metrics (object): `metrics.Metrics` receiving the timings and counts
+            of the operations (e.g. `metrics.InMemoryCollector()`)
 
     """
 
     # Public
-    def __init__(self, es=None):
+    def __init__(self, es=None, refresh='flush', cache_size=DEFAULT_CACHE_SIZE,
+                 metadata_ttl=DEFAULT_METADATA_TTL, metrics=None):
         # Use the passed `es` or create a new Elasticsearch instance
         self.__es = es if es is not None else Elasticsearch()
+        self.__refresh = _check_refresh_policy(refresh)
+        self.__cache = cache_module.LRUCache(cache_size)
+        self.__aliases = cache_module.AliasCache(
+            lambda: self.__es.indices.get_alias(index='*'), metadata_ttl)
+        self.__descriptors = {}
+        self.__metrics = metrics if metrics is not None else metrics_module.NO_METRICS
+        self.__shard_doc_sort = True
 
     def __repr__(self):
         # Template and format
@@ -54,17 +96,25 @@ class Storage(object):
 
     @property
     def buckets(self):
-        indexes = self.__es.indices.get_alias(index='*')
-        for index_name, index in indexes.items():
-            for alias_name in index.get('aliases', {}).keys():
-                yield alias_name
+        return iter(self.__aliases.aliases())
+
+    def invalidate_cache(self):
+        """Forget the cached indices, aliases, descriptors and documents.
+
+        Needed when other clients change the buckets of the cluster and
+        this storage has to see it before the `metadata_ttl` expires.
+
+        """
+        self.__aliases.invalidate()
+        self.__descriptors.clear()
+        self.__cache.invalidate()
 
     def get_index_name(self, bucket):
         uid = str(uuid.uuid4())[:8]
         today = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
         return '{}_{}_{}'.format(bucket, today, uid)
 
-    def create_index(self, bucket, index_settings=None):
+    def create_index(self, bucket, index_settings=None, alias=True):
         index_name = self.get_index_name(bucket)
         body = None
         if index_settings is not None:
@@ -72,26 +122,63 @@ class Storage(object):
                 settings=index_settings
             )
         self.__es.indices.create(index=index_name, body=body)
-        self.__es.indices.put_alias(index=index_name, name=bucket)
+        if alias:
+            self.__es.indices.put_alias(index=index_name, name=bucket)
+        self.__aliases.add(index_name, [bucket] if alias else [])
         return index_name
 
+    def swap_alias(self, bucket, index_name):
+        """Point a bucket at a new index, then delete its previous indices.
+
+        The alias is moved in one atomic call, so readers of the bucket
+        switch from the old data to the new data without a gap.
+
+        # Arguments
+            bucket(str):
+                Name of the bucket (alias)
+            index_name(str):
+                Index to point the bucket at
+
+        """
+        previous_index_names = [
+            name for name in self.__bucket_indices(bucket)
+            if name != index_name
+        ]
+        switch_alias(self.__es, bucket, index_name, previous_index_names)
+        self.__aliases.add(index_name, [bucket])
+        self.__descriptors.pop(bucket, None)
+        self.__cache.invalidate(bucket)
+        self.__delete_indices(previous_index_names)
+
     def put_mapping(self, bucket, descriptor, index_name, mapping_generator_cls):
-        mapping = mappers.descriptor_to_mapping(
-            descriptor, mapping_generator_cls=mapping_generator_cls
-        )
-        if es_version[0] < 8:
-            self.__es.indices.put_mapping(index=index_name, body=mapping)
-        else:
-            self.__es.indices.put_mapping(index=index_name, **mapping)
+        mapping = _descriptor_mapping(descriptor, mapping_generator_cls)
+        with self.__metrics.timer('put_mapping', {'bucket': bucket}):
+            if es_version[0] < 8:
+                self.__es.indices.put_mapping(index=index_name, body=mapping)
+            else:
+                self.__es.indices.put_mapping(index=index_name, **_mapping_params(mapping))
 
     def generate_doc_id(self, row, primary_key):
-        return '/'.join([str(row.get(k)) for k in primary_key])
+        return bulk.generate_doc_id(row, primary_key)
 
     def create(self, bucket, descriptor,
                reindex=False, always_recreate=False,
-               mapping_generator_cls=None, index_settings=None):
+               mapping_generator_cls=None, index_settings=None,
+               wait_for_reindex=True, reindex_requests_per_second=None,
+               blue_green=False):
         """Create index with mapping by schema.
 
+        The mapping of an existing bucket is compared with the one generated
+        for the descriptor (see `mappers.diff_mappings`): nothing is sent
+        when it is unchanged, additive changes are put in place and breaking
+        ones go straight to the reindex (or fail with the cluster's error).
+        The partitions of a bucket partitioned by `es:partitionField` (see
+        `partitions.Partitioner`) get the additive changes as well.
+
+        When a bucket is rebuilt into a new index (`reindex` on a mapping
+        conflict), the new index is filled without the bucket alias, which is
+        then switched to it atomically before the old indices are deleted.
+
         # Arguments
             bucket(str):
                 Name of index to be created
@@ -106,45 +193,69 @@ class Storage(object):
                 subclass of MappingGenerator
             index_settings:
                 settings which will be used in index creation
+            wait_for_reindex:
+                Block until the reindex (if any) completed. Otherwise
+                return right away and let the caller poll the task
+            reindex_requests_per_second:
+                Rate limit of the reindex (unthrottled by default)
+            blue_green:
+                With `always_recreate` on an existing bucket, leave the new
+                index without the alias so it can be filled (by writing to its
+                name) and then published with `swap_alias`
+
+        # Returns
+            ReindexTask: handle of the reindex, if one was started
+            str: name of the new index when it awaits `swap_alias`
 
         """
-        existing_index_names = []
-        if self.__es.indices.exists_alias(name=bucket):
-            existing_index_names = self.__es.indices.get_alias(name=bucket)
-            existing_index_names = sorted(existing_index_names.keys())
+        self.__cache.invalidate(bucket)
+        self.__descriptors.pop(bucket, None)
+        partitioner = partitions.get_partitioner(bucket, descriptor)
+        existing_index_names = sorted(self.__bucket_indices(bucket))
+        partition_names = [name for name in existing_index_names
+                           if partitions.is_partition_index(bucket, name)]
+        if partition_names and (reindex or always_recreate or partitioner is None):
+            raise ValueError('Bucket {} has partitions, it can only be updated with additive '
+                             'mapping changes of a partitioned descriptor (drop its '
+                             'partitions or delete it first)'.format(bucket))
+        existing_index_names = [name for name in existing_index_names
+                                if name not in partition_names]
 
-        if len(existing_index_names) == 0 or always_recreate:
-            index_name = self.create_index(bucket, index_settings=index_settings)
-            self.put_mapping(bucket, descriptor, index_name, mapping_generator_cls)
+        tags = {'bucket': bucket}
+        created = True
+        with self.__metrics.timer('create', tags):
+            if len(existing_index_names) == 0 or always_recreate:
+                # A replacement index only gets the alias once it has been filled
+                alias = len(existing_index_names) == 0 or not (reindex or blue_green)
+                index_name = self.create_index(bucket, index_settings=index_settings,
+                                               alias=alias)
+                self.put_mapping(bucket, descriptor, index_name, mapping_generator_cls)
 
-        else:
-            index_name = existing_index_names[-1]
-            try:
+            elif self.__update_mapping(bucket, descriptor, existing_index_names[-1],
+                                       mapping_generator_cls, reindex):
+                index_name = existing_index_names.pop(-1)
+                created = False
+
+            else:
+                index_name = self.create_index(bucket, index_settings=index_settings,
+                                               alias=False)
                 self.put_mapping(bucket, descriptor, index_name, mapping_generator_cls)
-                existing_index_names.pop(-1)
 
-            except RequestError:
-                if reindex:
-                    index_name = self.create_index(bucket, index_settings=index_settings)
-                    self.put_mapping(bucket, descriptor, index_name, mapping_generator_cls)
-                else:
-                    raise
+            if partition_names:
+                self.__update_partition_mappings(bucket, descriptor, partition_names,
+                                                 mapping_generator_cls)
 
         if reindex and len(existing_index_names) > 0:
-            reindex_body = dict(
-                source=dict(
-                    index=existing_index_names
-                ),
-                dest=dict(
-                    index=index_name,
-                    version_type='external'
-                )
-            )
-            self.__es.reindex(body=reindex_body)
-            self.__es.indices.flush()
+            task = self.__start_reindex(bucket, existing_index_names, index_name,
+                                        reindex_requests_per_second,
+                                        mappers.get_routing_key(descriptor), created)
+            if wait_for_reindex:
+                with self.__metrics.timer('reindex', tags):
+                    task.wait()
+            return task
 
-            for existing_index_name in existing_index_names:
-                self.__es.indices.delete(index=existing_index_name)
+        if blue_green and always_recreate and len(existing_index_names) > 0:
+            return index_name
 
     def delete(self, bucket=None):
         """Delete index with mapping by schema.
@@ -153,79 +264,921 @@ class Storage(object):
             bucket(str): Name of index to delete
 
         """
-        def internal_delete(bucket):
-            if self.__es.indices.exists_alias(name=bucket):
-                existing_index_names = self.__es.indices.get_alias(name=bucket)
-                existing_index_names = list(existing_index_names.keys())
-                for existing_index_name in existing_index_names:
-                    self.__es.indices.delete(index=existing_index_name)
-
+        self.__cache.invalidate(bucket)
         if bucket is None:
-            for bucket in self.buckets:
-                internal_delete(bucket)
+            self.__descriptors.clear()
+            self.__aliases.invalidate()
+            index_names = self.__aliases.indices()
         else:
-            internal_delete(bucket)
+            self.__descriptors.pop(bucket, None)
+            index_names = self.__bucket_indices(bucket)
+        self.__delete_indices(index_names)
+
+    def drop_partitions(self, bucket, before):
+        """Delete the partitions of a bucket holding only rows older than a date.
+
+        Partitions are whole indices, so they are dropped with a single
+        delete request whatever the number of rows they hold.
+
+        # Arguments
+            bucket(str):
+                Name of a partitioned bucket
+            before(date/datetime/str):
+                Partitions whose period ends at or before this date are dropped
+
+        # Returns
+            list: names of the dropped indices
+
+        """
+        partitioner = partitions.get_partitioner(bucket, self.__known_descriptor(bucket))
+        if partitioner is None:
+            raise ValueError('Bucket {} is not partitioned'.format(bucket))
+        index_names = partitioner.older(self.__es.indices.get_alias(name=bucket), before)
+        self.__cache.invalidate(bucket)
+        self.__delete_indices(index_names)
+        return index_names
+
+    @contextlib.contextmanager
+    def bulk_load(self, bucket, async_translog=False):
+        """Tune the indices of a bucket for ingest while the block runs.
+
+        Refreshes are disabled and replicas dropped (and the translog made
+        asynchronous if requested) until the block exits, at which point the
+        original settings are restored - also when the block raises.
+
+        # Arguments
+            bucket(str):
+                Name of index to tune
+            async_translog(bool):
+                Also fsync the translog asynchronously during the load
+
+        """
+        settings = dict(BULK_LOAD_SETTINGS)
+        if async_translog:
+            settings['index.translog.durability'] = 'async'
+        current = self.__es.indices.get_settings(index=bucket,
+                                                 name=','.join(settings),
+                                                 flat_settings=True)
+        originals = {}
+        for index_name, index in current.items():
+            values = index.get('settings', {})
+            originals[index_name] = dict((key, values.get(key)) for key in settings)
+        for index_name in originals:
+            self.__es.indices.put_settings(index=index_name, body=settings)
+        try:
+            yield
+        finally:
+            for index_name, original in originals.items():
+                self.__es.indices.put_settings(index=index_name, body=original)
 
     def describe(self, bucket, descriptor=None):
-        raise NotImplementedError()
-
-    def iter(self, bucket):
-        from_ = 0
-        size = 100
-        done = False
-        while not done:
-            body = None
-            results = self.__es.search(index=bucket,
-                                       body=body,
-                                       from_=from_,
-                                       size=size)
-            hits = results.get('hits', {}).get('hits', [])
-            for source in hits:
-                yield source.get('_source')
-            done = len(hits) == 0
-            from_ += size
+        """Return the descriptor of a bucket.
+
+        The descriptor is read from the `_meta` of the bucket mapping, where
+        `create` stores it, or rebuilt from the mapping of indices created
+        otherwise (see `mappers.DescriptorGenerator`). It is cached until
+        the bucket is created, swapped or deleted again.
+
+        # Arguments
+            bucket(str):
+                Name of index
+            descriptor(dict):
+                Cache this descriptor for the bucket instead of reading it
+
+        # Returns
+            dict: descriptor
 
-    def read(self, bucket):
+        """
+        if descriptor is not None:
+            self.__descriptors[bucket] = descriptor
+            return descriptor
+        descriptor = self.__descriptors.get(bucket)
+        if descriptor is None:
+            response = self.__es.indices.get_mapping(index=bucket)
+            # The newest index of the bucket, as in `create`
+            index_name = sorted(response.keys())[-1]
+            descriptor = mappers.mapping_to_descriptor(response[index_name]['mappings'])
+            self.__descriptors[bucket] = descriptor
+        return descriptor
+
+    def iter(self, bucket, page_size=DEFAULT_PAGE_SIZE, fields=None, filters=None,
+             slices=None, ordered=False, prefetch=DEFAULT_PREFETCH, routing=None):
+        """Iterate over the rows of a bucket.
+
+        Rows are read from a point-in-time snapshot of the bucket, paging with
+        `search_after` so every page costs the same regardless of its offset.
+        Clusters without point-in-time support, or without the `_shard_doc`
+        sort it relies on (before Elasticsearch 7.12), are read with a scroll instead.
+
+        # Arguments
+            bucket(str):
+                Name of index to read
+            page_size(int):
+                Number of rows fetched per search request
+            fields(list):
+                Only fetch these fields of every row
+            filters(dict):
+                Only fetch the rows matching these filters, evaluated by
+                Elasticsearch: `{field: value}` for equality, `{field: [values]}`
+                for `in` and `{field: {'gte': low, 'lt': high}}` for ranges.
+                String fields of the bucket descriptor are compared exactly
+                (see `mappers.filters_to_query`)
+            slices(int):
+                Split the read into this many slices fetched in parallel threads
+            ordered(bool):
+                With slices, yield pages in a deterministic round-robin
+                slice order instead of as soon as they arrive
+            prefetch(int):
+                With slices, number of pages buffered ahead of the consumer
+                (per slice when ordered)
+            routing(str/list):
+                Only search the shards of these routing values (by default,
+                those of a value or list filter on the `es:routingKey` field)
+
+        """
+        descriptor = self.__known_descriptor(bucket) if filters else None
+        pages = self.__iter_pages(bucket, page_size, _search_body(fields, filters, descriptor),
+                                  slices=slices, ordered=ordered, prefetch=prefetch,
+                                  indices=self.__search_indices(bucket, filters),
+                                  routing=self.__search_routing(bucket, filters, routing))
+        for hits in pages:
+            for hit in hits:
+                yield hit.get('_source')
+
+    def read(self, bucket, **options):
+        """Read all the rows of a bucket.
+
+        # Arguments
+            bucket(str):
+                Name of index to read
+            options:
+                Same options as `iter`
+
+        """
         # Get rows
-        rows = list(self.iter(bucket))
+        rows = list(self.iter(bucket, **options))
 
         return rows
 
-    def write(self, bucket, rows, primary_key, update=False, as_generator=False):
+    def iter_batches(self, bucket, descriptor=None, page_size=DEFAULT_PAGE_SIZE, fields=None,
+                     filters=None, slices=None, ordered=False, prefetch=DEFAULT_PREFETCH,
+                     format='arrow', routing=None):
+        """Iterate over the rows of a bucket, one typed column batch per page.
+
+        Pages are read like in `iter` but every page is converted to columns
+        typed from the descriptor (see `columnar.ColumnarConverter`) instead
+        of being yielded row by row. Requires pyarrow.
+
+        # Arguments
+            bucket(str):
+                Name of index to read
+            descriptor(dict):
+                Descriptor of the bucket, giving the type of every column
+                (defaults to the cached one of `describe`)
+            format(str):
+                `arrow` yields `pyarrow.RecordBatch` objects, `numpy` yields
+                dicts of NumPy arrays keyed by field name
+            options:
+                Same `page_size`, `fields`, `filters`, `slices`, `ordered`,
+                `prefetch` and `routing` options as `iter`
+
+        """
+        if descriptor is None:
+            descriptor = self.describe(bucket)
+        converter = columnar.ColumnarConverter(descriptor, fields=fields)
+        format = columnar.check_batch_format(format)
+        pages = self.__iter_pages(bucket, page_size, _search_body(fields, filters, descriptor),
+                                  slices=slices, ordered=ordered, prefetch=prefetch,
+                                  indices=self.__search_indices(bucket, filters),
+                                  routing=self.__search_routing(bucket, filters, routing))
+        for hits in pages:
+            if len(hits) > 0:
+                yield converter.convert(hits, format=format)
+
+    def read_table(self, bucket, descriptor=None, **options):
+        """Read all the rows of a bucket into a `pyarrow.Table`.
+
+        The table is assembled from the batches of `iter_batches`, so no
+        intermediate row dicts are kept (`table.to_pandas()` gives a DataFrame).
+
+        # Arguments
+            bucket(str):
+                Name of index to read
+            descriptor(dict):
+                Descriptor of the bucket (defaults to the cached one of `describe`)
+            options:
+                Same options as `iter_batches` (except `format`)
+
+        """
+        if descriptor is None:
+            descriptor = self.describe(bucket)
+        schema = columnar.ColumnarConverter(descriptor, fields=options.get('fields')).schema
+        batches = self.iter_batches(bucket, descriptor, **options)
+        return columnar.pyarrow.Table.from_batches(list(batches), schema=schema)
+
+    def get_many(self, bucket, keys, primary_key, fields=None,
+                 batch_size=DEFAULT_MGET_SIZE, concurrency=4, cache=False, routing=None):
+        """Fetch rows by their primary key.
+
+        Document ids are built from the keys with `generate_doc_id` and
+        fetched with `mget` requests of `batch_size` ids, `concurrency` of
+        them in flight at once. Rows of a bucket routed by `es:routingKey`
+        are fetched from the shard of their key when the routing field is
+        part of the primary key, otherwise `routing` must be given.
+        Documents the cluster fails to fetch raise a `RuntimeError` with
+        their error reasons instead of being returned as missing. Rows of
+        partitioned buckets are searched by id across their partitions,
+        so unlike `mget` they are only found once refreshed.
+
+        # Arguments
+            bucket(str):
+                Name of index to read
+            keys:
+                Iterable of keys: dicts of the primary key fields, tuples of
+                their values or, for single field primary keys, values
+            primary_key(list):
+                Field names used to generate the document ids
+            fields(list):
+                Only fetch these fields of every row
+            batch_size(int):
+                Number of ids fetched per `mget` request
+            concurrency(int):
+                Number of `mget` requests kept in flight on a thread pool
+            cache(bool):
+                Look rows up in (and add them to) the storage LRU cache,
+                which `write` invalidates for the bucket. Not used with
+                `fields`
+            routing(str):
+                Routing value of all the keys
+
+        # Returns
+            list: the rows in the order of `keys`, `None` for missing rows
+
+        """
+        key_rows = [_key_row(key, primary_key) for key in keys]
+        doc_ids = [self.generate_doc_id(row, primary_key) for row in key_rows]
+        routings = self.__key_routings(bucket, key_rows, doc_ids, primary_key, routing)
+        cache = cache and fields is None
+        found = {}
+        if cache:
+            for doc_id in doc_ids:
+                row = self.__cache.get(bucket, doc_id)
+                if row is not cache_module.MISSING:
+                    found[doc_id] = row
+        missing = [doc_id for doc_id in collections.OrderedDict.fromkeys(doc_ids)
+                   if doc_id not in found]
+        batches = list(bulk.iter_chunks(missing, batch_size))
+        source = dict(includes=list(fields)) if fields is not None \
+            else dict(excludes=[mappers.CONTENT_HASH_FIELD])
+        # Partitioned buckets alias several indices, which mget can't read through
+        partitioned = partitions.get_partitioner(bucket, self.__known_descriptor(bucket))
+        fetch = self.__search_ids if partitioned else self.__mget
+        for rows in _map_concurrently(lambda batch: fetch(bucket, batch, source, routings),
+                                      batches, concurrency):
+            found.update(rows)
+            if cache:
+                for doc_id, row in rows.items():
+                    self.__cache.put(bucket, doc_id, row)
+        return [found.get(doc_id) for doc_id in doc_ids]
+
+    def write(self, bucket, rows, primary_key, update=False, as_generator=False,
+              chunk_size=None, concurrency=1, bulk_load=False,
+              refresh=None, descriptor=None, processes=None, chunk_bytes=None,
+              max_retries=bulk.DEFAULT_RETRY.max_retries,
+              initial_backoff=bulk.DEFAULT_RETRY.initial_backoff,
+              on_error=None, dead_letter=None, report=None, checkpoint=None,
+              checkpoint_interval=checkpoints.DEFAULT_CHECKPOINT_INTERVAL,
+              skip_unchanged=False, mapping_generator_cls=None):
+        """Write rows to a bucket.
 
+        # Arguments
+            bucket(str):
+                Name of index to write to
+            rows:
+                Iterable of row dicts
+            primary_key(list):
+                Field names used to generate the document ids
+            update(bool):
+                Upsert partial documents instead of replacing them
+            as_generator(bool):
+                Yield every row once it has been acknowledged
+            chunk_size(int):
+                Number of rows sent per bulk request (500 by default, no
+                limit by default when `chunk_bytes` is set)
+            concurrency(int):
+                Number of bulk requests kept in flight on a thread pool.
+                Rows are still acknowledged in their original order.
+                Each row is held only until its chunk is acknowledged
+            bulk_load(bool):
+                Run the write inside `bulk_load` for the bucket
+            refresh(str):
+                What to do once all rows are acknowledged: `none` returns
+                right away, `wait_for` sends the last chunk with
+                `refresh=wait_for`, `refresh` refreshes and `flush` flushes
+                the bucket. Defaults to the storage `refresh` policy
+            descriptor(dict):
+                Descriptor of the rows. Fields are then cast to the format of
+                the generated mapping and serialized by a per-schema encoder
+            mapping_generator_cls:
+                subclass of MappingGenerator the bucket was created with, whose
+                (date) formats the fields are cast to
+            processes(int):
+                Build and serialize the bulk actions of every chunk in a pool
+                of that many worker processes; this process only sends the
+                pre-serialized bodies. Rows must be picklable
+            chunk_bytes(int):
+                Size chunks by a byte budget (initially that many bytes of
+                bulk body) adapted to the observed bulk latency and
+                rejections; a `bulk.ChunkSizer` can also be passed
+            max_retries(int):
+                Number of times items rejected with a 429 are sent again
+                before failing, with an exponential backoff
+            initial_backoff(float):
+                Seconds to wait before the first retry, doubled on every
+                retry (up to a minute)
+            on_error(callable):
+                Keep going when rows fail to be written, calling this with a
+                `failures.FailedItem` (row, position of the row in `rows`,
+                document id, status and Elasticsearch error) for each of
+                them. By default the write raises `BulkIndexError`
+            dead_letter(str):
+                Keep going when rows fail to be written, appending them to
+                this NDJSON file (see `failures.DeadLetterFile`)
+            report(failures.WriteReport):
+                Filled with the count of written and failed rows
+            checkpoint(str):
+                Make the write resumable: the number of acknowledged rows
+                (and the id of the last one) is saved every
+                `checkpoint_interval` rows to this JSON file (or to a
+                `checkpoints.IndexCheckpoint`). When the checkpoint exists,
+                the rows it covers are skipped; `rows` must then yield the
+                same rows in the same order. The checkpoint is removed once
+                all rows are written
+            checkpoint_interval(int):
+                Number of rows between two checkpoints
+            skip_unchanged(bool):
+                Store a content hash with every document and only send the
+                rows whose hash differs from the stored one (fetched with
+                one `mget` per chunk); unchanged rows are still yielded.
+                Set `es:contentHash` in the descriptor of the bucket to map
+                the hash field as a non indexed keyword
+
+        """
         if primary_key is None or len(primary_key) == 0:
             raise ValueError('primary_key cannot be an empty list')
+        refresh = _check_refresh_policy(refresh or self.__refresh)
+
+        skipped = 0
+        if checkpoint is not None:
+            if not hasattr(checkpoint, 'save'):
+                checkpoint = checkpoints.FileCheckpoint(checkpoint)
+            rows, skipped = checkpoints.resume(
+                rows, checkpoint, lambda row: self.generate_doc_id(row, primary_key))
 
-        def actions(rows_, primary_key_, update_):
-            if update_:
-                for row_ in rows_:
-                    yield {
-                        '_op_type': 'update',
-                        '_index': bucket,
-                        '_id': self.generate_doc_id(row_, primary_key_),
-                        '_source': {
-                            'doc': row_,
-                            'doc_as_upsert': True
-                        }
-                    }
+        chunk_size, sizer = _chunking(chunk_size, chunk_bytes)
+        retry = bulk.RetryPolicy(max_retries, initial_backoff, bulk.DEFAULT_RETRY.max_backoff)
+
+        # Actions are pre-serialized to be sized, never just to be measured:
+        # bulk bytes are only reported when they already are
+        serialize = sizer is not None
+        known_descriptor = self.__known_descriptor(bucket, descriptor)
+        partitioner = partitions.get_partitioner(bucket, known_descriptor)
+        actions = self.__iter_actions(bucket, rows, primary_key, update,
+                                      chunk_size or DEFAULT_CHUNK_SIZE, descriptor, processes,
+                                      serialize=serialize, hashed=skip_unchanged,
+                                      index_name=partitioner and partitioner.index_name,
+                                      routing_key=mappers.get_routing_key(known_descriptor),
+                                      mapping_generator_cls=mapping_generator_cls)
+        chunks = self.__metrics.timed(bulk.iter_chunks(actions, chunk_size, sizer=sizer),
+                                      'write.prepare', {'bucket': bucket})
+        if partitioner is not None:
+            chunks = self.__create_partitions(bucket, chunks)
+        # Refreshes are disabled under bulk_load, where wait_for would never return
+        wait_for = refresh == 'wait_for' and not bulk_load
+        outcomes = bulk.iter_acknowledged(
+            self.__es, chunks, concurrency=concurrency,
+            last_refresh='wait_for' if wait_for else None,
+            retry=retry, sizer=sizer,
+            collect_errors=on_error is not None or dead_letter is not None,
+            skip_unchanged=skip_unchanged, metrics=self.__metrics)
+        if checkpoint is not None:
+            outcomes = checkpoints.track(
+                outcomes, checkpoint, lambda row: self.generate_doc_id(row, primary_key),
+                offset=skipped, interval=checkpoint_interval)
+
+        self.__cache.invalidate(bucket)
+        with self.bulk_load(bucket) if bulk_load else _no_context(), \
+                _error_handler(on_error, dead_letter) as on_error:
+            acknowledged = failures.handle_outcomes(outcomes, on_error, report, start=skipped)
+            if as_generator:
+                for row in acknowledged:
+                    yield row
             else:
-                for row_ in rows_:
-                    yield {
-                        '_op_type': 'index',
-                        '_index': bucket,
-                        '_id': self.generate_doc_id(row_, primary_key_),
-                        '_source': row_
-                    }
-
-        iterables = itertools.tee(rows)
-        actions_iterable = actions(iterables[0], primary_key, update)
-
-        iter = zip(streaming_bulk(self.__es, actions=actions_iterable), iterables[1])
-
-        if as_generator:
-            for result, row in iter:
-                yield row
+                collections.deque(acknowledged, maxlen=0)
+        # Lookups made while writing may have cached outdated documents
+        self.__cache.invalidate(bucket)
+
+        # Made visible once the refresh interval of the indices is restored
+        if refresh == 'wait_for' and bulk_load:
+            refresh = 'refresh'
+        self.__refresh_bucket(bucket, refresh)
+
+    # Private
+
+    def __refresh_bucket(self, bucket, refresh):
+        if refresh in ('refresh', 'flush'):
+            with self.__metrics.timer(refresh, {'bucket': bucket}):
+                if refresh == 'refresh':
+                    self.__es.indices.refresh(index=bucket)
+                else:
+                    self.__es.indices.flush(index=bucket)
+
+    def __iter_actions(self, bucket, rows, primary_key, update, chunk_size, descriptor,
+                       processes, serialize=False, hashed=False, index_name=None,
+                       routing_key=None, mapping_generator_cls=None):
+        # Rows go to the bucket, or to the index given by `index_name(row)`
+        if processes:
+            # Overridden ids can't be generated in the workers
+            overridden = type(self).generate_doc_id is not Storage.generate_doc_id
+            chunks = bulk.iter_encoded_chunks(
+                bulk.iter_chunks(rows, chunk_size), processes, bucket, primary_key,
+                update, descriptor=descriptor,
+                generate_doc_id=self.generate_doc_id if overridden else None, hashed=hashed,
+                index_name=index_name, routing_key=routing_key,
+                mapping_generator_cls=mapping_generator_cls)
+            return itertools.chain.from_iterable(chunks)
+        encoder = None
+        if descriptor is not None or serialize:
+            encoder = encoders.get_encoder(descriptor or {}, mapping_generator_cls)
+        return (
+            bulk.make_action(row, index_name(row) if index_name else bucket,
+                             self.generate_doc_id(row, primary_key), update,
+                             encoder=encoder, hashed=hashed,
+                             routing=bulk.routing_value(row, routing_key) if routing_key else None)
+            for row in rows
+        )
+
+    def __update_mapping(self, bucket, descriptor, index_name, mapping_generator_cls,
+                         reindex):
+        # Returns whether the index got the mapping, or needs a reindex to get it
+        response = self.__es.indices.get_mapping(index=index_name)
+        diff = mappers.diff_mappings(response[index_name]['mappings'],
+                                     _descriptor_mapping(descriptor, mapping_generator_cls))
+        self.__metrics.count('mapping.' + diff.kind, tags={'bucket': bucket})
+        if diff.kind == mappers.MAPPING_NOOP:
+            return True
+        if diff.kind == mappers.MAPPING_BREAKING and reindex:
+            return False
+        # Breaking changes are still sent without reindex, to fail with the cluster's error
+        try:
+            self.put_mapping(bucket, descriptor, index_name, mapping_generator_cls)
+        except RequestError:
+            if reindex:
+                return False
+            raise
+        return True
+
+    def __bucket_indices(self, bucket):
+        # Cached indices are trusted, but a bucket missing from the cache may
+        # have been created since by another client: the cluster confirms it
+        index_names = self.__aliases.indices(bucket)
+        if index_names:
+            return index_names
+        try:
+            index_names = list(self.__es.indices.get_alias(name=bucket))
+        except NotFoundError:
+            return []
+        for index_name in index_names:
+            self.__aliases.add(index_name, [bucket])
+        return index_names
+
+    def __known_descriptor(self, bucket, descriptor=None):
+        # Returns the given descriptor, or the bucket's one if it exists
+        if descriptor is None:
+            try:
+                descriptor = self.describe(bucket)
+            except NotFoundError:
+                return None
+        return descriptor
+
+    def __search_indices(self, bucket, filters):
+        # Returns the partitions matching the filters, or None to search the whole bucket
+        if not filters:
+            return None
+        partitioner = partitions.get_partitioner(bucket, self.__known_descriptor(bucket))
+        if partitioner is None or partitioner.field not in filters:
+            return None
+        # Not cached, as other writers may have added partitions
+        index_names = sorted(self.__es.indices.get_alias(name=bucket))
+        selected = partitioner.select(index_names, filters[partitioner.field])
+        if len(','.join(selected)) > MAX_INDEX_NAMES_LENGTH:
+            # Too many to fit in the URL: the filter still applies to the whole bucket
+            return None
+        return selected
+
+    def __search_routing(self, bucket, filters, routing=None):
+        # Returns the routing of a search, from a filter on the routing field by default
+        if routing is None and filters:
+            routing_key = mappers.get_routing_key(self.__known_descriptor(bucket))
+            condition = filters.get(routing_key)
+            if condition is not None and not isinstance(condition, dict):
+                routing = condition
+        if isinstance(routing, (list, tuple, set)):
+            values = sorted(set(map(bulk.routing_string, routing)))
+            return ','.join(values) if values else None
+        return bulk.routing_string(routing) if routing is not None else None
+
+    def __key_routings(self, bucket, key_rows, doc_ids, primary_key, routing=None):
+        # Returns the routing of the documents by id, or None when they aren't routed
+        routing_key = mappers.get_routing_key(self.__known_descriptor(bucket))
+        if routing is None and routing_key is None:
+            return None
+        if routing is None and routing_key not in primary_key:
+            raise ValueError('Rows of bucket {} are routed by {}, which is not part of the '
+                             'primary key: pass their routing'.format(bucket, routing_key))
+        return dict(
+            (doc_id, six.text_type(routing) if routing is not None
+             else bulk.routing_value(row, routing_key))
+            for row, doc_id in zip(key_rows, doc_ids)
+        )
+
+    def __create_partitions(self, bucket, chunks):
+        # Creates the missing partitions of every chunk before it is sent
+        known = set(self.__aliases.indices(bucket))
+        body = None
+        for chunk in chunks:
+            for index_name in sorted(set(map(bulk.action_index, chunk)) - known):
+                if body is None:
+                    body = self.__partition_body(bucket)
+                try:
+                    self.__es.indices.create(index=index_name, body=body)
+                except RequestError as exception:
+                    if exception.error != 'resource_already_exists_exception':
+                        raise
+                self.__aliases.add(index_name, [bucket])
+                known.add(index_name)
+            yield chunk
+
+    def __partition_body(self, bucket):
+        # Partitions get the mapping of the bucket's base index (the one `create` made)
+        base_index_names = [name for name in sorted(self.__aliases.indices(bucket))
+                            if not partitions.is_partition_index(bucket, name)]
+        if not base_index_names:
+            raise ValueError('Bucket {} must be created before writing to its '
+                             'partitions'.format(bucket))
+        response = self.__es.indices.get_mapping(index=base_index_names[-1])
+        return dict(mappings=response[base_index_names[-1]]['mappings'],
+                    aliases={bucket: {}})
+
+    def __update_partition_mappings(self, bucket, descriptor, partition_names,
+                                    mapping_generator_cls):
+        # Partitions share one mapping, diffed on the newest and put to all at once
+        response = self.__es.indices.get_mapping(index=partition_names[-1])
+        diff = mappers.diff_mappings(response[partition_names[-1]]['mappings'],
+                                     _descriptor_mapping(descriptor, mapping_generator_cls))
+        if diff.kind != mappers.MAPPING_NOOP:
+            for names in _group_names(partition_names, MAX_INDEX_NAMES_LENGTH):
+                self.put_mapping(bucket, descriptor, ','.join(names), mapping_generator_cls)
+
+    def __forget_bucket_metadata(self, bucket):
+        # Called once a reindex switched the alias of the bucket on its own
+        self.__aliases.invalidate()
+        self.__descriptors.pop(bucket, None)
+
+    def __delete_indices(self, index_names):
+        # Deletes indices with as few requests as the URL length allows
+        for names in _group_names(index_names, MAX_INDEX_NAMES_LENGTH):
+            self.__es.indices.delete(index=','.join(names), ignore_unavailable=True)
+        self.__aliases.remove(index_names)
+
+    def __mget(self, bucket, doc_ids, source, routings=None):
+        docs = [dict(_id=doc_id, _source=source) for doc_id in doc_ids]
+        if routings is not None:
+            for doc in docs:
+                doc['routing'] = routings[doc['_id']]
+        tags = {'bucket': bucket}
+        with self.__metrics.timer('mget.latency', tags):
+            response = self.__es.mget(index=bucket, body=dict(docs=docs))
+        self.__metrics.count('mget.docs', len(docs), tags)
+        return _mget_rows(response['docs'])
+
+    def __search_ids(self, bucket, doc_ids, source, routings=None):
+        body = dict(query={'ids': {'values': list(doc_ids)}}, _source=source,
+                    size=len(doc_ids))
+        params = {}
+        if routings is not None:
+            params['routing'] = ','.join(sorted(set(routings[doc_id] for doc_id in doc_ids)))
+        tags = {'bucket': bucket}
+        with self.__metrics.timer('mget.latency', tags):
+            response = self.__es.search(index=bucket, body=body, **params)
+        self.__metrics.count('mget.docs', len(doc_ids), tags)
+        shard_failures = response.get('_shards', {}).get('failures') or []
+        if shard_failures:
+            reasons = [str(_error_reason(failure.get('reason'))) for failure in shard_failures]
+            raise RuntimeError('Failed to get documents from {} shard(s): {}'.format(
+                len(shard_failures), '; '.join(reasons[:10])))
+        rows = collections.OrderedDict.fromkeys(doc_ids)
+        rows.update((hit['_id'], hit['_source']) for hit in response['hits']['hits'])
+        return rows
+
+    def __start_reindex(self, bucket, source_index_names, index_name, requests_per_second,
+                        routing_key=None, created=False):
+        response = self.__es.reindex(body=reindex_body(source_index_names, index_name,
+                                                       routing_key),
+                                     slices='auto',
+                                     wait_for_completion=False,
+                                     requests_per_second=requests_per_second or -1)
+        return ReindexTask(self.__es, response['task'], index_name, source_index_names,
+                           alias=bucket,
+                           on_finish=lambda: self.__forget_bucket_metadata(bucket),
+                           delete_on_failure=created)
+
+    def __iter_pages(self, bucket, page_size, search_body,
+                     slices=None, ordered=False, prefetch=DEFAULT_PREFETCH, indices=None,
+                     routing=None):
+        # Searches the given indices of the bucket (e.g. its partitions), if any,
+        # and only the shards of the given routing
+        if indices is not None and len(indices) == 0:
+            return
+        target = ','.join(indices) if indices is not None else bucket
+        params = dict(routing=routing) if routing is not None else {}
+        slice_ids = [None] if not slices or slices < 2 else list(range(slices))
+
+        def scroll_pages(slice_id):
+            return self.__iter_scroll_pages(target, page_size, search_body, slice_id, slices,
+                                            params)
+
+        pit = None
+        if self.__shard_doc_sort:
+            try:
+                pit = self.__es.open_point_in_time(index=target,
+                                                   keep_alive=SEARCH_KEEP_ALIVE, **params)
+            except (AttributeError, RequestError):
+                # Point in time is only available from Elasticsearch 7.10
+                pass
+        if pit is None:
+            iterables = [scroll_pages(slice_id) for slice_id in slice_ids]
         else:
-            collections.deque(iter, maxlen=0)
+            iterables = [
+                self.__iter_pit_pages(pit['id'], page_size, search_body, slice_id, slices,
+                                      fallback=lambda slice_id=slice_id: scroll_pages(slice_id))
+                for slice_id in slice_ids
+            ]
+        iterables = [_measured_pages(pages, self.__metrics, {'bucket': bucket})
+                     for pages in iterables]
+        try:
+            if len(iterables) == 1:
+                pages = iterables[0]
+            else:
+                pages = _iter_concurrently(iterables, ordered=ordered, prefetch=prefetch)
+            for hits in pages:
+                yield hits
+        finally:
+            if pit is not None:
+                self.__es.close_point_in_time(body=dict(id=pit['id']))
+
+    def __iter_pit_pages(self, pit_id, page_size, search_body, slice_id=None, slices=None,
+                         fallback=None):
+        # Pages are sorted by `_shard_doc`, which is only available from
+        # Elasticsearch 7.12: when the first search is rejected for it the
+        # pages of `fallback` (a scroll) are yielded instead
+        search_after = None
+        while True:
+            body = dict(
+                search_body,
+                pit=dict(id=pit_id, keep_alive=SEARCH_KEEP_ALIVE),
+                sort=[{'_shard_doc': 'asc'}],
+                size=page_size,
+                track_total_hits=False,
+            )
+            if slice_id is not None:
+                body['slice'] = dict(id=slice_id, max=slices)
+            if search_after is not None:
+                body['search_after'] = search_after
+            try:
+                results = self.__es.search(body=body)
+            except RequestError as exception:
+                if (search_after is not None or fallback is None or
+                        not _rejects_shard_doc_sort(exception)):
+                    raise
+                self.__shard_doc_sort = False
+                for hits in fallback():
+                    yield hits
+                return
+            hits = results.get('hits', {}).get('hits', [])
+            if len(hits) == 0:
+                break
+            yield hits
+            search_after = hits[-1]['sort']
+
+    def __iter_scroll_pages(self, bucket, page_size, search_body,
+                            slice_id=None, slices=None, params=None):
+        body = dict(search_body, sort=['_doc'], size=page_size)
+        if slice_id is not None:
+            body['slice'] = dict(id=slice_id, max=slices)
+        results = self.__es.search(index=bucket, body=body, scroll=SEARCH_KEEP_ALIVE,
+                                   **(params or {}))
+        scroll_id = results.get('_scroll_id')
+        try:
+            while True:
+                hits = results.get('hits', {}).get('hits', [])
+                if len(hits) == 0:
+                    break
+                yield hits
+                results = self.__es.scroll(body=dict(scroll_id=scroll_id,
+                                                     scroll=SEARCH_KEEP_ALIVE))
+                scroll_id = results.get('_scroll_id', scroll_id)
+        finally:
+            if scroll_id is not None:
+                self.__es.clear_scroll(body=dict(scroll_id=[scroll_id]))
+
+
+# Internal
+
+@contextlib.contextmanager
+def _no_context():
+    yield
+
+
+def _measured_pages(pages, metrics, tags):
+    # Times the search request behind every page (not the time spent by the consumer)
+    for hits in metrics.timed(pages, 'search.latency', tags):
+        metrics.count('search.hits', len(hits), tags)
+        yield hits
+
+
+def _group_names(names, max_length):
+    group = []
+    length = 0
+    for name in names:
+        if group and length + len(name) + 1 > max_length:
+            yield group
+            group = []
+            length = 0
+        group.append(name)
+        length += len(name) + 1
+    if group:
+        yield group
+
+
+def _descriptor_mapping(descriptor, mapping_generator_cls):
+    mapping = mappers.descriptor_to_mapping(
+        descriptor, mapping_generator_cls=mapping_generator_cls
+    )
+    # The descriptor is kept along the mapping for `describe`
+    return dict(mapping, _meta={mappers.DESCRIPTOR_META_KEY: descriptor})
+
+
+def _mapping_params(mapping):
+    # The 8.x client takes the mapping as arguments (`meta` for `_meta`...)
+    return dict((key.lstrip('_'), value) for key, value in mapping.items())
+
+
+def _mget_rows(docs):
+    # Returns the rows of mget docs by id (None when not found), raising on failed docs
+    errors = [doc for doc in docs if doc.get('error') is not None]
+    if errors:
+        reasons = ['{}: {}'.format(doc['_id'], _error_reason(doc['error'])) for doc in errors]
+        raise RuntimeError('Failed to get {} document(s): {}'.format(
+            len(errors), '; '.join(reasons[:10])))
+    return dict((doc['_id'], doc['_source'] if doc.get('found') else None) for doc in docs)
+
+
+def _error_reason(error):
+    if isinstance(error, dict):
+        return error.get('reason') or error.get('type') or error
+    return error
+
+
+def _rejects_shard_doc_sort(exception):
+    # Clusters before 7.12 reject `_shard_doc` as a field with no mapping
+    return '_shard_doc' in six.text_type(exception.info)
+
+
+def _key_row(key, primary_key):
+    # Returns a row holding the primary key values of a `get_many` key
+    if isinstance(key, dict):
+        return key
+    if isinstance(key, (list, tuple)):
+        return dict(zip(primary_key, key))
+    return {primary_key[0]: key}
+
+
+def _map_concurrently(function, items, concurrency):
+    if concurrency <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    pool = ThreadPool(min(concurrency, len(items)))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _chunking(chunk_size, chunk_bytes):
+    # Returns the `chunk_size` and `bulk.ChunkSizer` of `write`
+    sizer = chunk_bytes
+    if chunk_bytes is not None and not isinstance(chunk_bytes, bulk.ChunkSizer):
+        sizer = bulk.ChunkSizer(chunk_bytes)
+    if chunk_size is None and sizer is None:
+        chunk_size = DEFAULT_CHUNK_SIZE
+    return chunk_size, sizer
+
+
+@contextlib.contextmanager
+def _error_handler(on_error, dead_letter):
+    # Combines the `on_error` callback and the `dead_letter` file of `write`
+    if dead_letter is None:
+        yield on_error
+        return
+    with failures.DeadLetterFile(dead_letter) as dead_letter_file:
+        if on_error is None:
+            yield dead_letter_file
+            return
+
+        def handler(item):
+            dead_letter_file(item)
+            on_error(item)
+
+        yield handler
+
+
+def _search_body(fields=None, filters=None, descriptor=None):
+    body = {}
+    if fields is not None:
+        body['_source'] = dict(includes=list(fields))
+    else:
+        body['_source'] = dict(excludes=[mappers.CONTENT_HASH_FIELD])
+    if filters:
+        body['query'] = mappers.filters_to_query(filters, descriptor)
+    return body
+
+
+def _check_refresh_policy(refresh):
+    if refresh not in REFRESH_POLICIES:
+        raise ValueError('refresh must be one of {}'.format(', '.join(REFRESH_POLICIES)))
+    return refresh
+
+
+def _iter_concurrently(iterables, ordered=False, prefetch=DEFAULT_PREFETCH):
+    """Consume every iterable in its own thread and yield their items.
+
+    Items are handed over through bounded queues, so at most `prefetch`
+    items (per iterable when `ordered`) are buffered ahead of the consumer.
+    With `ordered` the items are yielded round-robin in iterable order,
+    otherwise as soon as any thread produces them.
+    """
+    stop = threading.Event()
+    if ordered:
+        queues = [queue.Queue(prefetch) for _ in iterables]
+    else:
+        queues = [queue.Queue(prefetch)] * len(iterables)
+    threads = [
+        threading.Thread(target=_drain_into_queue, args=(iterable, queue_, stop))
+        for iterable, queue_ in zip(iterables, queues)
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        active = list(range(len(iterables)))
+        position = 0
+        while active:
+            position = position % len(active)
+            kind, value = queues[active[position]].get()
+            if kind == 'item':
+                yield value
+                position += 1 if ordered else 0
+            elif kind == 'done':
+                active.pop(position if ordered else 0)
+            else:
+                six.reraise(*value)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def _drain_into_queue(iterable, queue_, stop):
+    try:
+        for item in iterable:
+            if not _put_until_stopped(queue_, ('item', item), stop):
+                break
+        else:
+            _put_until_stopped(queue_, ('done', None), stop)
+    except Exception:
+        _put_until_stopped(queue_, ('error', sys.exc_info()), stop)
+    finally:
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            close()
+
 
-        self.__es.indices.flush(index=bucket)
+def _put_until_stopped(queue_, message, stop):
+    while not stop.is_set():
+        try:
+            queue_.put(message, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import asyncio
+from elasticsearch import AsyncElasticsearch
+from tableschema_elasticsearch import AsyncStorage
+
+
+# Tests
+
+def test_async_basic_flow():
+
+    async def flow():
+        descriptor = {
+            'fields': [{'name': 'id', 'type': 'integer'}],
+            'primaryKey': ['id'],
+        }
+        rows = [{'id': i} for i in range(100)]
+
+        engine = AsyncElasticsearch('http://localhost:9200')
+        storage = AsyncStorage(engine, refresh='wait_for')
+        await storage.delete()
+        await storage.create('unit-tests-async-first', descriptor)
+        await storage.create('unit-tests-async-second', descriptor)
+
+        # Write buckets concurrently
+        written = await storage.write_many([
+            ('unit-tests-async-first', rows, descriptor['primaryKey']),
+            ('unit-tests-async-second', rows[:10], descriptor['primaryKey']),
+        ], chunk_size=30, concurrency=2)
+        assert written == [100, 10]
+
+        assert sorted([bucket async for bucket in storage.buckets]) == [
+            'unit-tests-async-first', 'unit-tests-async-second']
+        assert sorted(await storage.read('unit-tests-async-first', page_size=7),
+                      key=lambda x: x['id']) == rows
+
+        await storage.delete()
+        await engine.close()
+
+    asyncio.run(flow())
+
+
+def test_async_write_routed_bucket():
+
+    async def flow():
+        descriptor = {
+            'fields': [{'name': 'id', 'type': 'integer'},
+                       {'name': 'tenant', 'type': 'string'}],
+            'primaryKey': ['id'],
+            'es:routingKey': 'tenant',
+        }
+        rows = [{'id': i, 'tenant': 'tenant-%d' % (i % 3)} for i in range(30)]
+
+        engine = AsyncElasticsearch('http://localhost:9200')
+        storage = AsyncStorage(engine, refresh='wait_for')
+        await storage.delete()
+        await storage.create('unit-tests-async-routed', descriptor)
+
+        # Rows are routed by the bucket's descriptor when none is passed
+        await storage.write_many([('unit-tests-async-routed', rows, descriptor['primaryKey'])])
+        assert sorted(await storage.read('unit-tests-async-routed', routing='tenant-1'),
+                      key=lambda x: x['id']) == [row for row in rows if row['id'] % 3 == 1]
+
+        await storage.delete()
+        await engine.close()
+
+    asyncio.run(flow())
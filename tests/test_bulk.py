@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import datetime
+import pytest
+from mock import Mock
+from elasticsearch.helpers import BulkIndexError
+from tableschema_elasticsearch import bulk
+from tableschema_elasticsearch import encoders
+from tableschema_elasticsearch.failures import FailedItem
+from tableschema_elasticsearch.mappers import CONTENT_HASH_FIELD
+from tableschema_elasticsearch.metrics import InMemoryCollector
+
+
+# Helpers
+
+def acknowledge(status=201):
+    def bulk_(body, **params):
+        if isinstance(body, bytes):
+            body = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+        return {'items': [{list(header)[0]: {'status': status}}
+                          for header in body[::2]]}
+    return Mock(bulk=Mock(side_effect=bulk_))
+
+
+# Tests
+
+def test_iter_chunks():
+    chunks = list(bulk.iter_chunks(range(7), 3))
+    assert chunks == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_make_action():
+    row = {'id': 1}
+    action = bulk.make_action(row, 'bucket', '1')
+    assert action.header == {'index': {'_index': 'bucket', '_id': '1'}}
+    assert action.source is row
+    action = bulk.make_action(row, 'bucket', '1', update=True)
+    assert action.header == {'update': {'_index': 'bucket', '_id': '1'}}
+    assert action.source == {'doc': row, 'doc_as_upsert': True}
+
+
+@pytest.mark.parametrize('concurrency', [1, 4])
+def test_iter_acknowledged_keeps_order(concurrency):
+    es = acknowledge()
+    rows = [{'id': i} for i in range(100)]
+    actions = (bulk.make_action(row, 'bucket', str(row['id'])) for row in rows)
+    chunks = bulk.iter_chunks(actions, 7)
+    assert list(bulk.iter_acknowledged(es, chunks, concurrency=concurrency)) == rows
+    assert es.bulk.call_count == 15
+
+
+def test_send_chunk_raises_on_item_errors():
+    es = acknowledge(status=400)
+    chunk = [bulk.make_action({'id': 1}, 'bucket', '1')]
+    with pytest.raises(BulkIndexError):
+        bulk.send_chunk(es, chunk)
+
+
+def test_iter_acknowledged_refreshes_last_chunk():
+    es = acknowledge()
+    actions = (bulk.make_action({'id': i}, 'bucket', str(i)) for i in range(10))
+    chunks = bulk.iter_chunks(actions, 4)
+    list(bulk.iter_acknowledged(es, chunks, concurrency=2, last_refresh='wait_for'))
+    refreshes = [call[1].get('refresh') for call in es.bulk.call_args_list]
+    assert refreshes == [None, None, 'wait_for']
+
+
+def test_iter_acknowledged_sends_without_look_ahead():
+    es = acknowledge()
+    built = []
+
+    def chunks():
+        for i in range(3):
+            built.append(i)
+            yield [bulk.make_action({'id': i}, 'bucket', str(i))]
+
+    outcomes = bulk.iter_acknowledged(es, chunks())
+    assert next(outcomes) == {'id': 0}
+    assert built == [0]
+    assert list(outcomes) == [{'id': 1}, {'id': 2}]
+
+
+def test_encode_chunk():
+    descriptor = {'fields': [{'name': 'id', 'type': 'integer'}]}
+    (header, data, content_hash), = bulk.encode_chunk(
+        [{'id': '1', 'name': 'a'}], 'bucket', ['id'], descriptor=descriptor)
+    assert header == {'index': {'_index': 'bucket', '_id': '1'}}
+    assert content_hash is None
+    assert [json.loads(line) for line in data.decode('utf-8').splitlines()] == [
+        {'index': {'_index': 'bucket', '_id': '1'}},
+        {'id': 1, 'name': 'a'},
+    ]
+
+
+def test_encode_chunk_index_names():
+    actions = bulk.encode_chunk([{'id': 1}, {'id': 2}], 'bucket', ['id'],
+                                index_names=['first', 'second'])
+    assert [header['index']['_index'] for header, _, _ in actions] == ['first', 'second']
+
+
+def test_encode_chunk_routing_key():
+    (header, _, _), = bulk.encode_chunk([{'id': 1, 'tenant': 7}], 'bucket', ['id'],
+                                        routing_key='tenant')
+    assert header == {'index': {'_index': 'bucket', '_id': '1', 'routing': '7'}}
+    with pytest.raises(ValueError):
+        bulk.encode_chunk([{'id': 1}], 'bucket', ['id'], routing_key='tenant')
+
+
+def test_routing_string():
+    assert bulk.routing_string(True) == 'true'
+    assert bulk.routing_string(datetime.datetime(2026, 1, 2, 3)) == '2026-01-02T03:00:00'
+    assert bulk.routing_string(7) == '7'
+
+
+def test_iter_encoded_chunks_keeps_order():
+    es = acknowledge()
+    rows = [{'id': i} for i in range(50)]
+    chunks = bulk.iter_encoded_chunks(bulk.iter_chunks(rows, 7), 2, 'bucket', ['id'],
+                                      generate_doc_id=lambda row, _: 'doc-%s' % row['id'])
+    assert list(bulk.iter_acknowledged(es, chunks)) == rows
+    body = es.bulk.call_args_list[0][1]['body']
+    assert json.loads(body.splitlines()[0]) == {'index': {'_index': 'bucket', '_id': 'doc-0'}}
+
+
+def test_iter_chunks_by_size():
+    sizer = bulk.ChunkSizer(100)
+    actions = [bulk.BulkAction(i, None, None, b'x' * 40) for i in range(7)]
+    chunks = list(bulk.iter_chunks(actions, None, sizer=sizer))
+    assert [[action.row for action in chunk] for chunk in chunks] == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_chunk_sizer_adapts():
+    sizer = bulk.ChunkSizer(1000, target_latency=1.0)
+    sizer.observe(1000, 0.1)
+    assert sizer.target_bytes == 1250
+    sizer.observe(1250, 0.1, rejected=0.2)
+    assert sizer.target_bytes == 1000
+    sizer.observe(1000, 4.0)
+    assert sizer.target_bytes == 500
+    for _ in range(20):
+        sizer.observe(100, 10.0, rejected=1.0)
+    assert sizer.target_bytes == 62
+
+
+def test_send_chunk_retries_rejected_items(monkeypatch):
+    monkeypatch.setattr(bulk.time, 'sleep', Mock())
+    responses = iter([[201, 429, 429], [201, 429], [201]])
+
+    def bulk_(body, **params):
+        return {'items': [{'index': {'status': status}} for status in next(responses)]}
+
+    es = Mock(bulk=Mock(side_effect=bulk_))
+    chunk = [bulk.make_action({'id': i}, 'bucket', str(i)) for i in range(3)]
+    retry = bulk.RetryPolicy(max_retries=2, initial_backoff=1, max_backoff=60)
+    assert bulk.send_chunk(es, chunk, retry=retry) == [{'id': 0}, {'id': 1}, {'id': 2}]
+    assert [len(call[1]['body']) for call in es.bulk.call_args_list] == [6, 4, 2]
+    assert [call[0][0] for call in bulk.time.sleep.call_args_list] == [1, 2]
+
+
+def test_send_chunk_reports_metrics(monkeypatch):
+    monkeypatch.setattr(bulk.time, 'sleep', Mock())
+    responses = iter([[201, 429], [201]])
+
+    def bulk_(body, **params):
+        return {'items': [{'index': {'status': status}} for status in next(responses)]}
+
+    es = Mock(bulk=Mock(side_effect=bulk_))
+    collector = InMemoryCollector()
+    encoder = encoders.get_encoder({})
+    chunk = [bulk.make_action({'id': i}, 'bucket', str(i), encoder=encoder) for i in range(2)]
+    retry = bulk.RetryPolicy(max_retries=2, initial_backoff=1, max_backoff=60)
+    bulk.send_chunk(es, chunk, retry=retry, metrics=collector)
+    tags = {'index': 'bucket'}
+    assert len(collector.timings('bulk.latency', tags)) == 2
+    assert collector.timings('bulk.backoff', tags) == [1]
+    assert collector.counts('bulk.docs', tags) == 3
+    assert collector.counts('bulk.rejected', tags) == 1
+    assert collector.counts('bulk.bytes', tags) == \
+        sum(len(action.data) for action in chunk) + len(chunk[1].data)
+
+
+def test_send_chunk_raises_when_retries_are_exhausted():
+    es = acknowledge(status=429)
+    chunk = [bulk.make_action({'id': 1}, 'bucket', '1')]
+    with pytest.raises(BulkIndexError):
+        bulk.send_chunk(es, chunk, retry=bulk.RetryPolicy(0, 0, 0))
+
+
+def test_send_chunk_collects_errors():
+    def bulk_(body, **params):
+        return {'items': [{'index': {'_id': '0', 'status': 201}},
+                          {'index': {'_id': '1', 'status': 400,
+                                     'error': {'type': 'mapper_parsing_exception'}}}]}
+
+    es = Mock(bulk=Mock(side_effect=bulk_))
+    chunk = [bulk.make_action({'id': i}, 'bucket', str(i)) for i in range(2)]
+    outcomes = bulk.send_chunk(es, chunk, collect_errors=True)
+    assert outcomes == [
+        {'id': 0},
+        FailedItem({'id': 1}, None, '1', 400, {'type': 'mapper_parsing_exception'}),
+    ]
+
+
+def test_send_chunk_skips_unchanged_actions():
+    es = acknowledge()
+    chunk = [bulk.make_action({'id': i}, 'bucket', str(i), hashed=True) for i in range(3)]
+    es.mget.return_value = {'docs': [
+        {'_id': '0', 'found': True, '_source': {CONTENT_HASH_FIELD: chunk[0].content_hash}},
+        {'_id': '1', 'found': True, '_source': {CONTENT_HASH_FIELD: 'stale'}},
+        {'_id': '2', 'found': False},
+    ]}
+    assert bulk.send_chunk(es, chunk, skip_unchanged=True) == [{'id': 0}, {'id': 1}, {'id': 2}]
+    assert [header['index']['_id'] for header in es.bulk.call_args[1]['body'][::2]] == ['1', '2']
+    assert es.mget.call_args[1]['body']['docs'][0] == \
+        {'_index': 'bucket', '_id': '0', '_source': [CONTENT_HASH_FIELD]}
+
+
+def test_make_action_hashed():
+    action = bulk.make_action({'id': 1}, 'bucket', '1', update=True, hashed=True)
+    assert action.source == {'doc': {'id': 1, CONTENT_HASH_FIELD: action.content_hash},
+                             'doc_as_upsert': True}
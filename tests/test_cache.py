@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from mock import Mock
+from tableschema_elasticsearch import cache
+
+
+# Tests
+
+def test_lru_cache_evicts_least_recently_used():
+    lru = cache.LRUCache(2)
+    lru.put('bucket', '1', {'id': 1})
+    lru.put('bucket', '2', {'id': 2})
+    assert lru.get('bucket', '1') == {'id': 1}
+    lru.put('bucket', '3', {'id': 3})
+    assert lru.get('bucket', '2') is cache.MISSING
+    assert lru.get('bucket', '1') == {'id': 1}
+    assert len(lru) == 2
+
+
+def test_lru_cache_invalidate():
+    lru = cache.LRUCache(10)
+    lru.put('first', '1', None)
+    lru.put('second', '1', {'id': 1})
+    lru.invalidate('first')
+    assert lru.get('first', '1') is cache.MISSING
+    assert lru.get('second', '1') == {'id': 1}
+    lru.invalidate()
+    assert len(lru) == 0
+
+
+def test_lru_cache_disabled():
+    lru = cache.LRUCache(0)
+    lru.put('bucket', '1', {'id': 1})
+    assert lru.get('bucket', '1') is cache.MISSING
+
+
+def test_alias_cache_fetches_once_per_ttl():
+    fetch = Mock(return_value={
+        'index-1': {'aliases': {'first': {}}},
+        'index-2': {'aliases': {'first': {}, 'second': {}}},
+        'orphan': {'aliases': {}},
+    })
+    aliases = cache.AliasCache(fetch, ttl=60)
+    assert aliases.aliases() == ['first', 'second']
+    assert aliases.indices('first') == ['index-1', 'index-2']
+    assert aliases.indices() == ['index-1', 'index-2']
+    assert fetch.call_count == 1
+    aliases.invalidate()
+    aliases.aliases()
+    assert fetch.call_count == 2
+
+
+def test_alias_cache_without_ttl_always_fetches():
+    fetch = Mock(return_value={})
+    aliases = cache.AliasCache(fetch, ttl=0)
+    aliases.aliases()
+    aliases.aliases()
+    assert fetch.call_count == 2
+
+
+def test_alias_cache_add_and_remove():
+    fetch = Mock(return_value={'index-1': {'aliases': {'first': {}}}})
+    aliases = cache.AliasCache(fetch, ttl=60)
+    aliases.aliases()
+    aliases.add('index-2', ['second'])
+    aliases.add('index-3')
+    assert aliases.aliases() == ['first', 'second']
+    assert aliases.indices('second') == ['index-2']
+    aliases.remove(['index-1', 'index-2'])
+    assert aliases.aliases() == []
+    assert fetch.call_count == 1
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import pytest
+from mock import Mock
+from tableschema_elasticsearch import checkpoints
+
+
+# Helpers
+
+def doc_id(row):
+    return str(row['id'])
+
+
+# Tests
+
+def test_file_checkpoint(tmpdir):
+    checkpoint = checkpoints.FileCheckpoint(str(tmpdir.join('load.json')))
+    assert checkpoint.load() is None
+    checkpoint.save({'acknowledged': 3, 'last_doc_id': '2'})
+    assert checkpoint.load() == {'acknowledged': 3, 'last_doc_id': '2'}
+    checkpoint.clear()
+    assert checkpoint.load() is None
+
+
+def test_resume():
+    checkpoint = Mock(load=Mock(return_value={'acknowledged': 3, 'last_doc_id': '2'}))
+    rows, skipped = checkpoints.resume(({'id': i} for i in range(5)), checkpoint, doc_id)
+    assert skipped == 3
+    assert list(rows) == [{'id': 3}, {'id': 4}]
+
+
+def test_resume_without_checkpoint():
+    checkpoint = Mock(load=Mock(return_value=None))
+    rows, skipped = checkpoints.resume([{'id': 0}], checkpoint, doc_id)
+    assert (list(rows), skipped) == ([{'id': 0}], 0)
+
+
+def test_resume_raises_on_other_rows():
+    checkpoint = Mock(load=Mock(return_value={'acknowledged': 3, 'last_doc_id': '2'}))
+    with pytest.raises(ValueError):
+        checkpoints.resume(({'id': i} for i in range(1, 5)), checkpoint, doc_id)
+
+
+def test_track():
+    checkpoint = Mock()
+    outcomes = checkpoints.track(({'id': i} for i in range(10, 15)), checkpoint, doc_id,
+                                 offset=10, interval=2)
+    assert len(list(outcomes)) == 5
+    assert [call[0][0] for call in checkpoint.save.call_args_list] == [
+        {'acknowledged': 12, 'last_doc_id': '11'},
+        {'acknowledged': 14, 'last_doc_id': '13'},
+    ]
+    assert checkpoint.clear.called
+
+
+def test_track_saves_progress_when_stopped():
+    checkpoint = Mock()
+
+    def outcomes():
+        yield {'id': 0}
+        raise RuntimeError()
+
+    with pytest.raises(RuntimeError):
+        list(checkpoints.track(outcomes(), checkpoint, doc_id, interval=10))
+    checkpoint.save.assert_called_once_with({'acknowledged': 1, 'last_doc_id': '0'})
+    assert not checkpoint.clear.called
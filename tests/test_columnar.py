@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import pytest
+import datetime
+pyarrow = pytest.importorskip('pyarrow')
+from tableschema_elasticsearch import columnar  # noqa: E402
+
+
+# Helpers
+
+DESCRIPTOR = {
+    'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'score', 'type': 'number'},
+        {'name': 'day', 'type': 'date', 'format': '%d/%m/%Y'},
+        {'name': 'at', 'type': 'datetime'},
+        {'name': 'location', 'type': 'geopoint'},
+        {'name': 'tags', 'type': 'array', 'es:itemType': 'string'},
+        {'name': 'inner', 'type': 'object',
+         'es:schema': {'fields': [{'name': 'x', 'type': 'integer'}]}},
+        {'name': 'extra', 'type': 'object', 'es:index': False},
+    ]
+}
+
+
+def hits(*sources):
+    return [{'_source': source} for source in sources]
+
+
+# Tests
+
+def test_to_record_batch():
+    converter = columnar.ColumnarConverter(DESCRIPTOR)
+    batch = converter.to_record_batch(hits(
+        {'id': 1, 'score': 0.5, 'day': '17/05/2020', 'at': '2020-01-02T03:04:05Z',
+         'location': {'lat': 1, 'lon': 2}, 'tags': ['a', 'b'], 'inner': {'x': '3'},
+         'extra': {'any': [1]}},
+        {'id': 'malformed', 'location': '2, 1'},
+    ))
+    assert batch.schema == converter.schema
+    assert batch.to_pylist() == [
+        {'id': 1, 'score': 0.5, 'day': datetime.date(2020, 5, 17),
+         'at': datetime.datetime(2020, 1, 2, 3, 4, 5),
+         'location': {'lat': 1.0, 'lon': 2.0}, 'tags': ['a', 'b'], 'inner': {'x': 3},
+         'extra': '{"any":[1]}'},
+        {'id': None, 'score': None, 'day': None, 'at': None,
+         'location': {'lat': 1.0, 'lon': 2.0}, 'tags': None, 'inner': None, 'extra': None},
+    ]
+
+
+def test_to_record_batch_non_string_dates():
+    converter = columnar.ColumnarConverter(DESCRIPTOR, fields=['day', 'at'])
+    batch = converter.to_record_batch(hits({'day': 1589673600, 'at': 1577934245000}))
+    assert batch.to_pylist() == [{'day': None, 'at': None}]
+
+
+def test_to_record_batch_fields():
+    converter = columnar.ColumnarConverter(DESCRIPTOR, fields=['score', 'id'])
+    batch = converter.to_record_batch(hits({'id': 1, 'score': 2}))
+    assert batch.schema.names == ['score', 'id']
+    assert batch.to_pylist() == [{'score': 2.0, 'id': 1}]
+
+
+def test_to_arrays():
+    pytest.importorskip('numpy')
+    converter = columnar.ColumnarConverter(DESCRIPTOR, fields=['id', 'score'])
+    arrays = converter.to_arrays(hits({'id': 1, 'score': 2}, {'id': 3, 'score': 4.5}))
+    assert arrays['id'].tolist() == [1, 3]
+    assert arrays['score'].dtype.name == 'float64'
+
+
+def test_check_batch_format():
+    with pytest.raises(ValueError):
+        columnar.check_batch_format('pandas')
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import decimal
+import datetime
+import pytest
+from tableschema_elasticsearch import encoders
+from tableschema_elasticsearch.mappers import MappingGenerator
+
+
+# Tests
+
+def test_row_encoder_cast():
+    encoder = encoders.RowEncoder({
+        'fields': [
+            {'name': 'an-int', 'type': 'integer'},
+            {'name': 'a-number', 'type': 'number'},
+            {'name': 'a-date', 'type': 'date', 'format': '%d/%m/%Y'},
+            {'name': 'a-datetime', 'type': 'datetime'},
+            {'name': 'a-geopoint', 'type': 'geopoint'},
+            {'name': 'an-array', 'type': 'array', 'es:itemType': 'integer'},
+            {'name': 'an-object', 'type': 'object',
+             'es:schema': {'fields': [{'name': 'inner', 'type': 'number'}]}},
+        ]
+    })
+    row = encoder.cast({
+        'an-int': '7',
+        'a-number': decimal.Decimal('1.25'),
+        'a-date': datetime.date(2020, 5, 17),
+        'a-datetime': datetime.datetime(2020, 1, 2, 3, 4, 5),
+        'a-geopoint': '10.5, 20.25',
+        'an-array': ['1', None, 3],
+        'an-object': {'inner': '2'},
+        'extra': 'kept',
+    })
+    assert row == {
+        'an-int': 7,
+        'a-number': 1.25,
+        'a-date': '17/05/2020',
+        'a-datetime': '2020-01-02T03:04:05',
+        'a-geopoint': {'lat': 20.25, 'lon': 10.5},
+        'an-array': [1, None, 3],
+        'an-object': {'inner': 2.0},
+        'extra': 'kept',
+    }
+
+
+def test_row_encoder_passes_invalid_values_through():
+    encoder = encoders.RowEncoder({'fields': [{'name': 'an-int', 'type': 'integer'}]})
+    assert encoder.cast({'an-int': 'n/a'}) == {'an-int': 'n/a'}
+
+
+def test_dumps():
+    value = {'a': decimal.Decimal('0.5'), 'b': datetime.date(2020, 1, 1), 'c': (1, 2)}
+    assert json.loads(encoders.dumps(value).decode('utf-8')) == \
+        {'a': 0.5, 'b': '2020-01-01', 'c': [1, 2]}
+
+
+def test_dumps_falls_back_to_client_serializer():
+    numpy = pytest.importorskip('numpy')
+    value = {'id': numpy.int64(1), 'score': numpy.float32(0.5), 'tags': numpy.array([1, 2])}
+    assert json.loads(encoders.dumps(value).decode('utf-8')) == \
+        {'id': 1, 'score': 0.5, 'tags': [1, 2]}
+    with pytest.raises(TypeError):
+        encoders.dumps({'value': object()})
+
+
+def test_get_encoder_is_cached():
+    descriptor = {'fields': [{'name': 'id', 'type': 'integer'}]}
+    assert encoders.get_encoder(descriptor) is encoders.get_encoder(dict(descriptor))
+
+
+def test_get_encoder_uses_mapping_generator_cls():
+
+    class IsoDatesMappingGenerator(MappingGenerator):
+        @classmethod
+        def _convert_date_format(cls, fmt):
+            return 'strict_date_optional_time'
+
+    descriptor = {'fields': [{'name': 'when', 'type': 'date', 'format': '%d/%m/%Y'}]}
+    row = {'when': datetime.date(2020, 1, 2)}
+    assert encoders.get_encoder(descriptor).cast(row) == {'when': '02/01/2020'}
+    assert encoders.get_encoder(descriptor, IsoDatesMappingGenerator).cast(row) == \
+        {'when': '2020-01-02'}
+
+
+def test_content_hash():
+    assert encoders.content_hash({'a': 1, 'b': [1, 2]}) == \
+        encoders.content_hash({'b': [1, 2], 'a': 1})
+    assert encoders.content_hash({'a': 1}) != encoders.content_hash({'a': 2})
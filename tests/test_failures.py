@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import io
+import json
+from tableschema_elasticsearch import failures
+
+
+# Helpers
+
+def failed(row, error):
+    return failures.FailedItem(row, None, str(row['id']), 400, error)
+
+
+# Tests
+
+def test_handle_outcomes():
+    report = failures.WriteReport()
+    errors = []
+    outcomes = [{'id': 0}, failed({'id': 1}, {'type': 'mapper_parsing_exception'}),
+                {'id': 2}, failed({'id': 3}, 'version_conflict')]
+    rows = list(failures.handle_outcomes(outcomes, errors.append, report))
+    assert rows == [{'id': 0}, {'id': 2}]
+    assert [item.position for item in errors] == [1, 3]
+    assert report.as_dict() == {
+        'succeeded': 2,
+        'failed': 2,
+        'error_types': {'mapper_parsing_exception': 1, 'version_conflict': 1},
+    }
+
+
+def test_dead_letter_file(tmpdir):
+    path = str(tmpdir.join('dead-letter.ndjson'))
+    with failures.DeadLetterFile(path) as dead_letter:
+        dead_letter(failed({'id': 1}, {'type': 'mapper_parsing_exception'})._replace(position=7))
+    with io.open(path, encoding='utf-8') as file:
+        assert [json.loads(line) for line in file] == [{
+            'row': {'id': 1},
+            'position': 7,
+            'doc_id': '1',
+            'status': 400,
+            'error': {'type': 'mapper_parsing_exception'},
+        }]
+
+
+def test_dead_letter_file_is_only_created_on_failure(tmpdir):
+    path = tmpdir.join('dead-letter.ndjson')
+    with failures.DeadLetterFile(str(path)):
+        pass
+    assert not path.exists()
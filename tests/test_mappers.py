@@ -9,6 +9,11 @@ from mock import Mock
 from tableschema_elasticsearch import mappers
 
 
+# Fixtures
+
+KEYWORD_TEXT = {'type': 'text', 'fields': {'keyword': {'type': 'keyword', 'ignore_above': 256}}}
+
+
 # Tests
 
 def test_descriptor_to_mapping():
@@ -31,7 +36,7 @@ def test_descriptor_to_mapping():
             {'name': 'another-object', 'type': 'object', 'es:index': False},
         ]
     }) == {
-     'properties': {'a-string': {'type': 'text'},
+     'properties': {'a-string': KEYWORD_TEXT,
                     'an-int': {'type': 'long', 'ignore_malformed': True, 'index': False},
                     'a-number': {'type': 'scaled_float', 'scaling_factor': 100, 'ignore_malformed': True,
                                  'index': False},
@@ -43,7 +48,7 @@ def test_descriptor_to_mapping():
                                          'format': 'strict_date_optional_time'},
                     'a-time': {'type': 'date', 'ignore_malformed': True, 'format': 'HH__mm__ss'},
                     'another-time': {'type': 'date', 'ignore_malformed': True, 'format': 'strict_date_optional_time'},
-                    'an-array': {'type': 'text'},
+                    'an-array': KEYWORD_TEXT,
                     'another-array': {'type': 'long', 'ignore_malformed': True, 'index': False},
                     'a-geopoint': {'type': 'geo_point', 'ignore_malformed': True,'index': False},
                     'an-object': {'properties': {'inner': {'type': 'long', 'ignore_malformed': True, 'index': False}},
@@ -65,3 +70,171 @@ def test_descriptor_to_mapping_missing_schema():
     }
     with pytest.raises(ValueError):
         mappers.descriptor_to_mapping(descriptor)
+
+
+def test_descriptor_to_mapping_content_hash():
+    descriptor = {
+        'fields': [{'name': 'name', 'type': 'string'}],
+        'es:contentHash': True,
+    }
+    assert mappers.descriptor_to_mapping(descriptor)['properties'] == {
+        'name': KEYWORD_TEXT,
+        mappers.CONTENT_HASH_FIELD: {'type': 'keyword', 'index': False},
+    }
+
+
+def test_descriptor_to_mapping_routing():
+    descriptor = {
+        'fields': [{'name': 'tenant', 'type': 'string'}],
+        'es:routingKey': 'tenant',
+    }
+    assert mappers.descriptor_to_mapping(descriptor)['_routing'] == {'required': True}
+    assert '_routing' not in mappers.descriptor_to_mapping({'fields': []})
+    with pytest.raises(ValueError):
+        mappers.get_routing_key(dict(descriptor, **{'es:routingKey': 'missing'}))
+
+
+def test_mapping_to_descriptor():
+    mapping = mappers.descriptor_to_mapping({
+        'fields': [
+            {'name': 'a-string', 'type': 'string'},
+            {'name': 'an-int', 'type': 'integer'},
+            {'name': 'a-number', 'type': 'number'},
+            {'name': 'a-bool', 'type': 'boolean'},
+            {'name': 'a-date', 'type': 'date', 'format': '%Y::%m::%d'},
+            {'name': 'a-datetime', 'type': 'datetime', 'format': '%Y::%m::%d T %H__%M__%S'},
+            {'name': 'another-datetime', 'type': 'datetime'},
+            {'name': 'a-time', 'type': 'time', 'format': '%H__%M__%S'},
+            {'name': 'a-geopoint', 'type': 'geopoint'},
+            {'name': 'an-object', 'type': 'object', 'es:schema': {'fields': [{'name': 'inner', 'type': 'integer'}]}},
+            {'name': 'another-object', 'type': 'object', 'es:index': False},
+        ],
+        'es:contentHash': True,
+    })
+    assert mappers.mapping_to_descriptor(mapping) == {
+        'fields': [
+            {'name': 'a-bool', 'type': 'boolean'},
+            {'name': 'a-date', 'type': 'date', 'format': '%Y::%m::%d'},
+            {'name': 'a-datetime', 'type': 'datetime', 'format': '%Y::%m::%d T %H__%M__%S'},
+            {'name': 'a-geopoint', 'type': 'geopoint'},
+            {'name': 'a-number', 'type': 'number'},
+            {'name': 'a-string', 'type': 'string'},
+            {'name': 'a-time', 'type': 'time', 'format': '%H__%M__%S'},
+            {'name': 'an-int', 'type': 'integer'},
+            {'name': 'an-object', 'type': 'object', 'es:schema': {'fields': [{'name': 'inner', 'type': 'integer'}]}},
+            {'name': 'another-datetime', 'type': 'datetime'},
+            {'name': 'another-object', 'type': 'object', 'es:index': False},
+        ],
+        'es:contentHash': True,
+    }
+
+
+def test_mapping_to_descriptor_from_meta():
+    descriptor = {'fields': [{'name': 'year', 'type': 'year'}], 'primaryKey': 'year'}
+    mapping = dict(mappers.descriptor_to_mapping(descriptor),
+                   _meta={mappers.DESCRIPTOR_META_KEY: descriptor})
+    assert mappers.mapping_to_descriptor(mapping) == descriptor
+
+
+def test_mapping_to_descriptor_unknown_type():
+    mapping = {'properties': {'ip': {'type': 'ip'}}}
+    assert mappers.mapping_to_descriptor(mapping) == {'fields': [{'name': 'ip', 'type': 'any'}]}
+
+
+def test_diff_mappings_noop():
+    descriptor = {'fields': [
+        {'name': 'a-number', 'type': 'number'},
+        {'name': 'a-date', 'type': 'date'},
+        {'name': 'an-object', 'type': 'object', 'es:schema': {'fields': [{'name': 'inner', 'type': 'integer'}]}},
+    ]}
+    target = mappers.descriptor_to_mapping(descriptor)
+    # As returned by Elasticsearch
+    current = {'properties': {
+        'a-number': {'type': 'scaled_float', 'scaling_factor': 100.0, 'ignore_malformed': True,
+                     'index': False},
+        'a-date': {'type': 'date', 'ignore_malformed': True, 'format': 'strict_date_optional_time'},
+        'an-object': {'dynamic': 'false', 'properties': {
+            'inner': {'type': 'long', 'ignore_malformed': True, 'index': False}}},
+    }}
+    diff = mappers.diff_mappings(current, target)
+    assert diff == ([], [], [])
+    assert diff.kind == mappers.MAPPING_NOOP
+
+
+def test_diff_mappings_additive():
+    current = mappers.descriptor_to_mapping({'fields': [{'name': 'name', 'type': 'string'}]})
+    current = dict(current, properties=dict(current['properties']))
+    target = mappers.descriptor_to_mapping({'fields': [
+        {'name': 'name', 'type': 'string'},
+        {'name': 'age', 'type': 'integer'},
+    ]})
+    target = dict(target, _meta={'tableschema': {}})
+    diff = mappers.diff_mappings(current, target)
+    assert diff == (['age'], ['_meta'], [])
+    assert diff.kind == mappers.MAPPING_ADDITIVE
+
+
+def test_diff_mappings_breaking():
+    current = {'properties': {
+        'name': {'type': 'text'},
+        'when': {'type': 'date', 'format': 'yyyy'},
+        'object': {'properties': {'inner': {'type': 'text', 'index': False}}},
+    }}
+    target = {'properties': {
+        'name': {'type': 'long', 'ignore_malformed': True},
+        'when': {'type': 'date', 'format': 'strict_date_optional_time'},
+        'object': {'properties': {'inner': {'type': 'text'}}},
+    }}
+    diff = mappers.diff_mappings(current, target)
+    assert diff.updated == ['name[ignore_malformed]']
+    assert diff.conflicts == ['name[type]', 'object.inner[index]', 'when[format]']
+    assert diff.kind == mappers.MAPPING_BREAKING
+
+
+def test_diff_mappings_routing():
+    current = {'_routing': {'required': 'true'}, 'properties': {}}
+    assert mappers.diff_mappings(current, {'_routing': {'required': True}}).kind == \
+        mappers.MAPPING_NOOP
+    assert mappers.diff_mappings(current, {}).conflicts == ['_routing']
+
+
+def test_filters_to_query():
+    assert mappers.filters_to_query({
+        'name': 'John Smith',
+        'age': {'gte': 18, 'lt': 65},
+        'country': ['FR', 'DE'],
+        'year': [2019, 2020],
+        'active': True,
+    }) == {'bool': {'filter': [
+        {'term': {'active': True}},
+        {'range': {'age': {'gte': 18, 'lt': 65}}},
+        {'bool': {'should': [{'match_phrase': {'country': 'FR'}},
+                             {'match_phrase': {'country': 'DE'}}],
+                  'minimum_should_match': 1}},
+        {'match_phrase': {'name': 'John Smith'}},
+        {'terms': {'year': [2019, 2020]}},
+    ]}}
+
+
+def test_filters_to_query_exact_strings():
+    descriptor = {'fields': [
+        {'name': 'name', 'type': 'string'},
+        {'name': 'tags', 'type': 'array', 'es:itemType': 'string'},
+        {'name': 'address', 'type': 'object', 'es:schema': {'fields': [
+            {'name': 'city', 'type': 'string'},
+        ]}},
+    ]}
+    assert mappers.filters_to_query({
+        'name': 'row-1',
+        'tags': ['a', 'b'],
+        'address.city': {'gte': 'M'},
+    }, descriptor) == {'bool': {'filter': [
+        {'range': {'address.city.keyword': {'gte': 'M'}}},
+        {'term': {'name.keyword': 'row-1'}},
+        {'terms': {'tags.keyword': ['a', 'b']}},
+    ]}}
+
+
+def test_filters_to_query_unknown_operator():
+    with pytest.raises(ValueError):
+        mappers.filters_to_query({'age': {'between': [1, 2]}})
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import socket
+from tableschema_elasticsearch import metrics
+
+
+# Tests
+
+def test_in_memory_collector():
+    collector = metrics.InMemoryCollector()
+    for seconds in [0.1, 0.3, 0.2]:
+        collector.timing('bulk.latency', seconds, {'index': 'first'})
+    collector.timing('bulk.latency', 0.4, {'index': 'second'})
+    collector.count('bulk.docs', 10, {'index': 'first'})
+    collector.count('bulk.docs', 5, {'index': 'second'})
+    assert collector.timings('bulk.latency', {'index': 'first'}) == [0.1, 0.3, 0.2]
+    assert collector.counts('bulk.docs', {'index': 'second'}) == 5
+    summary = collector.summary()
+    assert summary['counts'] == {'bulk.docs': 15}
+    latency = summary['timings']['bulk.latency']
+    assert latency['count'] == 4
+    assert latency['min'] == 0.1
+    assert latency['max'] == 0.4
+    assert latency['p50'] == 0.3
+    collector.reset()
+    assert collector.summary() == {'timings': {}, 'counts': {}}
+
+
+def test_timed_reports_every_item():
+    collector = metrics.InMemoryCollector()
+    with collector.timer('create'):
+        pass
+    assert list(collector.timed(iter([1, 2]), 'search.latency')) == [1, 2]
+    assert len(collector.timings('create')) == 1
+    # The last timing is the call which found the iterable exhausted
+    assert len(collector.timings('search.latency')) == 3
+
+
+def test_no_metrics():
+    assert list(metrics.NO_METRICS.timed([1, 2], 'search.latency')) == [1, 2]
+    with metrics.NO_METRICS.timer('create'):
+        pass
+
+
+def test_statsd_metrics():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(5)
+    statsd = metrics.StatsdMetrics('127.0.0.1', server.getsockname()[1], prefix='tse')
+    try:
+        statsd.timing('bulk.latency', 0.25, {'index': 'bucket'})
+        statsd.count('bulk.docs', 500)
+        assert server.recv(1024) == b'tse.bulk.latency:250.000|ms|#index:bucket'
+        assert server.recv(1024) == b'tse.bulk.docs:500|c'
+    finally:
+        statsd.close()
+        server.close()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import datetime
+import pytest
+from tableschema_elasticsearch import partitions
+
+
+# Fixtures
+
+DESCRIPTOR = {
+    'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'day', 'type': 'date'},
+    ],
+    'es:partitionField': 'day',
+}
+INDEX_NAMES = [
+    'events_20200101000000000000_abcdef12',
+    'events_partition_2026.01',
+    'events_partition_2026.02',
+    'events_partition_2026.03',
+]
+
+
+# Tests
+
+def test_get_partitioner():
+    assert partitions.get_partitioner('events', {'fields': []}) is None
+    partitioner = partitions.get_partitioner('events', DESCRIPTOR)
+    assert partitioner.field == 'day'
+
+
+@pytest.mark.parametrize('descriptor', [
+    dict(DESCRIPTOR, **{'es:partitionField': 'id'}),
+    dict(DESCRIPTOR, **{'es:partitionField': 'missing'}),
+    dict(DESCRIPTOR, **{'es:partitionPeriod': 'week'}),
+])
+def test_get_partitioner_invalid(descriptor):
+    with pytest.raises(ValueError):
+        partitions.get_partitioner('events', descriptor)
+
+
+def test_partitioner_index_name():
+    partitioner = partitions.get_partitioner('events', DESCRIPTOR)
+    assert partitioner.index_name({'day': '2026-02-14'}) == 'events_partition_2026.02'
+    assert partitioner.index_name({'day': datetime.date(2026, 3, 1)}) == \
+        'events_partition_2026.03'
+    with pytest.raises(ValueError):
+        partitioner.index_name({'day': None})
+    daily = partitions.get_partitioner('events', dict(DESCRIPTOR, **{
+        'es:partitionPeriod': 'day'}))
+    assert daily.index_name({'day': '2026-02-14'}) == 'events_partition_2026.02.14'
+
+
+def test_partitioner_select():
+    partitioner = partitions.get_partitioner('events', DESCRIPTOR)
+    assert partitioner.select(INDEX_NAMES, '2026-02-14') == ['events_partition_2026.02']
+    assert partitioner.select(INDEX_NAMES, ['2026-01-02', '2026-03-04']) == \
+        ['events_partition_2026.01', 'events_partition_2026.03']
+    assert partitioner.select(INDEX_NAMES, {'gte': '2026-02-01', 'lt': '2026-03-01'}) == \
+        ['events_partition_2026.02']
+    assert partitioner.select(INDEX_NAMES, {'gt': '2026-02-14'}) == \
+        ['events_partition_2026.02', 'events_partition_2026.03']
+    assert partitioner.select(INDEX_NAMES, {'gte': 'now-1d'}) == INDEX_NAMES[1:]
+
+
+def test_partitioner_older():
+    partitioner = partitions.get_partitioner('events', DESCRIPTOR)
+    assert partitioner.older(INDEX_NAMES, '2026-03-01') == \
+        ['events_partition_2026.01', 'events_partition_2026.02']
+    assert partitioner.older(INDEX_NAMES, datetime.date(2026, 2, 14)) == \
+        ['events_partition_2026.01']
+    with pytest.raises(ValueError):
+        partitioner.older(INDEX_NAMES, 'yesterday')
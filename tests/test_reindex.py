@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import pytest
+from mock import Mock
+from tableschema_elasticsearch import ReindexTask
+from tableschema_elasticsearch.reindex import reindex_body, task_status
+
+
+# Helpers
+
+def task_response(completed, created, total=100, failures=None):
+    response = {
+        'completed': completed,
+        'task': {'status': {'total': total, 'created': created},
+                 'running_time_in_nanos': 2 * 10 ** 9},
+    }
+    if completed:
+        response['response'] = {'failures': failures or []}
+    return response
+
+
+# Tests
+
+def test_task_status():
+    status = task_status(task_response(False, 40))
+    assert status == {'completed': False, 'total': 100, 'processed': 40,
+                      'remaining': 60, 'docs_per_second': 20.0, 'elapsed': 2.0}
+
+
+def test_reindex_task_wait_finishes_migration():
+    es = Mock()
+    es.tasks.get.side_effect = [task_response(False, 40), task_response(True, 100)]
+    task = ReindexTask(es, 'node:1', 'new', ['old-1', 'old-2'])
+    assert task.wait(poll_interval=0)['remaining'] == 0
+    assert task.done
+    es.indices.flush.assert_called_once_with(index='new')
+    assert [c[1]['index'] for c in es.indices.delete.call_args_list] == ['old-1', 'old-2']
+    # Finished tasks are not polled again
+    assert task.status()['completed']
+    assert es.tasks.get.call_count == 2
+
+
+def test_reindex_task_keeps_sources_on_failure():
+    es = Mock()
+    es.tasks.get.return_value = task_response(True, 90, failures=[{'cause': 'boom'}])
+    task = ReindexTask(es, 'node:1', 'new', ['old'])
+    with pytest.raises(RuntimeError):
+        task.wait(poll_interval=0)
+    assert not task.done
+    es.indices.delete.assert_not_called()
+
+
+def test_reindex_task_deletes_created_destination_on_failure():
+    es = Mock()
+    es.tasks.get.return_value = task_response(True, 90, failures=[{'cause': 'boom'}])
+    on_finish = Mock()
+    task = ReindexTask(es, 'node:1', 'new', ['old'], on_finish=on_finish,
+                       delete_on_failure=True)
+    with pytest.raises(RuntimeError):
+        task.wait(poll_interval=0)
+    es.indices.delete.assert_called_once_with(index='new', ignore_unavailable=True)
+    on_finish.assert_called_once_with()
+
+
+def test_reindex_task_switches_alias_before_deleting_sources():
+    es = Mock()
+    es.tasks.get.return_value = task_response(True, 100)
+    task = ReindexTask(es, 'node:1', 'new', ['old'], alias='bucket')
+    task.wait(poll_interval=0)
+    es.indices.update_aliases.assert_called_once_with(body={'actions': [
+        {'add': {'index': 'new', 'alias': 'bucket'}},
+        {'remove': {'index': 'old', 'alias': 'bucket'}},
+    ]})
+    calls = [name for name, args, kwargs in es.mock_calls]
+    assert calls.index('indices.update_aliases') < calls.index('indices.delete')
+
+
+def test_reindex_body_routes_by_routing_key():
+    assert 'script' not in reindex_body(['old'], 'new')
+    body = reindex_body(['old'], 'new', routing_key='tenant')
+    assert body['dest'] == {'index': 'new', 'version_type': 'external'}
+    assert body['script']['params'] == {'key': 'tenant'}
@@ -6,14 +6,16 @@ from __future__ import unicode_literals
 
 import six
 import json
+import datetime
 import io
 import time
 import pytest
 import logging
+from mock import Mock
 from tabulator import Stream
 from elasticsearch import Elasticsearch
 from elasticsearch.exceptions import RequestError
-from tableschema_elasticsearch import Storage
+from tableschema_elasticsearch import Storage, InMemoryCollector
 
 
 # Tests
@@ -129,8 +131,8 @@ def test_basic_flow():
     assert sorted(list(storage.buckets)) == ['unit-tests-articles', 'unit-tests-comments']
 
     # Assert descriptors
-    # assert storage.describe('articles') == sync_descriptor(articles_descriptor)
-    # assert storage.describe('comments') == sync_descriptor(comments_descriptor)
+    assert storage.describe('unit-tests-articles') == articles_descriptor
+    assert storage.describe('unit-tests-comments') == comments_descriptor
 
     # Assert rows
     print(storage.read('unit-tests-articles'))
@@ -182,3 +184,265 @@ def test_es_instance():
         assert repr(storage) == "Storage <Elasticsearch([{u'host': u'localhost'}])>"
     else:
         assert repr(storage) == "Storage <Elasticsearch([{'host': 'localhost'}])>"
+
+
+def test_iter_paging():
+    '''Rows are paged through a point in time snapshot'''
+    descriptor = {
+        'fields': [{'name': 'id', 'type': 'integer'},
+                   {'name': 'name', 'type': 'string'},
+                   {'name': 'day', 'type': 'date'}],
+        'primaryKey': ['id'],
+    }
+    rows = [{'id': i, 'name': 'row-{}'.format(i),
+             'day': '2020-{:02d}-{:02d}'.format(i // 28 + 1, i % 28 + 1)}
+            for i in range(250)]
+
+    engine = Elasticsearch()
+    storage = Storage(engine)
+    storage.delete()
+    storage.create('unit-tests-paging', descriptor)
+    list(storage.write('unit-tests-paging', rows, descriptor['primaryKey']))
+
+    assert sorted(storage.read('unit-tests-paging', page_size=7),
+                  key=lambda x: x['id']) == rows
+    assert len(list(storage.iter('unit-tests-paging', page_size=1000))) == len(rows)
+
+    # Sliced parallel reads
+    assert sorted(storage.read('unit-tests-paging', page_size=10, slices=3),
+                  key=lambda x: x['id']) == rows
+    ordered = storage.read('unit-tests-paging', page_size=10, slices=3, ordered=True)
+    assert ordered == storage.read('unit-tests-paging', page_size=10, slices=3, ordered=True)
+
+    # Projection and filters (integer fields are not indexed by the default mapping)
+    assert sorted(storage.read('unit-tests-paging', fields=['id'],
+                               filters={'day': {'gte': '2020-01-11', 'lt': '2020-01-14'}}),
+                  key=lambda x: x['id']) == [{'id': 10}, {'id': 11}, {'id': 12}]
+    # String equality is exact, not phrase containment
+    assert storage.read('unit-tests-paging', fields=['id'],
+                        filters={'name': 'row-1'}) == [{'id': 1}]
+    assert storage.read('unit-tests-paging', filters={'name': 'row 1'}) == []
+
+    # A rejected search does not switch later reads to a scroll
+    with pytest.raises(RequestError):
+        storage.read('unit-tests-paging', filters={'day': 'not-a-date'})
+    engine.open_point_in_time = Mock(wraps=engine.open_point_in_time)
+    assert len(storage.read('unit-tests-paging')) == len(rows)
+    assert engine.open_point_in_time.call_count == 1
+
+    storage.delete()
+
+
+def test_iter_many_partitions():
+    '''Partitions too many to be listed in a URL are read through the bucket'''
+    descriptor = {
+        'fields': [{'name': 'id', 'type': 'integer'}, {'name': 'day', 'type': 'date'}],
+        'primaryKey': ['id'],
+        'es:partitionField': 'day',
+        'es:partitionPeriod': 'day',
+    }
+    start = datetime.date(2026, 1, 1)
+    rows = [{'id': i, 'day': (start + datetime.timedelta(days=i)).isoformat()}
+            for i in range(100)]
+
+    engine = Elasticsearch()
+    storage = Storage(engine)
+    storage.delete()
+    storage.create('unit-tests-partitions', descriptor)
+    list(storage.write('unit-tests-partitions', rows, descriptor['primaryKey']))
+    assert len(engine.indices.get_alias(name='unit-tests-partitions')) > 100
+
+    selected = storage.read('unit-tests-partitions',
+                            filters={'day': {'gte': '2026-01-02', 'lt': '2026-04-01'}})
+    assert sorted(row['id'] for row in selected) == list(range(1, 90))
+
+    storage.delete()
+
+
+def test_read_table():
+    '''Rows are read into typed columns, page by page'''
+    pyarrow = pytest.importorskip('pyarrow')
+    descriptor = {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'name', 'type': 'string'},
+            {'name': 'score', 'type': 'number'},
+        ],
+        'primaryKey': ['id'],
+    }
+    rows = [{'id': i, 'name': 'row-%d' % i, 'score': i / 2} for i in range(30)]
+
+    engine = Elasticsearch()
+    storage = Storage(engine)
+    storage.delete()
+    storage.create('unit-tests-columnar', descriptor)
+    list(storage.write('unit-tests-columnar', rows, descriptor['primaryKey']))
+
+    batches = list(storage.iter_batches('unit-tests-columnar', descriptor, page_size=7))
+    assert [batch.num_rows for batch in batches] == [7, 7, 7, 7, 2]
+    table = storage.read_table('unit-tests-columnar', descriptor)
+    assert table.schema.types == [pyarrow.int64(), pyarrow.string(), pyarrow.float64()]
+    assert sorted(table.to_pylist(), key=lambda x: x['id']) == rows
+
+    storage.delete()
+
+
+def test_get_many():
+    '''Rows are fetched by primary key with batched mget requests'''
+    descriptor = {
+        'fields': [{'name': 'id', 'type': 'integer'}, {'name': 'name', 'type': 'string'}],
+        'primaryKey': ['id'],
+    }
+    rows = [{'id': i, 'name': 'row-%d' % i} for i in range(50)]
+
+    engine = Elasticsearch()
+    storage = Storage(engine)
+    storage.delete()
+    storage.create('unit-tests-get-many', descriptor)
+    list(storage.write('unit-tests-get-many', rows, descriptor['primaryKey']))
+
+    keys = [42, 7, 1000, 7]
+    assert storage.get_many('unit-tests-get-many', keys, ['id'], batch_size=2) == \
+        [rows[42], rows[7], None, rows[7]]
+    assert storage.get_many('unit-tests-get-many', [{'id': 3}], ['id'], fields=['name']) == \
+        [{'name': 'row-3'}]
+
+    # Cached lookups are invalidated by writes
+    assert storage.get_many('unit-tests-get-many', [(1,)], ['id'], cache=True) == [rows[1]]
+    list(storage.write('unit-tests-get-many', [{'id': 1, 'name': 'new'}], ['id']))
+    assert storage.get_many('unit-tests-get-many', [(1,)], ['id'], cache=True) == \
+        [{'id': 1, 'name': 'new'}]
+
+    storage.delete()
+
+
+def test_write_concurrency():
+    '''Concurrent bulk writes acknowledge rows in their original order'''
+    descriptor = {
+        'fields': [{'name': 'id', 'type': 'integer'}],
+        'primaryKey': ['id'],
+    }
+    rows = [{'id': i} for i in range(1000)]
+
+    engine = Elasticsearch()
+    storage = Storage(engine)
+    storage.delete()
+    storage.create('unit-tests-concurrency', descriptor)
+    written = list(storage.write('unit-tests-concurrency', iter(rows),
+                                 descriptor['primaryKey'], as_generator=True,
+                                 chunk_size=50, concurrency=4, refresh='wait_for'))
+    assert written == rows
+
+    assert sorted(storage.read('unit-tests-concurrency'), key=lambda x: x['id']) == rows
+
+    storage.delete()
+
+
+def test_write_with_metrics():
+    '''Collecting metrics does not change how rows are serialized'''
+    numpy = pytest.importorskip('numpy')
+    descriptor = {
+        'fields': [{'name': 'id', 'type': 'integer'}],
+        'primaryKey': ['id'],
+    }
+    rows = [{'id': numpy.int64(i)} for i in range(10)]
+
+    engine = Elasticsearch()
+    metrics = InMemoryCollector()
+    storage = Storage(engine, metrics=metrics)
+    storage.delete()
+    storage.create('unit-tests-metrics', descriptor)
+    list(storage.write('unit-tests-metrics', rows, descriptor['primaryKey']))
+
+    assert sorted(storage.read('unit-tests-metrics'), key=lambda x: x['id']) == \
+        [{'id': i} for i in range(10)]
+    assert metrics.summary()['counts']['bulk.docs'] == 10
+
+    storage.delete()
+
+
+def test_bulk_load():
+    '''Ingest settings are applied during a bulk load and restored afterwards'''
+    descriptor = {
+        'fields': [{'name': 'id', 'type': 'integer'}],
+        'primaryKey': ['id'],
+    }
+
+    engine = Elasticsearch()
+    storage = Storage(engine)
+    storage.delete()
+    storage.create('unit-tests-bulk-load', descriptor,
+                   index_settings={'refresh_interval': '30s'})
+
+    def settings():
+        result = engine.indices.get_settings(index='unit-tests-bulk-load', flat_settings=True)
+        return list(result.values())[0]['settings']
+
+    def rows():
+        assert settings()['index.refresh_interval'] == '-1'
+        assert settings()['index.number_of_replicas'] == '0'
+        for i in range(10):
+            yield {'id': i}
+        raise ValueError('source failed')
+
+    with pytest.raises(ValueError):
+        list(storage.write('unit-tests-bulk-load', rows(), descriptor['primaryKey'],
+                           bulk_load=True))
+    assert settings()['index.refresh_interval'] == '30s'
+    assert settings()['index.number_of_replicas'] == '1'
+
+    storage.delete()
+
+
+def test_blue_green_recreate():
+    '''A recreated bucket keeps serving the old rows until the alias is swapped'''
+    descriptor = {
+        'fields': [{'name': 'id', 'type': 'integer'}],
+        'primaryKey': ['id'],
+    }
+
+    engine = Elasticsearch()
+    storage = Storage(engine, refresh='refresh')
+    storage.delete()
+    storage.create('unit-tests-blue-green', descriptor)
+    list(storage.write('unit-tests-blue-green', [{'id': 1}], descriptor['primaryKey']))
+
+    index_name = storage.create('unit-tests-blue-green', descriptor,
+                                always_recreate=True, blue_green=True)
+    list(storage.write(index_name, [{'id': 2}, {'id': 3}], descriptor['primaryKey']))
+    assert storage.read('unit-tests-blue-green') == [{'id': 1}]
+
+    storage.swap_alias('unit-tests-blue-green', index_name)
+    assert list(engine.indices.get_alias(name='unit-tests-blue-green')) == [index_name]
+    assert sorted(storage.read('unit-tests-blue-green'), key=lambda x: x['id']) == [
+        {'id': 2}, {'id': 3}]
+
+    storage.delete()
+
+
+def test_create_confirms_cache_misses():
+    '''A bucket created by another client since the cache was loaded is not created twice'''
+    descriptor = {'fields': [{'name': 'id', 'type': 'integer'}]}
+
+    engine = Elasticsearch()
+    storage = Storage(engine)
+    storage.delete()
+    list(storage.buckets)
+    Storage(engine).create('unit-tests-shared', descriptor)
+    storage.create('unit-tests-shared', descriptor)
+    assert len(engine.indices.get_alias(name='unit-tests-shared')) == 1
+
+    storage.delete()
+
+
+def test_delete_confirms_cache_misses():
+    '''A bucket created by another client since the cache was loaded is deleted'''
+    descriptor = {'fields': [{'name': 'id', 'type': 'integer'}]}
+
+    engine = Elasticsearch()
+    storage = Storage(engine)
+    storage.delete()
+    list(storage.buckets)
+    Storage(engine).create('unit-tests-shared', descriptor)
+    storage.delete('unit-tests-shared')
+    assert not engine.indices.exists_alias(name='unit-tests-shared')